@@ -1,13 +1,21 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+import asyncio
 import uvicorn
 import os
 
 from database import SessionLocal, engine, Base
 from routers import auth, users, rooms, sessions, admin, game, llm_config, audio, games, facilitator, player
 from models import User, Room, GameSession, Scenario
+from services.llm_registry import llm_registry
+from services.llm_usage import run_usage_flusher, flush_llm_usage
+from services.idempotency import run_idempotency_purger
+from services.speech_pipeline import shutdown_decode_pool
+from services.recordings_retention import run_recordings_sweeper, RECORDINGS_SWEEP_ENABLED
+from services.file_service import UPLOAD_MAX_REQUEST_BYTES
 
 # Criar tabelas
 Base.metadata.create_all(bind=engine)
@@ -18,6 +26,33 @@ app = FastAPI(
     version="1.0.0"
 )
 
+class UploadSizeLimitMiddleware:
+    """Recusa com 413, antes de ler o corpo, uploads multipart com Content-Length acima de UPLOAD_MAX_REQUEST_BYTES
+    (ASGI puro: não interfere nas respostas em streaming)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            content_length = headers.get(b"content-length", b"")
+            if (
+                headers.get(b"content-type", b"").startswith(b"multipart/form-data")
+                and content_length.isdigit()
+                and int(content_length) > UPLOAD_MAX_REQUEST_BYTES
+            ):
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"Upload excede o limite de {UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB"},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+# Adicionado antes do CORS para que a resposta 413 também receba os cabeçalhos CORS
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS
 origins_env = os.getenv("CORS_ORIGINS")
 allow_origins = [
@@ -53,6 +88,52 @@ app.include_router(player.router, prefix="/api/player", tags=["Jogador"])
 async def root():
     return {"message": "Plataforma de Jogo Online Multiagentes API"}
 
+@app.on_event("startup")
+async def start_usage_flusher():
+    # Grava periodicamente o uso das LLMs acumulado no worker
+    app.state.usage_flusher = asyncio.create_task(run_usage_flusher())
+
+@app.on_event("startup")
+async def start_idempotency_purger():
+    # Remove periodicamente as Idempotency-Keys expiradas
+    app.state.idempotency_purger = asyncio.create_task(run_idempotency_purger())
+
+@app.on_event("startup")
+async def start_recordings_sweeper():
+    # Remove periodicamente as gravações expiradas (um worker por vez, via lock no volume)
+    if RECORDINGS_SWEEP_ENABLED:
+        app.state.recordings_sweeper = asyncio.create_task(run_recordings_sweeper())
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    # Fecha os pools de conexão HTTP dos clientes de LLM
+    await llm_registry.aclose()
+
+@app.on_event("shutdown")
+async def stop_usage_flusher():
+    # Grava o que restou no buffer antes de encerrar o worker
+    flusher = getattr(app.state, "usage_flusher", None)
+    if flusher is not None:
+        flusher.cancel()
+    await asyncio.to_thread(flush_llm_usage)
+
+@app.on_event("shutdown")
+async def stop_decode_pool():
+    # Encerra os processos de decodificação de áudio
+    shutdown_decode_pool()
+
+@app.on_event("shutdown")
+async def stop_idempotency_purger():
+    purger = getattr(app.state, "idempotency_purger", None)
+    if purger is not None:
+        purger.cancel()
+
+@app.on_event("shutdown")
+async def stop_recordings_sweeper():
+    sweeper = getattr(app.state, "recordings_sweeper", None)
+    if sweeper is not None:
+        sweeper.cancel()
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy"}
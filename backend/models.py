@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Float, Enum as SQLEnum, Index, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Float, LargeBinary, Enum as SQLEnum, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -12,6 +12,8 @@ class UserRole(str, enum.Enum):
 class LLMProvider(str, enum.Enum):
     OPENAI = "openai"
     ANTHROPIC = "anthropic"
+    # Provider simulado, sem rede (testes de carga e benchmarks)
+    LOCAL = "local"
 
 class User(Base):
     __tablename__ = "users"
@@ -79,6 +81,7 @@ class Game(Base):
     description = Column(Text)
     cover_image_url = Column(String)
     is_active = Column(Boolean, default=True)
+    content_version = Column(Integer, nullable=False, default=0, server_default="0")  # Incrementada a cada alteração de regras ou cenas
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -100,12 +103,31 @@ class Scenario(Base):
     file_content = Column(Text)  # Conteúdo extraído do arquivo
     phase = Column(Integer, default=1)
     order = Column(Integer, default=0)
+    segment_count = Column(Integer)  # Quantidade de trechos pré-calculados (NULL = ainda não segmentado)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     game = relationship("Game", back_populates="scenarios")
     session_scenarios = relationship("SessionScenario", back_populates="scenario")
+    segments = relationship("ScenarioSegment", back_populates="scenario", cascade="all, delete-orphan", order_by="ScenarioSegment.position")
+
+class ScenarioSegment(Base):
+    __tablename__ = "scenario_segments"
+
+    __table_args__ = (
+        UniqueConstraint("scenario_id", "position", name="uq_scenario_segments_scenario_position"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scenario_id = Column(Integer, ForeignKey("scenarios.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)  # Trecho já sanitizado (sem blocos "não exibir ao jogador")
+    start_offset = Column(Integer, nullable=False)  # Posição do trecho no texto sanitizado da cena
+    end_offset = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    scenario = relationship("Scenario", back_populates="segments")
 
 class GameSession(Base):
     __tablename__ = "game_sessions"
@@ -128,12 +150,18 @@ class GameSession(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     last_activity = Column(DateTime(timezone=True), server_default=func.now())
+    # Perfil dos jogadores (nomes, idades, quantidade) mantido a cada mensagem
+    player_profile = Column(JSON)
+    # Resumo dos turnos antigos e último turno já incorporado a ele
+    memory_summary = Column(Text)
+    memory_summary_until_id = Column(Integer)
     
     game = relationship("Game", back_populates="sessions")
     player = relationship("User", back_populates="sessions")
     room = relationship("Room", back_populates="sessions")
     interactions = relationship("SessionInteraction", back_populates="session")
     scenarios = relationship("SessionScenario", back_populates="session")
+    narrative_state = relationship("SessionNarrativeState", back_populates="session", uselist=False)
 
 class SessionInteraction(Base):
     __tablename__ = "session_interactions"
@@ -149,10 +177,40 @@ class SessionInteraction(Base):
     tokens_used = Column(Integer)
     cost = Column(Float)
     response_time = Column(Float)
+    first_token_time = Column(Float)  # Tempo até o primeiro trecho (respostas em streaming)
+    extracted_features = Column(JSON)  # Dados de perfil extraídos desta mensagem
+    prompt_sections = Column(JSON)  # Tamanho de cada seção do prompt de sistema (caracteres/tokens estimados)
+    cache_read_tokens = Column(Integer)  # Tokens do prefixo lidos do cache de prompt do provider
+    cache_write_tokens = Column(Integer)  # Tokens do prefixo gravados no cache de prompt do provider
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # id e created_at retornados no próprio INSERT (RETURNING), sem refresh depois do commit
+    __mapper_args__ = {"eager_defaults": True}
     
     session = relationship("GameSession", back_populates="interactions")
 
+class SessionNarrativeState(Base):
+    __tablename__ = "session_narrative_states"
+
+    __table_args__ = (
+        UniqueConstraint("session_id", name="uq_session_narrative_states_session_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("game_sessions.id"), nullable=False)
+    scenario_id = Column(Integer, ForeignKey("scenarios.id"))
+    segment_index = Column(Integer, default=0)
+    selected_element = Column(String)
+    decision_history = Column(JSON, default=list)  # transições de cena (turno, cena, motivo, elemento)
+    turn_count = Column(Integer, default=0)
+    version = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __mapper_args__ = {"version_id_col": version}
+
+    session = relationship("GameSession", back_populates="narrative_state")
+
 class SessionScenario(Base):
     __tablename__ = "session_scenarios"
     
@@ -178,13 +236,35 @@ class PlayerBoard(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("game_sessions.id"), nullable=False)
     player_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    board_state = Column(JSON, default=dict)
+    board_state = Column(JSON, default=dict)  # snapshot de tamanho fixo: ordem, vez e contagens por jogador
+    version = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    # Compare-and-set pela versão: duas rolagens simultâneas não sobrescrevem o snapshot uma da outra
+    __mapper_args__ = {"version_id_col": version}
+
     session = relationship("GameSession")
     player = relationship("User")
 
+class PlayerBoardEvent(Base):
+    """Histórico das rolagens de um tabuleiro (só inserção; o snapshot fica em PlayerBoard.board_state)"""
+    __tablename__ = "player_board_events"
+
+    __table_args__ = (
+        Index("ix_player_board_events_board_id_id", "board_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    board_id = Column(Integer, ForeignKey("player_boards.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("game_sessions.id"), nullable=False)
+    slot = Column(Integer, nullable=False)
+    element = Column(String, nullable=False)
+    effect = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    board = relationship("PlayerBoard")
+
 class GameRule(Base):
     __tablename__ = "game_rules"
     
@@ -219,6 +299,12 @@ class LLMConfiguration(Base):
     total_tokens = Column(Integer, default=0)
     total_cost = Column(Float, default=0.0)
     avg_response_time = Column(Float, default=0.0)
+    # Respostas servidas pelo cache de narração (sem chamada à LLM)
+    cache_hits = Column(Integer, default=0)
+    cache_saved_tokens = Column(Integer, default=0)
+    # Tokens de entrada lidos/gravados no cache de prompt do provider
+    total_cache_read_tokens = Column(Integer, default=0)
+    total_cache_write_tokens = Column(Integer, default=0)
     
     game = relationship("Game", back_populates="llm_configs")
 
@@ -235,6 +321,80 @@ class LLMTestResult(Base):
     quality_score = Column(Float)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class LLMUsageRollup(Base):
+    """Uso agregado de uma configuração num intervalo de gravação de um worker (só inserção)"""
+    __tablename__ = "llm_usage_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    llm_config_id = Column(Integer, ForeignKey("llm_configurations.id"), nullable=False)
+    period_start = Column(DateTime(timezone=True), nullable=False)
+    period_end = Column(DateTime(timezone=True), nullable=False)
+    requests = Column(Integer, default=0)
+    failures = Column(Integer, default=0)
+    tokens_used = Column(Integer, default=0)
+    cost = Column(Float, default=0.0)
+    cache_read_tokens = Column(Integer, default=0)
+    cache_write_tokens = Column(Integer, default=0)
+    cache_hits = Column(Integer, default=0)
+    cache_saved_tokens = Column(Integer, default=0)
+    latency_sum = Column(Float, default=0.0)
+    # Contagem de chamadas por faixa de latência (limites em services/llm_usage.LATENCY_BUCKETS)
+    latency_histogram = Column(JSON)
+
+    __table_args__ = (
+        Index("ix_llm_usage_rollups_config_period", "llm_config_id", "period_end"),
+    )
+
+class LLMResponseCache(Base):
+    """Camada compartilhada do cache de respostas de narração (chave semântica do turno)"""
+    __tablename__ = "llm_response_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    provider = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    tokens_used = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class TTSAudioCache(Base):
+    """Camada compartilhada do cache de síntese de voz (mp3 pelo digest de texto, idioma, voz e motor)"""
+    __tablename__ = "tts_audio_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    audio = Column(LargeBinary, nullable=False)
+    size_bytes = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IdempotencyKey(Base):
+    """Chave Idempotency-Key de uma requisição de interação: repetições devolvem a resposta gravada"""
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 do endpoint e do corpo da requisição: a mesma chave com outro conteúdo é rejeitada
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(String, nullable=False, default="in_progress")  # in_progress, completed
+    # Sem FK: a resposta fica gravada aqui e a repetição não depende da interação ainda existir
+    interaction_id = Column(Integer)
+    response = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+
+class SessionTurnLease(Base):
+    """Vez de uma sessão entre workers: o worker dono do token processa o turno até liberar ou a concessão expirar"""
+    __tablename__ = "session_turn_leases"
+
+    # Sem FK: a linha vive só durante o turno e não impede remover a sessão
+    session_id = Column(Integer, primary_key=True)
+    token = Column(String(32), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
 class InvitationStatus(str, enum.Enum):
     PENDING = "pending"
     ACCEPTED = "accepted"
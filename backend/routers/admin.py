@@ -1,16 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+import asyncio
 from pydantic import BaseModel, EmailStr
 from database import get_db
-from models import User, Game, GameRule, Scenario, LLMConfiguration, GameSession, SessionInteraction, LLMTestResult, Invitation, InvitationStatus, UserRole, FacilitatorPlayer, Room, RoomMember, SessionScenario, PlayerGameAccess, FacilitatorGameAccess, InvitationGame
-from schemas import GameCreate, GameResponse, GameRuleCreate, GameRuleResponse, ScenarioCreate, ScenarioResponse, LLMConfigCreate, LLMConfigUpdate, LLMConfigResponse, LLMTestRequest, LLMTestResponse, SessionStats, LLMStats, InvitationCreate, InvitationResponse, UserResponse, PlayerGameAccessResponse, FacilitatorGameAccessResponse
+from models import User, Game, GameRule, Scenario, LLMConfiguration, GameSession, SessionInteraction, LLMTestResult, LLMUsageRollup, Invitation, InvitationStatus, UserRole, FacilitatorPlayer, Room, RoomMember, SessionScenario, PlayerGameAccess, FacilitatorGameAccess, InvitationGame, SessionNarrativeState, ScenarioSegment, PlayerBoard, PlayerBoardEvent
+from schemas import GameCreate, GameResponse, GameRuleCreate, GameRuleResponse, ScenarioCreate, ScenarioResponse, LLMConfigCreate, LLMConfigUpdate, LLMConfigResponse, LLMTestRequest, LLMTestResponse, SessionStats, LLMStats, AudioCacheStats, StorageStats, InvitationCreate, InvitationResponse, UserResponse, PlayerGameAccessResponse, FacilitatorGameAccessResponse
 from services.email_service import EmailService
 from auth import get_current_admin_user, get_password_hash
 from services.llm_service import LLMService
-from services.file_service import FileService
+from services.file_service import FileService, UploadTooLargeError
+from services.narrative_service import ScenarioSegmentStore
+from services.game_catalog import bump_game_content_version, forget_game_catalog
+from services.llm_registry import llm_registry
+from services.llm_router import llm_router
+from services.llm_usage import usage_rollup
+from services.audio_service import AudioService
+from services.tts_cache import tts_cache, disk_usage, TTS_CACHE_SHARED
+from services.recordings_retention import storage_usage, sweep_recordings
 
 router = APIRouter()
 
@@ -64,12 +73,13 @@ async def create_game(
     # Processar upload da imagem de capa
     if cover_image and cover_image.filename:
         try:
-            file_data = await cover_image.read()
             file_service = FileService()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"game_cover_{timestamp}_{cover_image.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="game_cover")
+            file_path = await file_service.save_upload_stream(cover_image, filename, file_type="game_cover")
             cover_image_url = file_service.get_file_url(file_path, file_type="game_cover")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
     
@@ -212,12 +222,13 @@ async def update_game(
     # Processar upload da imagem de capa se fornecido
     if cover_image and cover_image.filename:
         try:
-            file_data = await cover_image.read()
             file_service = FileService()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"game_cover_{timestamp}_{cover_image.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="game_cover")
+            file_path = await file_service.save_upload_stream(cover_image, filename, file_type="game_cover")
             game.cover_image_url = file_service.get_file_url(file_path, file_type="game_cover")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
     
@@ -250,6 +261,7 @@ async def delete_game(
         # Deletar LLM test results relacionados às configurações
         if llm_config_ids:
             db.query(LLMTestResult).filter(LLMTestResult.llm_config_id.in_(llm_config_ids)).delete()
+            db.query(LLMUsageRollup).filter(LLMUsageRollup.llm_config_id.in_(llm_config_ids)).delete(synchronize_session=False)
         
         # Deletar LLM configurations
         db.query(LLMConfiguration).filter(LLMConfiguration.game_id == game_id).delete()
@@ -265,10 +277,24 @@ async def delete_game(
         # Deletar session scenarios relacionados às sessions
         if session_ids:
             db.query(SessionScenario).filter(SessionScenario.session_id.in_(session_ids)).delete()
+
+        # Deletar estado narrativo das sessions
+        if session_ids:
+            db.query(SessionNarrativeState).filter(SessionNarrativeState.session_id.in_(session_ids)).delete()
+
+        # Deletar histórico e tabuleiros dos jogadores
+        if session_ids:
+            db.query(PlayerBoardEvent).filter(PlayerBoardEvent.session_id.in_(session_ids)).delete(synchronize_session=False)
+            db.query(PlayerBoard).filter(PlayerBoard.session_id.in_(session_ids)).delete(synchronize_session=False)
         
         # Deletar game sessions
         db.query(GameSession).filter(GameSession.game_id == game_id).delete()
         
+        # Deletar trechos pré-calculados das cenas
+        scenario_ids = [row.id for row in db.query(Scenario.id).filter(Scenario.game_id == game_id).all()]
+        if scenario_ids:
+            db.query(ScenarioSegment).filter(ScenarioSegment.scenario_id.in_(scenario_ids)).delete(synchronize_session=False)
+
         # Deletar scenarios (que já tem cascade para session_scenarios)
         db.query(Scenario).filter(Scenario.game_id == game_id).delete()
         
@@ -278,6 +304,8 @@ async def delete_game(
         # Agora deletar o jogo
         db.delete(game)
         db.commit()
+        forget_game_catalog(game_id)
+        llm_registry.invalidate()
         
         return {"message": "Jogo deletado com sucesso"}
     except Exception as e:
@@ -328,6 +356,7 @@ async def create_game_rule(rule_data: GameRuleCreate, db: Session = Depends(get_
         created_by=current_user.id
     )
     db.add(db_rule)
+    bump_game_content_version(db, db_rule.game_id)
     db.commit()
     db.refresh(db_rule)
     return db_rule
@@ -368,13 +397,14 @@ async def upload_rule_file(
 
     try:
         file_service = FileService()
-        file_data = await file.read()
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         filename = f"rule_{timestamp}_{file.filename}"
-        file_path = await file_service.save_uploaded_file(file_data, filename, file_type="rule_file")
+        file_path = await file_service.save_upload_stream(file, filename, file_type="rule_file")
         file_content = await file_service.extract_text_from_file(file_path, file_ext)
         file_url = file_service.get_file_url(file_path, file_type="rule_file")
         return {"file_url": file_url, "file_content": file_content, "file_name": file.filename}
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
 
@@ -383,6 +413,7 @@ async def update_game_rule(rule_id: int, rule_data: GameRuleCreate, db: Session
     rule = db.query(GameRule).filter(GameRule.id == rule_id).first()
     if not rule:
         raise HTTPException(status_code=404, detail="Regra não encontrada")
+    bump_game_content_version(db, rule.game_id, rule_data.game_id)
     rule.game_id = rule_data.game_id
     rule.title = rule_data.title
     rule.description = rule_data.description
@@ -398,6 +429,7 @@ async def delete_game_rule(rule_id: int, db: Session = Depends(get_db), current_
     if not rule:
         raise HTTPException(status_code=404, detail="Regra não encontrada")
     rule.is_active = False
+    bump_game_content_version(db, rule.game_id)
     db.commit()
     return {"message": "Regra desativada com sucesso"}
 
@@ -455,11 +487,12 @@ async def create_scenario(
 
         try:
             file_service = FileService()
-            file_data = await image_file.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_image_{timestamp}_{image_file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="scenario_image")
+            file_path = await file_service.save_upload_stream(image_file, filename, file_type="scenario_image")
             image_url = file_service.get_file_url(file_path, file_type="scenario_image")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
 
@@ -473,11 +506,12 @@ async def create_scenario(
 
         try:
             file_service = FileService()
-            file_data = await video_file.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_video_{timestamp}_{video_file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="scenario_video")
+            file_path = await file_service.save_upload_stream(video_file, filename, file_type="scenario_video")
             video_url = file_service.get_file_url(file_path, file_type="scenario_video")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar vídeo: {str(e)}")
     
@@ -491,16 +525,17 @@ async def create_scenario(
         
         try:
             file_service = FileService()
-            file_data = await file.read()
             
             # Salvar arquivo
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_{timestamp}_{file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename)
+            file_path = await file_service.save_upload_stream(file, filename)
             
             # Extrair texto do arquivo
             file_content = await file_service.extract_text_from_file(file_path, file_ext)
             file_url = file_service.get_file_url(file_path)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
     
@@ -516,6 +551,10 @@ async def create_scenario(
         order=order
     )
     db.add(db_scenario)
+    db.flush()
+    # Segmentar a cena uma única vez, no upload
+    ScenarioSegmentStore(db).rebuild(db_scenario)
+    bump_game_content_version(db, game_id)
     db.commit()
     db.refresh(db_scenario)
     return db_scenario
@@ -566,12 +605,11 @@ async def update_scenario(
         
         try:
             file_service = FileService()
-            file_data = await file.read()
             
             # Salvar arquivo
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_{timestamp}_{file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename)
+            file_path = await file_service.save_upload_stream(file, filename)
             
             # Extrair texto do arquivo
             file_content = await file_service.extract_text_from_file(file_path, file_ext)
@@ -579,6 +617,9 @@ async def update_scenario(
             
             scenario.file_url = file_url
             scenario.file_content = file_content
+            ScenarioSegmentStore(db).rebuild(scenario)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
     
@@ -592,11 +633,12 @@ async def update_scenario(
 
         try:
             file_service = FileService()
-            file_data = await image_file.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_image_{timestamp}_{image_file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="scenario_image")
+            file_path = await file_service.save_upload_stream(image_file, filename, file_type="scenario_image")
             scenario.image_url = file_service.get_file_url(file_path, file_type="scenario_image")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
 
@@ -610,15 +652,17 @@ async def update_scenario(
 
         try:
             file_service = FileService()
-            file_data = await video_file.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"scenario_video_{timestamp}_{video_file.filename}"
-            file_path = await file_service.save_uploaded_file(file_data, filename, file_type="scenario_video")
+            file_path = await file_service.save_upload_stream(video_file, filename, file_type="scenario_video")
             scenario.video_url = file_service.get_file_url(file_path, file_type="scenario_video")
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar vídeo: {str(e)}")
 
     # Atualizar outros campos
+    bump_game_content_version(db, scenario.game_id, game_id)
     scenario.game_id = game_id
     scenario.name = name
     scenario.description = description
@@ -651,6 +695,10 @@ async def delete_scenario(
     db.query(GameSession).filter(GameSession.current_scenario_id == scenario_id).update(
         {"current_scenario_id": None}
     )
+    db.query(SessionNarrativeState).filter(SessionNarrativeState.scenario_id == scenario_id).update(
+        {"scenario_id": None, "segment_index": 0, "version": SessionNarrativeState.version + 1}
+    )
+    bump_game_content_version(db, scenario.game_id)
     db.delete(scenario)
     db.commit()
     return {"message": "Cena removida com sucesso"}
@@ -743,6 +791,7 @@ async def create_llm_config(config_data: LLMConfigCreate, db: Session = Depends(
     )
     db.add(db_config)
     db.commit()
+    llm_registry.invalidate()
     db.refresh(db_config)
     return db_config
 
@@ -786,6 +835,7 @@ async def update_llm_config(config_id: int, config_data: LLMConfigUpdate, db: Se
         config.temperature = config_data.temperature
     
     db.commit()
+    llm_registry.invalidate()
     db.refresh(config)
     return config
 
@@ -801,8 +851,10 @@ async def delete_llm_config(config_id: int, db: Session = Depends(get_db), curre
         if other_configs == 0:
             raise HTTPException(status_code=400, detail="Não é possível deletar a única configuração de LLM")
     
+    db.query(LLMUsageRollup).filter(LLMUsageRollup.llm_config_id == config_id).delete(synchronize_session=False)
     db.delete(config)
     db.commit()
+    llm_registry.invalidate()
     return {"message": "Configuração de LLM deletada com sucesso"}
 
 @router.post("/llm/test", response_model=LLMTestResponse)
@@ -840,14 +892,47 @@ async def test_llm(test_data: LLMTestRequest, db: Session = Depends(get_db), cur
         raise HTTPException(status_code=500, detail=f"Erro ao testar LLM: {error_detail}")
 
 @router.get("/llm/stats", response_model=List[LLMStats])
-async def get_llm_stats(db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+async def get_llm_stats(hours: int = 24, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+    # Totais acumulados na configuração; taxa de sucesso e percentis vêm das linhas de uso gravadas na janela (`hours`)
+    window = usage_rollup(db, datetime.now(timezone.utc) - timedelta(hours=max(1, hours)))
     configs = db.query(LLMConfiguration).all()
     stats = []
     for config in configs:
-        success_rate = 1.0 if config.total_requests > 0 else 0.0
-        stats.append(LLMStats(llm_config_id=config.id, provider=config.provider.value, model_name=config.model_name, total_requests=config.total_requests, total_tokens=config.total_tokens, total_cost=config.total_cost, avg_response_time=config.avg_response_time, success_rate=success_rate))
+        rollup = window.get(config.id, {})
+        cache_hits = config.cache_hits or 0
+        served = (config.total_requests or 0) + cache_hits
+        cache_hit_rate = cache_hits / served if served else 0.0
+        stats.append(LLMStats(
+            llm_config_id=config.id, provider=config.provider.value, model_name=config.model_name,
+            total_requests=config.total_requests or 0, total_tokens=config.total_tokens or 0, total_cost=config.total_cost or 0.0,
+            avg_response_time=config.avg_response_time or 0.0, success_rate=rollup.get("success_rate", 0.0),
+            cache_hits=cache_hits, cache_saved_tokens=config.cache_saved_tokens or 0, cache_hit_rate=cache_hit_rate,
+            total_cache_read_tokens=config.total_cache_read_tokens or 0, total_cache_write_tokens=config.total_cache_write_tokens or 0,
+            window_hours=max(1, hours), window_requests=rollup.get("window_requests", 0), window_failures=rollup.get("window_failures", 0),
+            latency_p50=rollup.get("latency_p50"), latency_p95=rollup.get("latency_p95"), latency_p99=rollup.get("latency_p99"),
+            circuit_state=llm_router.health_snapshot(config.id)["circuit_state"],
+        ))
     return stats
 
+@router.get("/audio/stats", response_model=AudioCacheStats)
+async def get_audio_stats(current_user: User = Depends(get_current_admin_user)):
+    # Acertos e faltas do cache de síntese de voz neste worker, mais o que está gravado em disco
+    usage = await asyncio.to_thread(disk_usage, AudioService().audio_output_dir)
+    return AudioCacheStats(**tts_cache.stats(), shared_enabled=TTS_CACHE_SHARED, **usage)
+
+@router.get("/storage", response_model=StorageStats)
+async def get_storage_stats(current_user: User = Depends(get_current_admin_user)):
+    # Uso do volume de gravações, arquivos ainda referenciados e o que a retenção já liberou
+    return StorageStats(**(await asyncio.to_thread(storage_usage)))
+
+@router.post("/storage/sweep")
+async def run_storage_sweep(dry_run: bool = True, current_user: User = Depends(get_current_admin_user)):
+    # Executa a coleta agora (por padrão só simula e informa o que seria removido)
+    result = await sweep_recordings(dry_run=dry_run)
+    if result.get("skipped"):
+        raise HTTPException(status_code=409, detail="Já existe uma coleta das gravações em andamento")
+    return result
+
 @router.get("/sessions")
 async def list_all_sessions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
     sessions = db.query(GameSession).offset(skip).limit(limit).all()
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pathlib import Path
 import os
 from services.audio_service import AudioService
+from services.tts_stream import load_manifest, stream_manifest, manifest_playlist
 
 router = APIRouter()
 
@@ -13,3 +14,25 @@ async def get_audio_file(filename: str):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Arquivo de áudio não encontrado")
     return FileResponse(str(file_path), media_type="audio/mpeg")
+
+@router.get("/stream/{manifest_id}")
+async def stream_audio(manifest_id: str):
+    """Narração em trechos como um único mp3 entregue aos poucos: a reprodução começa após a primeira frase"""
+    audio_service = AudioService()
+    manifest = load_manifest(audio_service.audio_output_dir, manifest_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Arquivo de áudio não encontrado")
+    return StreamingResponse(
+        stream_manifest(manifest, audio_service.audio_output_dir),
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/manifest/{manifest_id}")
+async def get_audio_manifest(manifest_id: str):
+    """Trechos da narração (playlist) para clientes que preferem baixar arquivo por arquivo"""
+    audio_service = AudioService()
+    manifest = load_manifest(audio_service.audio_output_dir, manifest_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Arquivo de áudio não encontrado")
+    return manifest_playlist(manifest)
@@ -7,6 +7,7 @@ from database import get_db
 from models import Game, User
 from schemas import GameCreate, GameResponse
 from auth import get_current_admin_user
+from services.file_service import FileService, UploadTooLargeError
 
 router = APIRouter()
 
@@ -29,22 +30,13 @@ async def create_game(
             raise HTTPException(status_code=400, detail=f"Formato de imagem não suportado. Use: {', '.join(allowed_extensions)}")
         
         try:
-            import os
-            import aiofiles
-            from pathlib import Path
-            
-            upload_dir = Path(os.getenv("GAME_COVERS_DIR", "./game_covers"))
-            upload_dir.mkdir(parents=True, exist_ok=True)
-            
-            file_data = await cover_image.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"game_{timestamp}_{cover_image.filename}"
-            file_path = upload_dir / filename
-            
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(file_data)
+            await FileService().save_upload_stream(cover_image, filename, file_type="game_cover")
             
             cover_image_url = f"/api/admin/games/covers/{filename}"
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
     
@@ -101,22 +93,13 @@ async def update_game(
             raise HTTPException(status_code=400, detail=f"Formato de imagem não suportado. Use: {', '.join(allowed_extensions)}")
         
         try:
-            import os
-            import aiofiles
-            from pathlib import Path
-            
-            upload_dir = Path(os.getenv("GAME_COVERS_DIR", "./game_covers"))
-            upload_dir.mkdir(parents=True, exist_ok=True)
-            
-            file_data = await cover_image.read()
             timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
             filename = f"game_{timestamp}_{cover_image.filename}"
-            file_path = upload_dir / filename
-            
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(file_data)
+            await FileService().save_upload_stream(cover_image, filename, file_type="game_cover")
             
             game.cover_image_url = f"/api/admin/games/covers/{filename}"
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
     
@@ -4,6 +4,7 @@ from typing import Optional
 from database import get_db
 from models import LLMConfiguration
 from schemas import LLMConfigResponse
+from services.llm_registry import llm_registry
 from auth import get_current_active_user, get_current_admin_user
 
 router = APIRouter()
@@ -40,4 +41,5 @@ async def activate_llm_config(config_id: int, db: Session = Depends(get_db), cur
     db.query(LLMConfiguration).filter(LLMConfiguration.game_id == config.game_id).update({"is_active": False})
     config.is_active = True
     db.commit()
+    llm_registry.invalidate()
     return {"message": "Configuração de LLM ativada com sucesso"}
@@ -76,9 +76,9 @@ async def delete_user(
     
     # Importar modelos necessários
     from models import (
-        GameSession, SessionInteraction, SessionScenario,
+        GameSession, SessionInteraction, SessionScenario, SessionNarrativeState, PlayerBoard, PlayerBoardEvent,
         RoomMember, FacilitatorPlayer, PlayerGameAccess, FacilitatorGameAccess,
-        Invitation, InvitationGame, Room, GameRule
+        Invitation, InvitationGame, Room, GameRule, IdempotencyKey
     )
     
     # 1. Deletar interações de sessões do usuário
@@ -90,9 +90,17 @@ async def delete_user(
         db.query(SessionInteraction).filter(SessionInteraction.session_id.in_(session_ids)).delete(synchronize_session=False)
         # Deletar SessionScenario
         db.query(SessionScenario).filter(SessionScenario.session_id.in_(session_ids)).delete(synchronize_session=False)
+        # Deletar SessionNarrativeState
+        db.query(SessionNarrativeState).filter(SessionNarrativeState.session_id.in_(session_ids)).delete(synchronize_session=False)
+        # Deletar histórico e tabuleiros (PlayerBoardEvent, PlayerBoard)
+        db.query(PlayerBoardEvent).filter(PlayerBoardEvent.session_id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(PlayerBoard).filter(PlayerBoard.session_id.in_(session_ids)).delete(synchronize_session=False)
         # Deletar GameSession
         db.query(GameSession).filter(GameSession.player_id == user_id).delete(synchronize_session=False)
     
+    # 1b. Deletar Idempotency-Keys do usuário
+    db.query(IdempotencyKey).filter(IdempotencyKey.user_id == user_id).delete(synchronize_session=False)
+
     # 2. Deletar RoomMember
     db.query(RoomMember).filter(RoomMember.user_id == user_id).delete(synchronize_session=False)
     
@@ -102,6 +102,8 @@ class InteractionCreate(BaseModel):
     player_input: str
     player_input_type: str = "text"
     include_audio_response: bool = False
+    # Id gerado pelo cliente para o pedido: um reenvio com o mesmo id enquanto o original está na fila é rejeitado
+    client_request_id: Optional[str] = None
 
 class InteractionResponse(BaseModel):
     id: int
@@ -120,6 +122,21 @@ class InteractionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BoardEventResponse(BaseModel):
+    id: int
+    slot: int
+    element: str
+    effect: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class BoardEventPage(BaseModel):
+    events: List[BoardEventResponse]
+    # Passar como before_id para buscar a página seguinte (mais antiga); None quando não há mais eventos
+    next_before_id: Optional[int] = None
+
 class ScenarioCreate(BaseModel):
     game_id: int
     name: str
@@ -237,6 +254,55 @@ class LLMStats(BaseModel):
     total_cost: float
     avg_response_time: float
     success_rate: float
+    cache_hits: int = 0
+    cache_saved_tokens: int = 0
+    cache_hit_rate: float = 0.0
+    total_cache_read_tokens: int = 0
+    total_cache_write_tokens: int = 0
+    # Janela das linhas de uso gravadas (todos os workers)
+    window_hours: int = 24
+    window_requests: int = 0
+    window_failures: int = 0
+    latency_p50: Optional[float] = None
+    latency_p95: Optional[float] = None
+    latency_p99: Optional[float] = None
+    # Disjuntor no worker que respondeu
+    circuit_state: str = "closed"
+
+class StorageDirectoryUsage(BaseModel):
+    name: str
+    path: str
+    ttl_hours: float
+    files: int
+    bytes: int
+    # Arquivos apontados por SessionInteraction.ai_response_audio_url (não expiram)
+    referenced_files: int
+    referenced_bytes: int
+
+class StorageStats(BaseModel):
+    directories: List[StorageDirectoryUsage]
+    volume_total_bytes: int
+    volume_used_bytes: int
+    volume_free_bytes: int
+    sweeper_enabled: bool
+    last_sweep: Optional[Dict[str, Any]] = None
+    total_deleted_files: int = 0
+    total_reclaimed_bytes: int = 0
+
+class AudioCacheStats(BaseModel):
+    # Contadores do worker que respondeu; o disco é o diretório de saída de áudio
+    disk_hits: int
+    shared_hits: int
+    misses: int
+    coalesced: int
+    errors: int
+    lookups: int
+    hit_rate: float
+    avg_synthesis_seconds: float
+    inflight: int
+    shared_enabled: bool
+    disk_entries: int
+    disk_bytes: int
 
 # Schemas para sistema de convites e facilitadores
 class InvitationCreate(BaseModel):
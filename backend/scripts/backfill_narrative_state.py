@@ -0,0 +1,56 @@
+"""
+Script de migração para criar o estado narrativo das sessões existentes.
+Reconstrói cena, trecho, elemento e decisões a partir das interações já gravadas.
+Execute uma única vez após criar a tabela session_narrative_states;
+sessões sem estado também são reconstruídas sob demanda na próxima interação.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine, Base
+from models import GameSession, Scenario, SessionNarrativeState
+from services.narrative_service import NarrativeEngine, NarrativeStateService
+
+# Garantir que todos os modelos estão configurados
+Base.metadata.create_all(bind=engine)
+
+def backfill_narrative_states():
+    db = SessionLocal()
+    try:
+        sessions = db.query(GameSession).outerjoin(
+            SessionNarrativeState, SessionNarrativeState.session_id == GameSession.id
+        ).filter(SessionNarrativeState.id == None).all()
+        print(f"Sessões sem estado narrativo: {len(sessions)}")
+
+        engines = {}
+        state_service = NarrativeStateService(db)
+        created = 0
+        for session in sessions:
+            if session.game_id not in engines:
+                scenarios = db.query(Scenario).filter(
+                    Scenario.game_id == session.game_id,
+                    Scenario.is_active == True
+                ).order_by(Scenario.phase, Scenario.order).all()
+                engines[session.game_id] = NarrativeEngine(scenarios)
+            narrative = engines[session.game_id]
+            current_scenario = narrative.scene_by_id(session.current_scenario_id)
+            base_scene = narrative.intro_scene() or current_scenario or (narrative.scenarios[0] if narrative.scenarios else None)
+            if not base_scene:
+                continue
+            state_service.backfill(session, narrative, base_scene)
+            created += 1
+
+        db.commit()
+        print(f"Estados narrativos criados: {created}")
+        print("Migração concluída com sucesso!")
+
+    except Exception as e:
+        db.rollback()
+        print(f"Erro durante a migração: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    backfill_narrative_states()
@@ -0,0 +1,40 @@
+"""
+Script de migração para pré-calcular os trechos das cenas existentes.
+Preenche scenario_segments e scenarios.segment_count a partir de file_content.
+Use --all para refazer também as cenas já segmentadas.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine, Base
+from models import Scenario
+from services.narrative_service import ScenarioSegmentStore
+
+# Garantir que todos os modelos estão configurados
+Base.metadata.create_all(bind=engine)
+
+def build_scenario_segments(rebuild_all: bool = False):
+    db = SessionLocal()
+    try:
+        query = db.query(Scenario)
+        if not rebuild_all:
+            query = query.filter(Scenario.segment_count == None)
+        scenarios = query.all()
+        store = ScenarioSegmentStore(db)
+        for scenario in scenarios:
+            count = store.rebuild(scenario)
+            print(f"{scenario.name}: {count} trechos")
+        db.commit()
+        print(f"Cenas segmentadas: {len(scenarios)}")
+        print("Migração concluída com sucesso!")
+
+    except Exception as e:
+        db.rollback()
+        print(f"Erro durante a migração: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    build_scenario_segments(rebuild_all="--all" in sys.argv)
@@ -0,0 +1,2 @@
+ALTER TABLE session_interactions
+ADD COLUMN IF NOT EXISTS first_token_time DOUBLE PRECISION;
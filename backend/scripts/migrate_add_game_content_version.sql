@@ -0,0 +1,2 @@
+ALTER TABLE games
+ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 0;
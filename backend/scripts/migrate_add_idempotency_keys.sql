@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    key VARCHAR(255) NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'in_progress',
+    interaction_id INTEGER,
+    response JSON,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL,
+    CONSTRAINT uq_idempotency_keys_user_key UNIQUE (user_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_id ON idempotency_keys (id);
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
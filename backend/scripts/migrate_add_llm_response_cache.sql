@@ -0,0 +1,17 @@
+ALTER TABLE llm_configurations
+ADD COLUMN IF NOT EXISTS cache_hits INTEGER DEFAULT 0;
+
+ALTER TABLE llm_configurations
+ADD COLUMN IF NOT EXISTS cache_saved_tokens INTEGER DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    provider VARCHAR NOT NULL,
+    model_name VARCHAR NOT NULL,
+    response TEXT NOT NULL,
+    tokens_used INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_llm_response_cache_expires_at ON llm_response_cache (expires_at);
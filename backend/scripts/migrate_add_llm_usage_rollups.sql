@@ -0,0 +1,19 @@
+CREATE TABLE IF NOT EXISTS llm_usage_rollups (
+    id SERIAL PRIMARY KEY,
+    llm_config_id INTEGER NOT NULL REFERENCES llm_configurations(id),
+    period_start TIMESTAMPTZ NOT NULL,
+    period_end TIMESTAMPTZ NOT NULL,
+    requests INTEGER DEFAULT 0,
+    failures INTEGER DEFAULT 0,
+    tokens_used INTEGER DEFAULT 0,
+    cost DOUBLE PRECISION DEFAULT 0,
+    cache_read_tokens INTEGER DEFAULT 0,
+    cache_write_tokens INTEGER DEFAULT 0,
+    cache_hits INTEGER DEFAULT 0,
+    cache_saved_tokens INTEGER DEFAULT 0,
+    latency_sum DOUBLE PRECISION DEFAULT 0,
+    latency_histogram JSON
+);
+
+CREATE INDEX IF NOT EXISTS ix_llm_usage_rollups_id ON llm_usage_rollups (id);
+CREATE INDEX IF NOT EXISTS ix_llm_usage_rollups_config_period ON llm_usage_rollups (llm_config_id, period_end);
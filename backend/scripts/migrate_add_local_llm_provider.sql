@@ -0,0 +1,2 @@
+-- Provider simulado (sem rede) para testes de carga e benchmarks
+ALTER TYPE llmprovider ADD VALUE IF NOT EXISTS 'LOCAL';
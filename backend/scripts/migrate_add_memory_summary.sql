@@ -0,0 +1,5 @@
+ALTER TABLE game_sessions
+ADD COLUMN IF NOT EXISTS memory_summary TEXT;
+
+ALTER TABLE game_sessions
+ADD COLUMN IF NOT EXISTS memory_summary_until_id INTEGER;
@@ -0,0 +1,14 @@
+ALTER TABLE player_boards
+ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+CREATE TABLE IF NOT EXISTS player_board_events (
+    id SERIAL PRIMARY KEY,
+    board_id INTEGER NOT NULL REFERENCES player_boards(id),
+    session_id INTEGER NOT NULL REFERENCES game_sessions(id),
+    slot INTEGER NOT NULL,
+    element VARCHAR NOT NULL,
+    effect JSON,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_player_board_events_board_id_id ON player_board_events (board_id, id);
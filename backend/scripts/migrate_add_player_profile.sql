@@ -0,0 +1,5 @@
+ALTER TABLE game_sessions
+ADD COLUMN IF NOT EXISTS player_profile JSON;
+
+ALTER TABLE session_interactions
+ADD COLUMN IF NOT EXISTS extracted_features JSON;
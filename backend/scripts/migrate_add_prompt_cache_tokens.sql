@@ -0,0 +1,11 @@
+ALTER TABLE session_interactions
+ADD COLUMN IF NOT EXISTS cache_read_tokens INTEGER;
+
+ALTER TABLE session_interactions
+ADD COLUMN IF NOT EXISTS cache_write_tokens INTEGER;
+
+ALTER TABLE llm_configurations
+ADD COLUMN IF NOT EXISTS total_cache_read_tokens INTEGER DEFAULT 0;
+
+ALTER TABLE llm_configurations
+ADD COLUMN IF NOT EXISTS total_cache_write_tokens INTEGER DEFAULT 0;
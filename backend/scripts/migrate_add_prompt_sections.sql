@@ -0,0 +1,2 @@
+ALTER TABLE session_interactions
+ADD COLUMN IF NOT EXISTS prompt_sections JSON;
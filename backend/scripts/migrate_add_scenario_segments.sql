@@ -0,0 +1,24 @@
+ALTER TABLE scenarios
+ADD COLUMN IF NOT EXISTS segment_count INTEGER;
+
+CREATE TABLE IF NOT EXISTS scenario_segments (
+    id SERIAL PRIMARY KEY,
+    scenario_id INTEGER NOT NULL REFERENCES scenarios(id),
+    position INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'uq_scenario_segments_scenario_position'
+    ) THEN
+        ALTER TABLE scenario_segments
+            ADD CONSTRAINT uq_scenario_segments_scenario_position UNIQUE (scenario_id, position);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS ix_scenario_segments_id ON scenario_segments (id);
@@ -0,0 +1,24 @@
+CREATE TABLE IF NOT EXISTS session_narrative_states (
+    id SERIAL PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES game_sessions(id),
+    scenario_id INTEGER REFERENCES scenarios(id),
+    segment_index INTEGER DEFAULT 0,
+    selected_element VARCHAR,
+    decision_history JSON,
+    turn_count INTEGER DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'uq_session_narrative_states_session_id'
+    ) THEN
+        ALTER TABLE session_narrative_states
+            ADD CONSTRAINT uq_session_narrative_states_session_id UNIQUE (session_id);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS ix_session_narrative_states_id ON session_narrative_states (id);
@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS session_turn_leases (
+    session_id INTEGER PRIMARY KEY,
+    token VARCHAR(32) NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS tts_audio_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    audio BYTEA NOT NULL,
+    size_bytes INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
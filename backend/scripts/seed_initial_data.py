@@ -36,6 +36,8 @@ from auth import get_password_hash
 from database import SessionLocal, engine, Base
 from models import User, UserRole, Game, GameRule, Scenario
 from services.file_service import FileService
+from services.narrative_service import ScenarioSegmentStore
+from services.game_catalog import bump_game_content_version
 
 load_dotenv()
 
@@ -95,6 +97,7 @@ async def seed_data():
     Base.metadata.create_all(bind=engine)
     db = SessionLocal()
     file_service = FileService()
+    segment_store = ScenarioSegmentStore(db)
 
     admin_email = os.getenv("ADMIN_EMAIL")
     admin_password = os.getenv("ADMIN_PASSWORD")
@@ -222,6 +225,8 @@ async def seed_data():
             Scenario.name == name
         ).first()
         if existing:
+            if existing.segment_count is None:
+                segment_store.rebuild(existing)
             continue
 
         file_content = await file_service.extract_text_from_file(str(file_path), file_path.suffix.lower())
@@ -254,7 +259,11 @@ async def seed_data():
             is_active=True
         )
         db.add(scenario)
+        db.flush()
+        segment_store.rebuild(scenario)
 
+    # Invalida o catálogo compilado do jogo nos workers em execução
+    bump_game_content_version(db, game.id)
     db.commit()
     db.close()
     print("Seed concluído com sucesso.")
@@ -1,10 +1,16 @@
 from typing import Optional
 import os
 import aiofiles
-from gtts import gTTS
-import speech_recognition as sr
-from pydub import AudioSegment
 from pathlib import Path
+from services.tts_cache import tts_cache
+from services.tts_stream import start_narration
+from services.speech_pipeline import Transcription, transcribe
+
+def audio_format_hint(filename: Optional[str]) -> Optional[str]:
+    """WAV é lido direto pelo pydub, sem ffmpeg; nos demais formatos o ffmpeg detecta o conteúdo"""
+    if filename and filename.lower().endswith(".wav"):
+        return "wav"
+    return None
 
 class AudioService:
     def __init__(self):
@@ -15,28 +21,28 @@ class AudioService:
     
     async def text_to_speech(self, text: str, lang: str = "pt-BR") -> str:
         try:
-            tts = gTTS(text=text, lang=lang, slow=False)
-            output_file = self.audio_output_dir / f"tts_{hash(text)}.mp3"
-            tts.save(str(output_file))
+            output_file = await tts_cache.get_or_synthesize(text, lang, self.audio_output_dir)
             return str(output_file)
         except Exception as e:
             raise Exception(f"Erro ao converter texto em áudio: {str(e)}")
+
+    async def text_to_speech_stream(self, text: str, lang: str = "pt-BR") -> str:
+        """Narração em trechos sintetizados em paralelo; retorna o id do manifesto assim que o primeiro trecho fica pronto"""
+        try:
+            manifest = await start_narration(text, lang, self.audio_output_dir)
+            return manifest["id"]
+        except Exception as e:
+            raise Exception(f"Erro ao converter texto em áudio: {str(e)}")
     
     async def speech_to_text(self, audio_file_path: str) -> str:
+        async with aiofiles.open(audio_file_path, "rb") as f:
+            audio_data = await f.read()
+        return (await self.transcribe(audio_data, audio_format_hint(audio_file_path))).text
+
+    async def transcribe(self, audio_data: bytes, audio_format: Optional[str] = None) -> Transcription:
+        """Transcrição em memória com os tempos de decodificação e reconhecimento"""
         try:
-            recognizer = sr.Recognizer()
-            audio = AudioSegment.from_file(audio_file_path)
-            wav_path = audio_file_path.replace(Path(audio_file_path).suffix, ".wav")
-            audio.export(wav_path, format="wav")
-            with sr.AudioFile(wav_path) as source:
-                audio_data = recognizer.record(source)
-            try:
-                text = recognizer.recognize_google(audio_data, language="pt-BR")
-            except sr.UnknownValueError:
-                text = "Não foi possível reconhecer o áudio"
-            if os.path.exists(wav_path) and wav_path != audio_file_path:
-                os.remove(wav_path)
-            return text
+            return await transcribe(audio_data, audio_format)
         except Exception as e:
             raise Exception(f"Erro ao converter áudio em texto: {str(e)}")
     
@@ -0,0 +1,159 @@
+from typing import Optional, List, Any
+import os
+import re
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import GameSession, SessionInteraction
+from services.prompt_builder import estimate_tokens
+
+# Janela de turnos recentes enviada à LLM e limite de tokens dessa janela
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "8"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+MEMORY_RESPONSE_MAX_CHARS = int(os.getenv("MEMORY_RESPONSE_MAX_CHARS", "600"))
+# Resumo dos turnos antigos: atualizado a cada K turnos e limitado em tokens
+MEMORY_SUMMARY_EVERY = int(os.getenv("MEMORY_SUMMARY_EVERY", "10"))
+MEMORY_SUMMARY_TOKEN_BUDGET = int(os.getenv("MEMORY_SUMMARY_TOKEN_BUDGET", "400"))
+# Entre duas atualizações do resumo a janela cresce além de MEMORY_MAX_TURNS: nenhum turno fica fora do resumo e da janela
+MEMORY_UNSUMMARIZED_LIMIT = MEMORY_MAX_TURNS + MEMORY_SUMMARY_EVERY
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+def _shorten(text: str, max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+def _first_sentence(text: str) -> str:
+    text = " ".join((text or "").split())
+    return SENTENCE_END_RE.split(text, maxsplit=1)[0] if text else ""
+
+class MemoryTurn:
+    """Turno da janela de memória com a resposta do narrador já encurtada"""
+
+    __slots__ = ("id", "player_input", "ai_response")
+
+    def __init__(self, interaction: Any):
+        self.id = interaction.id
+        self.player_input = interaction.player_input
+        self.ai_response = _shorten(interaction.ai_response, MEMORY_RESPONSE_MAX_CHARS)
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.player_input or "") + estimate_tokens(self.ai_response or "")
+
+def summarize_turns(interactions: List[Any]) -> List[str]:
+    """Resumo extrativo: fala do jogador e primeira frase do narrador de cada turno"""
+    lines = []
+    for interaction in interactions:
+        player = _shorten(interaction.player_input, 120)
+        narrator = _shorten(_first_sentence(interaction.ai_response), 160)
+        if player or narrator:
+            lines.append(f"- Jogador: {player} | Narrador: {narrator}")
+    return lines
+
+def fit_summary(lines: List[str], budget: int = MEMORY_SUMMARY_TOKEN_BUDGET) -> str:
+    """Mantém as linhas mais recentes do resumo dentro do limite de tokens"""
+    kept: List[str] = []
+    total = 0
+    for line in reversed(lines):
+        tokens = estimate_tokens(line)
+        if kept and total + tokens > budget:
+            break
+        kept.append(line)
+        total += tokens
+    return "\n".join(reversed(kept))
+
+def fit_window(rows: List[Any], max_turns: int) -> List[MemoryTurn]:
+    """Turnos mais recentes (rows do mais novo ao mais antigo) dentro do orçamento de tokens, do mais antigo ao mais novo"""
+    turns: List[MemoryTurn] = []
+    total = 0
+    for row in rows[:max_turns]:
+        turn = MemoryTurn(row)
+        tokens = turn.tokens()
+        if turns and total + tokens > MEMORY_TOKEN_BUDGET:
+            break
+        turns.append(turn)
+        total += tokens
+    turns.reverse()
+    return turns
+
+def _unsummarized(db: Session, session_id: int, summary_until_id: Optional[int], limit: int) -> List[Any]:
+    query = db.query(
+        SessionInteraction.id, SessionInteraction.player_input, SessionInteraction.ai_response
+    ).filter(SessionInteraction.session_id == session_id)
+    if summary_until_id:
+        query = query.filter(SessionInteraction.id > summary_until_id)
+    return query.order_by(SessionInteraction.id.desc()).limit(limit).all()
+
+class ConversationMemory:
+    """Memória da conversa para o contexto da LLM: resumo dos turnos antigos + janela recente"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        # Algum turno ainda não resumido ficou fora da janela: o resumo precisa ser atualizado já
+        self.overflowed = False
+        self._pending_lines: List[str] = []
+
+    def recent_turns(self, session: GameSession) -> List[MemoryTurn]:
+        """Todos os turnos ainda não resumidos, do mais antigo ao mais novo, enquanto couberem no orçamento"""
+        rows = _unsummarized(self.db, session.id, session.memory_summary_until_id, MEMORY_UNSUMMARIZED_LIMIT)
+        turns = fit_window(rows, MEMORY_UNSUMMARIZED_LIMIT)
+        self.overflowed = len(turns) < len(rows) or len(rows) >= MEMORY_UNSUMMARIZED_LIMIT
+        # Os que não couberam entram no resumo deste prompt até a atualização gravar o resumo novo
+        self._pending_lines = summarize_turns(list(reversed(rows[len(turns):])))
+        return turns
+
+    def summary(self, session: GameSession) -> str:
+        """Resumo gravado mais os turnos que ficaram fora da janela (chamar depois de recent_turns)"""
+        if not self._pending_lines:
+            return session.memory_summary or ""
+        return fit_summary((session.memory_summary or "").splitlines() + self._pending_lines)
+
+    @staticmethod
+    def needs_refresh(turn_count: Optional[int]) -> bool:
+        return bool(turn_count) and turn_count > MEMORY_MAX_TURNS and turn_count % MEMORY_SUMMARY_EVERY == 0
+
+def refresh_session_summary(session_id: int) -> None:
+    """Incorpora ao resumo os turnos que saíram da janela recente (executado em segundo plano)"""
+    db = SessionLocal()
+    try:
+        session = db.query(GameSession).filter(GameSession.id == session_id).first()
+        if not session:
+            return
+        previous_until = session.memory_summary_until_id
+        # Fica fora do resumo só a janela base (MEMORY_MAX_TURNS turnos dentro do orçamento de tokens);
+        # tudo o que vem antes dela é resumido, inclusive turnos que o orçamento já tirava da janela
+        window = fit_window(_unsummarized(db, session_id, previous_until, MEMORY_MAX_TURNS), MEMORY_MAX_TURNS)
+        if not window:
+            return
+        query = db.query(
+            SessionInteraction.id, SessionInteraction.player_input, SessionInteraction.ai_response
+        ).filter(
+            SessionInteraction.session_id == session_id,
+            SessionInteraction.id < window[0].id
+        )
+        if previous_until:
+            query = query.filter(SessionInteraction.id > previous_until)
+        folded = query.order_by(SessionInteraction.id.asc()).all()
+        if not folded:
+            return
+        lines = (session.memory_summary or "").splitlines() + summarize_turns(folded)
+        # Atualização condicional: outro worker pode ter resumido os mesmos turnos
+        guard = db.query(GameSession).filter(GameSession.id == session_id)
+        if previous_until:
+            guard = guard.filter(GameSession.memory_summary_until_id == previous_until)
+        else:
+            guard = guard.filter(GameSession.memory_summary_until_id == None)
+        updated = guard.update({
+            GameSession.memory_summary: fit_summary(lines),
+            GameSession.memory_summary_until_id: folded[-1].id,
+        }, synchronize_session=False)
+        if updated:
+            db.commit()
+        else:
+            db.rollback()
+    except Exception as e:
+        db.rollback()
+        print(f"[MEMORY] Erro ao atualizar resumo da sessão {session_id}: {str(e)}")
+    finally:
+        db.close()
@@ -0,0 +1,205 @@
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime
+import random
+import re
+from models import PlayerBoard, PlayerBoardEvent
+from services.narrative_service import normalize_text
+
+# Rolagem de dados resolvida localmente (sem LLM): elementos, ordem dos jogadores e tabuleiro pessoal
+DICE_ELEMENTS = [
+    {"key": "agua", "name": "Água", "icon": "💧"},
+    {"key": "ar", "name": "Ar", "icon": "🌬️"},
+    {"key": "terra", "name": "Terra", "icon": "🌱"},
+    {"key": "fogo", "name": "Fogo", "icon": "🔥"},
+    {"key": "sombra", "name": "Sombra", "icon": "🌑"},
+    {"key": "luz", "name": "Luz", "icon": "✨"},
+]
+
+ELEMENT_LABELS = {
+    "agua": "Água",
+    "ar": "Ar",
+    "terra": "Terra",
+    "fogo": "Fogo",
+    "sombra": "Sombra",
+    "luz": "Luz",
+}
+
+RULES_BLOCKED_TERMS = [
+    "dado", "dados", "rolar", "rolagem", "anula", "anular", "substitui", "substituir",
+    "impede", "avanca", "avanç", "cena", "elemento", "sombra", "luz", "jogador", "ia",
+    "pode", "podem", "deve", "devem", "quando", "caso", "se ", "regras", "mecanica", "mecânica"
+]
+
+def is_dice_roll_request(text: str) -> bool:
+    normalized = normalize_text(text)
+    return "rolar dados" in normalized or "rolar os dados" in normalized or "rolar dado" in normalized
+
+def extract_rules_section(content: str, section_number: int) -> str:
+    if not content:
+        return ""
+    pattern = rf"(?:se[cç][aã]o)\s*{section_number}\\b[:\\.\\-]*"
+    normalized = normalize_text(content)
+    match = re.search(pattern, normalized, re.IGNORECASE)
+    if not match:
+        return ""
+    start = match.start()
+    end_match = re.search(rf"(?:se[cç][aã]o)\s*{section_number + 1}\\b", normalized[start:])
+    end_index = start + end_match.start() if end_match else len(content)
+    return content[start:end_index].strip()
+
+def sanitize_rules_text(content: str) -> str:
+    if not content:
+        return ""
+    lines: List[str] = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        normalized = normalize_text(stripped)
+        if normalized.startswith("seção") or normalized.startswith("secao"):
+            continue
+        if any(term in normalized for term in RULES_BLOCKED_TERMS):
+            continue
+        if normalized[:1].isdigit():
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def shadow_light_texts(rules_content: str) -> Dict[str, str]:
+    """Textos das Seções 5 (sombra) e 6 (luz) do arquivo de regras; calculados uma vez por versão do catálogo"""
+    return {
+        "sombra": sanitize_rules_text(extract_rules_section(rules_content, 5)),
+        "luz": sanitize_rules_text(extract_rules_section(rules_content, 6)),
+    }
+
+def build_roll_order(profile_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    players = profile_data.get("players") or []
+    if players:
+        return [
+            {"slot": idx + 1, "name": player.get("name") or f"Jogador {idx + 1}"}
+            for idx, player in enumerate(players)
+        ]
+    count = profile_data.get("count") or 1
+    return [{"slot": idx + 1, "name": f"Jogador {idx + 1}"} for idx in range(count)]
+
+def apply_shadow_light_rules(slot_state: Dict[str, Any], element_key: str) -> Dict[str, Any]:
+    counts = slot_state.get("counts") or {}
+    effect: Dict[str, Any] = {}
+    if element_key == "sombra":
+        if int(counts.get("luz", 0)) > 0:
+            counts["luz"] = int(counts.get("luz", 0)) - 1
+            effect["shadow_canceled_light"] = True
+        else:
+            counts["sombra"] = int(counts.get("sombra", 0)) + 1
+            effect["shadow_added"] = True
+    elif element_key == "luz":
+        if int(counts.get("sombra", 0)) > 0:
+            counts["sombra"] = int(counts.get("sombra", 0)) - 1
+            effect["light_canceled_shadow"] = True
+        else:
+            counts["luz"] = int(counts.get("luz", 0)) + 1
+            effect["light_added"] = True
+    else:
+        counts[element_key] = int(counts.get(element_key, 0)) + 1
+        effect["element_added"] = element_key
+    slot_state["counts"] = counts
+    return effect
+
+def compact_board_state(board_state: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Cópia do snapshot só com ordem, vez e contagens; o histórico antigo guardado dentro do JSON
+    (tabuleiros anteriores à tabela de eventos) é devolvido para virar eventos"""
+    state = board_state if isinstance(board_state, dict) else {}
+    legacy_events: List[Dict[str, Any]] = []
+    slots: Dict[str, Any] = {}
+    for slot_key, slot_state in (state.get("slots") or {}).items():
+        slot_state = slot_state or {}
+        slots[slot_key] = {"counts": dict(slot_state.get("counts") or {})}
+        for entry in slot_state.get("history") or []:
+            legacy_events.append({"slot": int(slot_key), "element": entry.get("element"), "effect": entry.get("effect"), "at": entry.get("at")})
+    compact: Dict[str, Any] = {"order": [dict(item) for item in state.get("order") or []], "turn_index": state.get("turn_index") or 0, "slots": slots}
+    if state.get("counts"):
+        compact["counts"] = dict(state["counts"])
+    legacy_events.sort(key=lambda event: event["at"] or "")
+    return compact, legacy_events
+
+def add_element_to_board(board_state: Optional[Dict[str, Any]], element_key: str, profile_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Registra o elemento no jogador da vez; devolve um novo snapshot de tamanho fixo
+    (o SQLAlchemy não detecta alteração no mesmo dict JSON) e os eventos a gravar"""
+    state, events = compact_board_state(board_state)
+    order = state.get("order") or build_roll_order(profile_data)
+    if not order:
+        order = [{"slot": 1, "name": "Jogador 1"}]
+    turn_index = int(state.get("turn_index") or 0)
+    current_turn = order[turn_index % len(order)]
+    slots = state["slots"]
+    slot_key = str(current_turn["slot"])
+    slot_state = slots.get(slot_key) or {}
+    effect = apply_shadow_light_rules(slot_state, element_key)
+    slots[slot_key] = slot_state
+    state["order"] = order
+    state["turn_index"] = (turn_index + 1) % len(order)
+    events.append({"slot": int(current_turn["slot"]), "element": element_key, "effect": effect, "at": None})
+    return {"state": state, "events": events, "order": order, "current": current_turn, "next": order[state["turn_index"]]}
+
+def board_event_rows(board: PlayerBoard, session_id: int, events: List[Dict[str, Any]]) -> List[PlayerBoardEvent]:
+    rows = []
+    for event in events:
+        row = PlayerBoardEvent(board=board, session_id=session_id, slot=event["slot"], element=event["element"], effect=event["effect"])
+        if event.get("at"):
+            # Eventos migrados do histórico antigo mantêm o horário original
+            row.created_at = datetime.fromisoformat(event["at"])
+        rows.append(row)
+    return rows
+
+def format_board_status(board_state: Optional[Dict[str, Any]]) -> str:
+    if not isinstance(board_state, dict):
+        return "Tabuleiro pessoal: sem registros."
+    order = board_state.get("order") or []
+    slots = board_state.get("slots") or {}
+    lines = ["Tabuleiro pessoal (status atual):"]
+    if order:
+        for item in order:
+            slot_key = str(item.get("slot"))
+            slot_state = slots.get(slot_key) or {}
+            counts = slot_state.get("counts") or {}
+            if not counts:
+                counts_text = "sem elementos registrados"
+            else:
+                counts_text = ", ".join(
+                    f"{ELEMENT_LABELS.get(key, key)}: {counts[key]}" for key in counts
+                )
+            lines.append(f"- {item.get('name', f'Jogador {slot_key}')}: {counts_text}")
+        return "\n".join(lines)
+    # fallback para caso não exista ordem
+    counts = board_state.get("counts") or {}
+    if not counts:
+        return "Tabuleiro pessoal: sem registros."
+    counts_text = ", ".join(f"{ELEMENT_LABELS.get(key, key)}: {counts[key]}" for key in counts)
+    return f"Tabuleiro pessoal (status atual): {counts_text}"
+
+def roll_dice(board_state: Optional[Dict[str, Any]], profile_data: Dict[str, Any], rules_texts: Dict[str, str], next_segment: str = "") -> Dict[str, Any]:
+    """Sorteia o elemento, atualiza o tabuleiro e monta a resposta do narrador; devolve {"text", "board_state", "events"}"""
+    selected = random.choice(DICE_ELEMENTS)
+    turn_info = add_element_to_board(board_state, selected["key"], profile_data)
+    if selected["key"] == "sombra":
+        outcome = rules_texts.get("sombra") or "Uma sombra se move e aguarda sua resposta."
+    elif selected["key"] == "luz":
+        outcome = rules_texts.get("luz") or "Uma luz clara se revela e guia sua próxima escolha."
+    else:
+        outcome = f"O elemento {selected['name']} foi adicionado ao seu tabuleiro pessoal."
+    response_text = (
+        f"Resultado da rolagem: {selected['icon']} {selected['name']}\n"
+        f"{outcome}"
+    )
+    if turn_info.get("order") and len(turn_info["order"]) > 1:
+        order_text = ", ".join([f"{item['slot']}. {item['name']}" for item in turn_info["order"]])
+        response_text = (
+            f"Ordem de rolagem: {order_text}\n"
+            f"Jogador a rolar agora: {turn_info['current']['name']}\n\n"
+            f"{response_text}\n"
+            f"Próximo jogador: {turn_info['next']['name']}"
+        )
+    response_text = f"{response_text}\n\n{format_board_status(turn_info['state'])}"
+    if next_segment:
+        response_text = f"{response_text}\n\n{next_segment}"
+    return {"text": response_text, "board_state": turn_info["state"], "events": turn_info["events"]}
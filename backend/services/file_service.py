@@ -6,11 +6,40 @@ import unicodedata
 from pathlib import Path
 from typing import Optional
 
+from fastapi import UploadFile
+
 import aiofiles
 import PyPDF2
 from docx import Document
 from supabase import create_client
 
+_MB = 1024 * 1024
+
+# Uploads copiados em blocos do UploadFile para o destino: memória constante independentemente do tamanho
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(_MB)))
+# Limite por tipo de arquivo (MB)
+UPLOAD_MAX_BYTES = {
+    "game_cover": int(float(os.getenv("UPLOAD_MAX_MB_GAME_COVER", "10")) * _MB),
+    "scenario_image": int(float(os.getenv("UPLOAD_MAX_MB_SCENARIO_IMAGE", "10")) * _MB),
+    "scenario_video": int(float(os.getenv("UPLOAD_MAX_MB_SCENARIO_VIDEO", "500")) * _MB),
+    "rule_file": int(float(os.getenv("UPLOAD_MAX_MB_RULE_FILE", "25")) * _MB),
+    "scenario": int(float(os.getenv("UPLOAD_MAX_MB_SCENARIO_FILE", "25")) * _MB),
+}
+# Corpo multipart inteiro (Content-Length), recusado antes de ser lido; o padrão cabe imagem, vídeo e
+# documento de uma mesma cena
+UPLOAD_MAX_REQUEST_BYTES = int(float(os.getenv(
+    "UPLOAD_MAX_MB_REQUEST",
+    str((UPLOAD_MAX_BYTES["scenario_image"] + UPLOAD_MAX_BYTES["scenario_video"] + UPLOAD_MAX_BYTES["scenario"]) / _MB + 1),
+)) * _MB)
+
+def max_upload_bytes(file_type: str) -> int:
+    return UPLOAD_MAX_BYTES.get(file_type, UPLOAD_MAX_BYTES["scenario"])
+
+class UploadTooLargeError(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Arquivo excede o limite de {limit / _MB:.0f} MB")
+        self.limit = limit
+
 class FileService:
     def __init__(self):
         self.upload_dir = Path(os.getenv("SCENARIO_FILES_DIR", "./scenario_files"))
@@ -35,22 +64,43 @@ class FileService:
         if self.supabase_url and self.supabase_key and self.supabase_bucket:
             self.supabase_client = create_client(self.supabase_url, self.supabase_key)
     
-    async def save_uploaded_file(self, file_data: bytes, filename: str, file_type: str = "scenario") -> str:
-        """Salva arquivo enviado e retorna o caminho
-        file_type: 'scenario', 'game_cover', 'scenario_image', 'scenario_video' ou 'rule_file'
-        """
+    def _target_path(self, filename: str, file_type: str) -> Path:
         if file_type == "game_cover":
-            file_path = self.game_covers_dir / filename
-        elif file_type == "scenario_image":
-            file_path = self.scenario_images_dir / filename
-        elif file_type == "scenario_video":
-            file_path = self.scenario_videos_dir / filename
-        elif file_type == "rule_file":
-            file_path = self.rule_files_dir / filename
-        else:
-            file_path = self.upload_dir / filename
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_data)
+            return self.game_covers_dir / filename
+        if file_type == "scenario_image":
+            return self.scenario_images_dir / filename
+        if file_type == "scenario_video":
+            return self.scenario_videos_dir / filename
+        if file_type == "rule_file":
+            return self.rule_files_dir / filename
+        return self.upload_dir / filename
+
+    async def save_upload_stream(self, upload: UploadFile, filename: str, file_type: str = "scenario") -> str:
+        """Copia o upload em blocos para o destino e retorna o caminho
+        file_type: 'scenario', 'game_cover', 'scenario_image', 'scenario_video' ou 'rule_file'
+        Acima do limite do tipo levanta UploadTooLargeError e nada fica gravado"""
+        limit = max_upload_bytes(file_type)
+        if upload.size is not None and upload.size > limit:
+            raise UploadTooLargeError(limit)
+        file_path = self._target_path(filename, file_type)
+        # Gravado com outro nome e renomeado no fim: o arquivo nunca aparece pela metade
+        part_path = file_path.with_name(f".{file_path.name}.part")
+        size = 0
+        try:
+            async with aiofiles.open(part_path, 'wb') as f:
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > limit:
+                        raise UploadTooLargeError(limit)
+                    await f.write(chunk)
+            os.replace(part_path, file_path)
+        except BaseException:
+            if part_path.exists():
+                part_path.unlink()
+            raise
         return str(file_path)
 
     def _sanitize_filename(self, filename: str) -> str:
@@ -0,0 +1,137 @@
+from typing import Optional, Dict, List
+import threading
+from sqlalchemy.orm import Session, defer
+from database import SessionLocal
+from models import Game, GameRule, Scenario
+from services.narrative_service import SceneIndex, ScenarioSegmentStore, normalize_text
+from services.dice_roll import shadow_light_texts
+
+class CatalogScene:
+    """Snapshot compacto de uma cena (sem o texto completo do arquivo)"""
+
+    __slots__ = ("id", "name", "description", "phase", "order", "segment_count")
+
+    def __init__(self, scenario: Scenario):
+        self.id = scenario.id
+        self.name = scenario.name
+        self.description = scenario.description
+        self.phase = scenario.phase
+        self.order = scenario.order
+        self.segment_count = scenario.segment_count
+
+class CatalogRule:
+    """Snapshot compacto de um elemento do jogo com o título já normalizado"""
+
+    __slots__ = ("id", "title", "norm_title", "rule_type", "content", "file_content")
+
+    def __init__(self, rule: GameRule):
+        self.id = rule.id
+        self.title = rule.title
+        self.norm_title = normalize_text(rule.title)
+        self.rule_type = rule.rule_type
+        self.content = rule.content
+        self.file_content = (rule.content or {}).get("file_content")
+
+    @property
+    def is_history(self) -> bool:
+        return self.norm_title.startswith("historia")
+
+    @property
+    def is_prompt_instruction(self) -> bool:
+        return "prompt de instrucao" in self.norm_title
+
+    @property
+    def is_rules(self) -> bool:
+        return "regras" in self.norm_title or "mecanicas" in self.norm_title or self.rule_type in ["rule", "mechanic"]
+
+    @property
+    def group(self) -> int:
+        if self.is_rules:
+            return 1
+        if "estrutura" in self.norm_title and "cena" in self.norm_title:
+            return 2
+        if "nivel" in self.norm_title and "poder" in self.norm_title:
+            return 3
+        return 9
+
+class GameCatalog:
+    """Conteúdo ativo de um jogo compilado para consulta rápida durante as interações"""
+
+    __slots__ = (
+        "game_id", "version", "scenes", "scene_index", "rules",
+        "history_rules", "prompt_instruction", "opening_rules", "rules_file_content", "dice_rules_texts",
+    )
+
+    def __init__(self, game_id: int, version: int, scenarios: List[Scenario], rules: List[GameRule]):
+        self.game_id = game_id
+        self.version = version
+        self.scenes = [CatalogScene(scenario) for scenario in scenarios]
+        self.scene_index = SceneIndex(self.scenes)
+        self.rules = [CatalogRule(rule) for rule in rules]
+        self.history_rules = [rule for rule in self.rules if rule.is_history]
+        self.prompt_instruction = next((rule for rule in self.rules if rule.is_prompt_instruction), None)
+        # Regras/mecânicas, estrutura das cenas e níveis de poder (enviados apenas no início)
+        self.opening_rules = sorted(
+            [rule for rule in self.rules if not rule.is_history and not rule.is_prompt_instruction and rule.group in [1, 2, 3]],
+            key=lambda rule: rule.group
+        )
+        self.rules_file_content = next((rule.file_content for rule in self.rules if rule.is_rules and rule.file_content), "")
+        # Textos de sombra/luz (Seções 5 e 6) usados na rolagem de dados
+        self.dice_rules_texts = shadow_light_texts(self.rules_file_content)
+
+_catalogs: Dict[int, GameCatalog] = {}
+_catalog_lock = threading.Lock()
+
+def get_game_content_version(db: Session, game_id: int) -> int:
+    return db.query(Game.content_version).filter(Game.id == game_id).scalar() or 0
+
+def get_game_catalog(db: Session, game_id: int, version: Optional[int] = None) -> GameCatalog:
+    """Retorna o catálogo do jogo, recompilando apenas quando a versão do conteúdo mudou"""
+    if version is None:
+        version = get_game_content_version(db, game_id)
+    catalog = _catalogs.get(game_id)
+    if catalog is not None and catalog.version == version:
+        return catalog
+    with _catalog_lock:
+        catalog = _catalogs.get(game_id)
+        if catalog is None or catalog.version != version:
+            catalog = _compile_catalog(game_id, version)
+            _catalogs[game_id] = catalog
+    return catalog
+
+def _compile_catalog(game_id: int, version: int) -> GameCatalog:
+    # Sessão própria: a compilação não participa da transação da requisição
+    db = SessionLocal()
+    try:
+        scenarios = db.query(Scenario).options(defer(Scenario.file_content)).filter(
+            Scenario.game_id == game_id,
+            Scenario.is_active == True
+        ).order_by(Scenario.phase, Scenario.order).all()
+        pending = [scenario for scenario in scenarios if scenario.segment_count is None]
+        # Cenas anteriores à tabela de trechos são segmentadas uma vez aqui
+        store = ScenarioSegmentStore(db)
+        for scenario in pending:
+            store.rebuild(scenario)
+        rules = db.query(GameRule).filter(
+            GameRule.game_id == game_id,
+            GameRule.is_active == True
+        ).all()
+        catalog = GameCatalog(game_id, version, scenarios, rules)
+        if pending:
+            db.commit()
+        return catalog
+    finally:
+        db.close()
+
+def bump_game_content_version(db: Session, *game_ids: Optional[int]) -> None:
+    """Invalida o catálogo dos jogos em todos os workers; chamar nas rotas que alteram regras ou cenas"""
+    for game_id in {game_id for game_id in game_ids if game_id}:
+        db.query(Game).filter(Game.id == game_id).update(
+            {Game.content_version: Game.content_version + 1},
+            synchronize_session=False
+        )
+        _catalogs.pop(game_id, None)
+
+def forget_game_catalog(game_id: int) -> None:
+    """Descarta o catálogo em cache neste worker (jogo removido: não há versão a incrementar)"""
+    _catalogs.pop(game_id, None)
@@ -0,0 +1,217 @@
+from typing import Optional, Dict, Any, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import hashlib
+import json
+import os
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import IdempotencyKey
+
+# Cabeçalho Idempotency-Key nas rotas de interação: a repetição de uma requisição (retentativa do cliente
+# após timeout) devolve a resposta gravada ou aguarda a original em andamento, sem nova chamada à LLM/TTS
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "120"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.5"))
+# Chave em andamento há mais tempo que isso é considerada abandonada (worker reiniciado no meio do turno)
+IDEMPOTENCY_STALE_AFTER = float(os.getenv("IDEMPOTENCY_STALE_AFTER", "300"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "600"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+_OWNER = "owner"
+
+class InvalidIdempotencyKeyError(Exception):
+    def __init__(self):
+        super().__init__(f"Idempotency-Key inválida (máximo de {IDEMPOTENCY_KEY_MAX_LENGTH} caracteres).")
+
+class IdempotencyMismatchError(Exception):
+    """A mesma chave foi reutilizada com outro conteúdo"""
+
+    def __init__(self):
+        super().__init__("Esta Idempotency-Key já foi usada com uma requisição diferente.")
+
+class IdempotencyInProgressError(Exception):
+    """A requisição original ainda não terminou dentro do prazo de espera"""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("A requisição com esta Idempotency-Key ainda está em andamento. Tente novamente em instantes.")
+        self.retry_after = retry_after
+
+def request_fingerprint(endpoint: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps({"endpoint": endpoint, "payload": payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _claim_row(user_id: int, key: str, fingerprint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Reserva a chave no banco (executado em thread): (_OWNER, None), (COMPLETED, resposta) ou (IN_PROGRESS, None)"""
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        row = db.query(IdempotencyKey).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).first()
+        if row is not None and _aware(row.expires_at) <= now:
+            db.delete(row)
+            db.commit()
+            row = None
+        if row is None:
+            db.add(IdempotencyKey(
+                user_id=user_id, key=key, fingerprint=fingerprint, status=IN_PROGRESS,
+                created_at=now, expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+            ))
+            try:
+                db.commit()
+                return _OWNER, None
+            except IntegrityError:
+                # Outra requisição com a mesma chave reservou primeiro
+                db.rollback()
+                row = db.query(IdempotencyKey).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).first()
+                if row is None:
+                    return IN_PROGRESS, None
+        if row.fingerprint != fingerprint:
+            raise IdempotencyMismatchError()
+        if row.status == COMPLETED:
+            return COMPLETED, row.response
+        if row.created_at is not None and _aware(row.created_at) <= now - timedelta(seconds=IDEMPOTENCY_STALE_AFTER):
+            # Assume a chave abandonada; o UPDATE condicional garante um único novo dono
+            taken = db.query(IdempotencyKey).filter(
+                IdempotencyKey.id == row.id,
+                IdempotencyKey.status == IN_PROGRESS,
+                IdempotencyKey.created_at == row.created_at,
+            ).update({"created_at": now}, synchronize_session=False)
+            db.commit()
+            if taken:
+                return _OWNER, None
+        return IN_PROGRESS, None
+    finally:
+        db.close()
+
+def _complete_row(user_id: int, key: str, response: Dict[str, Any], interaction_id: Optional[int]) -> None:
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key).update({
+            "status": COMPLETED,
+            "response": response,
+            "interaction_id": interaction_id,
+            "expires_at": _utcnow() + timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+        }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[IDEMPOTENCY] Erro ao gravar resposta da chave {key}: {str(e)}")
+    finally:
+        db.close()
+
+def _release_row(user_id: int, key: str) -> None:
+    """A requisição falhou: libera a chave para que a próxima tentativa execute o turno"""
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.status == IN_PROGRESS,
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[IDEMPOTENCY] Erro ao liberar a chave {key}: {str(e)}")
+    finally:
+        db.close()
+
+class IdempotencyClaim:
+    """Resultado da reserva: `replay` traz a resposta gravada; senão esta requisição executa o turno
+    e deve chamar complete() ou abandon() (ambos podem ser chamados mais de uma vez)"""
+
+    def __init__(self, store: "IdempotencyStore", user_id: int, key: str, replay: Optional[Dict[str, Any]] = None):
+        self._store = store
+        self.user_id = user_id
+        self.key = key
+        self.replay = replay
+        self.done = replay is not None
+
+    async def complete(self, response: Dict[str, Any], interaction_id: Optional[int] = None) -> None:
+        if self.done:
+            return
+        self.done = True
+        await self._store._finish(self, response, interaction_id)
+
+    async def abandon(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        await self._store._finish(self, None, None)
+
+class IdempotencyStore:
+    """Reserva de chaves no banco (vale entre workers) e, no worker, o futuro da requisição em andamento
+    para que as repetições esperem por ela em vez de consultar o banco"""
+
+    def __init__(self):
+        self._inflight: Dict[Tuple[int, str], Tuple[str, "asyncio.Future"]] = {}
+
+    async def claim(self, user_id: int, key: str, fingerprint: str) -> IdempotencyClaim:
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise InvalidIdempotencyKeyError()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            inflight = self._inflight.get((user_id, key))
+            if inflight is not None:
+                inflight_fingerprint, future = inflight
+                if inflight_fingerprint != fingerprint:
+                    raise IdempotencyMismatchError()
+                try:
+                    response = await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    raise IdempotencyInProgressError()
+                if response is not None:
+                    return IdempotencyClaim(self, user_id, key, replay=response)
+                # A original falhou e liberou a chave: esta requisição tenta executar o turno
+                continue
+            state, response = await asyncio.to_thread(_claim_row, user_id, key, fingerprint)
+            if state == _OWNER:
+                self._inflight[(user_id, key)] = (fingerprint, loop.create_future())
+                return IdempotencyClaim(self, user_id, key)
+            if state == COMPLETED:
+                return IdempotencyClaim(self, user_id, key, replay=response)
+            # Em andamento em outro worker: consulta o banco até concluir, ser liberada ou acabar o prazo
+            if loop.time() >= deadline:
+                raise IdempotencyInProgressError()
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    async def _finish(self, claim: IdempotencyClaim, response: Optional[Dict[str, Any]], interaction_id: Optional[int]) -> None:
+        try:
+            # Protegido do cancelamento da requisição: a chave não fica presa se o cliente desconectar
+            if response is not None:
+                await asyncio.shield(asyncio.to_thread(_complete_row, claim.user_id, claim.key, response, interaction_id))
+            else:
+                await asyncio.shield(asyncio.to_thread(_release_row, claim.user_id, claim.key))
+        finally:
+            inflight = self._inflight.pop((claim.user_id, claim.key), None)
+            if inflight is not None and not inflight[1].done():
+                inflight[1].set_result(response)
+
+idempotency_store = IdempotencyStore()
+
+def purge_expired_idempotency_keys() -> int:
+    db = SessionLocal()
+    try:
+        deleted = db.query(IdempotencyKey).filter(IdempotencyKey.expires_at <= _utcnow()).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    except Exception as e:
+        db.rollback()
+        print(f"[IDEMPOTENCY] Erro ao remover chaves expiradas: {str(e)}")
+        return 0
+    finally:
+        db.close()
+
+async def run_idempotency_purger() -> None:
+    """Tarefa iniciada no startup: remove as chaves expiradas a cada IDEMPOTENCY_PURGE_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        await asyncio.to_thread(purge_expired_idempotency_keys)
@@ -0,0 +1,90 @@
+from typing import Optional, List, Dict, Any
+from sqlalchemy import and_
+from sqlalchemy.orm import Session, contains_eager
+from models import Game, GameSession, PlayerBoard, SessionInteraction, SessionNarrativeState
+from schemas import InteractionCreate
+from services.llm_registry import LLMConfigSnapshot
+from services.response_cache import CachedResponse
+
+class InteractionContext:
+    """Dados que um turno precisa, carregados em uma única consulta"""
+
+    __slots__ = ("session", "content_version", "narrative_state", "board", "is_first_interaction")
+
+    def __init__(self, session: GameSession, content_version: int, board: Optional[PlayerBoard], is_first_interaction: bool):
+        self.session = session
+        self.content_version = content_version
+        self.narrative_state = session.narrative_state
+        self.board = board
+        self.is_first_interaction = is_first_interaction
+
+def load_interaction_context(db: Session, session_id: int, player_id: int) -> Optional[InteractionContext]:
+    """Sessão, versão do conteúdo do jogo, estado narrativo e tabuleiro do jogador em um só SELECT"""
+    row = db.query(GameSession, Game.content_version, PlayerBoard).join(
+        Game, Game.id == GameSession.game_id
+    ).outerjoin(
+        SessionNarrativeState, SessionNarrativeState.session_id == GameSession.id
+    ).outerjoin(
+        PlayerBoard, and_(PlayerBoard.session_id == GameSession.id, PlayerBoard.player_id == player_id)
+    ).options(
+        contains_eager(GameSession.narrative_state)
+    ).filter(
+        GameSession.id == session_id,
+        GameSession.player_id == player_id
+    ).first()
+    if not row:
+        return None
+    session, content_version, board = row
+    if session.narrative_state is not None:
+        is_first_interaction = not session.narrative_state.turn_count
+    else:
+        # Sessões anteriores ao estado narrativo persistido
+        is_first_interaction = db.query(SessionInteraction.id).filter(
+            SessionInteraction.session_id == session.id
+        ).first() is None
+    return InteractionContext(session, content_version or 0, board, is_first_interaction)
+
+class PreparedTurn:
+    """Resultado da fase de leitura: tudo o que as fases de LLM e de escrita precisam, sem acesso ao banco"""
+
+    __slots__ = (
+        "interaction_data", "turn_objects", "refresh_memory", "extracted_features", "dice_response",
+        "llm_config", "system_prompt", "user_prompt", "context", "prompt_sections",
+        "cache_key", "cached_response", "system_prefix_chars", "llm_candidates",
+    )
+
+    def __init__(
+        self,
+        interaction_data: InteractionCreate,
+        turn_objects: List[Any],
+        refresh_memory: bool,
+        extracted_features: Optional[Dict[str, Any]],
+        dice_response: Optional[str],
+        llm_config: Optional[LLMConfigSnapshot],
+        system_prompt: str,
+        user_prompt: str,
+        context: Dict[str, Any],
+        prompt_sections: List[Dict[str, Any]],
+        cache_key: Optional[str] = None,
+        cached_response: Optional[CachedResponse] = None,
+        system_prefix_chars: int = 0,
+        llm_candidates: Optional[List[LLMConfigSnapshot]] = None,
+    ):
+        # turn_objects[0] é a sessão; os demais são o estado narrativo e, na rolagem de dados, o tabuleiro e seus eventos
+        self.interaction_data = interaction_data
+        self.turn_objects = turn_objects
+        self.refresh_memory = refresh_memory
+        self.extracted_features = extracted_features
+        self.dice_response = dice_response
+        self.llm_config = llm_config
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.context = context
+        self.prompt_sections = prompt_sections
+        # Turno cacheável: chave semântica e, se houver, a resposta já em cache
+        self.cache_key = cache_key
+        self.cached_response = cached_response
+        # Tamanho do prefixo estável do prompt de sistema (cache de prompt do provider)
+        self.system_prefix_chars = system_prefix_chars
+        # Configuração da sessão seguida das alternativas do mesmo jogo (failover)
+        self.llm_candidates = llm_candidates or ([llm_config] if llm_config else [])
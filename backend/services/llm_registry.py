@@ -0,0 +1,118 @@
+from typing import Optional, Dict, List, Tuple, Any
+import asyncio
+import os
+import threading
+import time
+import httpx
+import openai
+from anthropic import AsyncAnthropic
+from sqlalchemy.orm import Session
+from models import LLMConfiguration, LLMProvider
+
+# Configurações em cache por worker; alterações feitas pelas rotas de admin invalidam o cache local
+# na hora e os demais workers recarregam após o TTL
+LLM_CONFIG_CACHE_TTL = float(os.getenv("LLM_CONFIG_CACHE_TTL", "30"))
+# Chamadas simultâneas por provider (LLM_MAX_CONCURRENCY_OPENAI, LLM_MAX_CONCURRENCY_ANTHROPIC)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+class LLMConfigSnapshot:
+    """Cópia somente leitura de uma LLMConfiguration (sem os contadores de uso)"""
+
+    __slots__ = ("id", "game_id", "provider", "model_name", "api_key", "is_active", "cost_per_token", "max_tokens", "temperature")
+
+    def __init__(self, config: LLMConfiguration):
+        self.id = config.id
+        self.game_id = config.game_id
+        self.provider = config.provider
+        self.model_name = config.model_name
+        self.api_key = config.api_key
+        self.is_active = config.is_active
+        self.cost_per_token = config.cost_per_token
+        self.max_tokens = config.max_tokens
+        self.temperature = config.temperature
+
+class LLMProviderRegistry:
+    """Registro do processo: configurações em cache, um cliente assíncrono por provider/chave e limite de concorrência"""
+
+    def __init__(self):
+        self._configs: Optional[List[LLMConfigSnapshot]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[LLMProvider, str], Any] = {}
+        self._semaphores: Dict[LLMProvider, asyncio.Semaphore] = {}
+
+    def configs(self, db: Session) -> List[LLMConfigSnapshot]:
+        configs = self._configs
+        if configs is not None and time.monotonic() - self._loaded_at < LLM_CONFIG_CACHE_TTL:
+            return configs
+        with self._lock:
+            if self._configs is None or time.monotonic() - self._loaded_at >= LLM_CONFIG_CACHE_TTL:
+                rows = db.query(LLMConfiguration).order_by(LLMConfiguration.id).all()
+                self._configs = [LLMConfigSnapshot(row) for row in rows]
+                self._loaded_at = time.monotonic()
+            return self._configs
+
+    def invalidate(self) -> None:
+        """Chamar nas rotas que criam, alteram, ativam ou removem configurações"""
+        with self._lock:
+            self._configs = None
+
+    def resolve(self, db: Session, config_id: Optional[int] = None, session_llm_provider: Optional[str] = None, session_llm_model: Optional[str] = None) -> Optional[LLMConfigSnapshot]:
+        configs = self.configs(db)
+        if config_id:
+            # Quando config_id é fornecido, buscar diretamente por ID (não precisa estar ativa)
+            return next((config for config in configs if config.id == config_id), None)
+        if session_llm_provider and session_llm_model:
+            try:
+                provider_enum = LLMProvider(session_llm_provider) if isinstance(session_llm_provider, str) else session_llm_provider
+                config = next((
+                    config for config in configs
+                    if config.provider == provider_enum and config.model_name == session_llm_model
+                ), None)
+                if config:
+                    return config
+            except (ValueError, AttributeError):
+                pass
+        # Fallback para LLM ativa
+        return next((config for config in configs if config.is_active), None)
+
+    def _http_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT),
+        )
+
+    def client(self, config: Any) -> Any:
+        """Cliente assíncrono reutilizado (pool de conexões HTTP com keep-alive) por provider e chave de API.
+        As novas tentativas ficam a cargo do agendador em llm_service, não do SDK."""
+        key = (config.provider, config.api_key)
+        client = self._clients.get(key)
+        if client is None:
+            if config.provider == LLMProvider.OPENAI:
+                client = openai.AsyncOpenAI(api_key=config.api_key, http_client=self._http_client(), max_retries=0)
+            elif config.provider == LLMProvider.ANTHROPIC:
+                client = AsyncAnthropic(api_key=config.api_key, http_client=self._http_client(), max_retries=0)
+            else:
+                raise ValueError(f"Provider {config.provider} não suportado")
+            self._clients[key] = client
+        return client
+
+    def slot(self, provider: LLMProvider) -> asyncio.Semaphore:
+        """Semáforo que limita as chamadas simultâneas ao provider neste worker"""
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            limit = int(os.getenv(f"LLM_MAX_CONCURRENCY_{provider.name}", str(LLM_MAX_CONCURRENCY)))
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
+
+llm_registry = LLMProviderRegistry()
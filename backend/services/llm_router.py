@@ -0,0 +1,261 @@
+from typing import Optional, Dict, Any, List, AsyncIterator
+from collections import deque
+import asyncio
+import math
+import os
+import time
+from sqlalchemy.orm import Session
+from services.llm_registry import llm_registry, LLMConfigSnapshot
+from services.llm_service import LLMService, LLMOverloadedError
+from services.llm_usage import usage_buffer
+
+# Saúde por configuração (por worker): janela das últimas chamadas
+LLM_HEALTH_WINDOW = int(os.getenv("LLM_HEALTH_WINDOW", "100"))
+# Disjuntor: abre com N falhas seguidas ou taxa de erro alta na janela; reabre para teste após o cooldown
+LLM_BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("LLM_BREAKER_CONSECUTIVE_FAILURES", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_MIN_SAMPLES = int(os.getenv("LLM_BREAKER_MIN_SAMPLES", "10"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Failover para outras configurações do mesmo jogo
+LLM_FAILOVER_ENABLED = os.getenv("LLM_FAILOVER_ENABLED", "true").lower() == "true"
+LLM_FAILOVER_MAX_BACKUPS = int(os.getenv("LLM_FAILOVER_MAX_BACKUPS", "2"))
+# Requisição de cobertura (hedge): se a resposta demorar mais que o limite, dispara uma segunda e usa a primeira que chegar.
+# LLM_HEDGE_AFTER=0 usa o p95 da configuração (mínimo LLM_HEDGE_MIN_DELAY)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class LLMUnavailableError(LLMOverloadedError):
+    """Todas as configurações candidatas estão com o disjuntor aberto"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.args = ("Serviço de LLM indisponível no momento. Tente novamente em instantes.",)
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+class ConfigHealth:
+    """Latência (p50/p95), taxa de erro e disjuntor de uma configuração"""
+
+    def __init__(self):
+        self.latencies: deque = deque(maxlen=LLM_HEALTH_WINDOW)
+        self.outcomes: deque = deque(maxlen=LLM_HEALTH_WINDOW)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    @property
+    def p50(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 0.95)
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(LLM_BREAKER_COOLDOWN - (time.monotonic() - self.opened_at)))
+
+    def available(self) -> bool:
+        """Pode receber chamadas agora (sem reservar o teste do meio-aberto)"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= LLM_BREAKER_COOLDOWN
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return True
+
+    def acquire(self) -> bool:
+        if not self.available():
+            return False
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # Apenas uma chamada de teste por vez com o disjuntor meio-aberto
+            self.probing = True
+        return True
+
+    def release(self) -> None:
+        """Chamada cancelada (perdeu o hedge) sem resultado"""
+        self.probing = False
+
+    def record_success(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.probing = False
+        self.state = CLOSED
+
+    def record_failure(self) -> None:
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= LLM_BREAKER_CONSECUTIVE_FAILURES or (
+            len(self.outcomes) >= LLM_BREAKER_MIN_SAMPLES and self.error_rate >= LLM_BREAKER_ERROR_RATE
+        ):
+            if self.state != OPEN:
+                print(f"[LLM] Disjuntor aberto (erros seguidos: {self.consecutive_failures}, taxa de erro: {self.error_rate:.0%})")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"latency_p50": self.p50, "latency_p95": self.p95, "error_rate": self.error_rate, "circuit_state": self.state}
+
+class LLMRouter:
+    """Escolhe a configuração de cada chamada: disjuntor por configuração, failover dentro do jogo e hedge opcional"""
+
+    def __init__(self):
+        self._health: Dict[int, ConfigHealth] = {}
+
+    def health(self, config: LLMConfigSnapshot) -> ConfigHealth:
+        health = self._health.get(config.id)
+        if health is None:
+            health = ConfigHealth()
+            self._health[config.id] = health
+        return health
+
+    def health_snapshot(self, config_id: int) -> Dict[str, Any]:
+        health = self._health.get(config_id)
+        return health.snapshot() if health else ConfigHealth().snapshot()
+
+    def candidates(self, db: Session, primary: Optional[LLMConfigSnapshot]) -> List[LLMConfigSnapshot]:
+        """Configuração da sessão primeiro; depois as demais do mesmo jogo, das mais saudáveis às menos"""
+        if primary is None:
+            return []
+        if not LLM_FAILOVER_ENABLED:
+            return [primary]
+        backups = [
+            config for config in llm_registry.configs(db)
+            if config.game_id == primary.game_id and config.id != primary.id
+        ]
+        backups.sort(key=lambda config: (
+            not self.health(config).available(),
+            self.health(config).error_rate,
+            self.health(config).p95 or 0.0,
+            not config.is_active,
+        ))
+        return [primary] + backups[:LLM_FAILOVER_MAX_BACKUPS]
+
+    def _unavailable(self, candidates: List[LLMConfigSnapshot]) -> LLMUnavailableError:
+        return LLMUnavailableError(min((self.health(config).retry_after() for config in candidates), default=1))
+
+    def _hedge_delay(self, config: LLMConfigSnapshot) -> float:
+        if LLM_HEDGE_AFTER > 0:
+            return LLM_HEDGE_AFTER
+        return max(LLM_HEDGE_MIN_DELAY, self.health(config).p95 or 0.0)
+
+    async def _attempt(self, service: LLMService, config: LLMConfigSnapshot, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        health = self.health(config)
+        started = time.monotonic()
+        try:
+            result = await service.generate_with_config(config, *args, **kwargs)
+        except asyncio.CancelledError:
+            health.release()
+            raise
+        except LLMOverloadedError:
+            # Fila cheia é limitação local, não falha do provider
+            health.release()
+            raise
+        except Exception:
+            health.record_failure()
+            usage_buffer.record_failure(config.id)
+            raise
+        health.record_success(time.monotonic() - started)
+        usage_buffer.record_success(config.id, result["tokens_used"], result["cost"], result["response_time"], result.get("cache_read_tokens", 0), result.get("cache_write_tokens", 0))
+        result["config_id"] = config.id
+        return result
+
+    async def _hedged(self, service: LLMService, config: LLMConfigSnapshot, remaining: List[LLMConfigSnapshot], *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        pending = {asyncio.create_task(self._attempt(service, config, *args, **kwargs))}
+        last_error: Optional[BaseException] = None
+        # Tudo dentro do try: se a requisição for cancelada (inclusive durante a espera do hedge),
+        # o finally cancela as tentativas e libera a vaga no circuit breaker
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay(config))
+            if not done:
+                # Cobertura em outra configuração saudável do jogo ou, sem alternativa, na mesma
+                backup = next((candidate for candidate in remaining if self.health(candidate).acquire()), None)
+                if backup is not None:
+                    remaining.remove(backup)
+                elif self.health(config).available():
+                    backup = config
+                if backup is not None:
+                    pending.add(asyncio.create_task(self._attempt(service, backup, *args, **kwargs)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    async def generate(self, service: LLMService, candidates: List[LLMConfigSnapshot], prompt: str, system_prompt: Optional[str] = None, context: Optional[Dict[str, Any]] = None, prefix_chars: int = 0) -> Dict[str, Any]:
+        """Como LLMService.generate_with_config, com failover; o resultado indica a configuração usada (config_id)"""
+        remaining = list(candidates)
+        last_error: Optional[BaseException] = None
+        while remaining:
+            config = remaining.pop(0)
+            if not self.health(config).acquire():
+                continue
+            try:
+                if LLM_HEDGE_ENABLED:
+                    return await self._hedged(service, config, remaining, prompt, system_prompt, context, prefix_chars=prefix_chars)
+                return await self._attempt(service, config, prompt, system_prompt, context, prefix_chars=prefix_chars)
+            except Exception as e:
+                last_error = e
+                if remaining:
+                    print(f"[LLM] Falha na configuração {config.id} ({str(e)}); tentando outra configuração do jogo")
+        if last_error is not None:
+            raise last_error
+        raise self._unavailable(candidates)
+
+    async def stream(self, service: LLMService, candidates: List[LLMConfigSnapshot], prompt: str, system_prompt: Optional[str] = None, context: Optional[Dict[str, Any]] = None, prefix_chars: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Como LLMService.stream_with_config, com failover enquanto nenhum trecho foi enviado (sem hedge)"""
+        last_error: Optional[BaseException] = None
+        for config in candidates:
+            health = self.health(config)
+            if not health.acquire():
+                continue
+            started = False
+            try:
+                async for chunk in service.stream_with_config(config, prompt, system_prompt, context, prefix_chars=prefix_chars):
+                    if chunk["type"] == "delta":
+                        started = True
+                    else:
+                        health.record_success(chunk["response_time"])
+                        usage_buffer.record_success(config.id, chunk["tokens_used"], chunk["cost"], chunk["response_time"], chunk.get("cache_read_tokens", 0), chunk.get("cache_write_tokens", 0))
+                        chunk["config_id"] = config.id
+                    yield chunk
+                return
+            except LLMOverloadedError as e:
+                health.release()
+                last_error = e
+            except Exception as e:
+                health.record_failure()
+                usage_buffer.record_failure(config.id)
+                if started:
+                    raise
+                last_error = e
+            except BaseException:
+                # Cliente desconectou (aclose do gerador: GeneratorExit/CancelledError): libera a vaga de teste do meio-aberto
+                health.release()
+                raise
+        if last_error is not None:
+            raise last_error
+        raise self._unavailable(candidates)
+
+llm_router = LLMRouter()
@@ -1,94 +1,359 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Tuple, Union, List, Callable, Awaitable
+from contextlib import asynccontextmanager
 from sqlalchemy.orm import Session
+import asyncio
+import hashlib
+import math
+import os
+import random
 import time
+import anthropic
+import httpx
 import openai
-from anthropic import Anthropic
-from models import LLMConfiguration, LLMProvider
+from models import LLMProvider
+from services.llm_registry import llm_registry, LLMConfigSnapshot
+from services.local_llm import local_llm
+from services.llm_usage import usage_buffer
+
+# Custo dos tokens lidos/gravados no cache de prompt do provider, relativo ao token de entrada normal
+PROMPT_CACHE_COST_FACTORS = {
+    LLMProvider.OPENAI: (0.5, 1.0),
+    LLMProvider.ANTHROPIC: (0.1, 1.25),
+}
+
+# Agendador das chamadas ao narrador: fila e limite de requisições simultâneas por configuração,
+# novas tentativas com backoff exponencial dentro do prazo da requisição e rejeição (503) com fila cheia
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "45"))
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class LLMOverloadedError(Exception):
+    """Fila da configuração cheia ou sem vaga dentro do prazo: o cliente deve tentar de novo depois"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("O narrador está com muitas requisições no momento. Tente novamente em instantes.")
+        self.retry_after = retry_after
+
+class LLMDeadlineError(Exception):
+    """Prazo da requisição esgotado (incluindo espera na fila e novas tentativas)"""
+
+def is_transient_error(error: Optional[BaseException]) -> bool:
+    """Timeouts, falhas de conexão, limite de taxa e erros 5xx do provider (segue a cadeia de causas)"""
+    while error is not None:
+        if isinstance(error, (TimeoutError, httpx.TimeoutException, httpx.NetworkError, openai.APIConnectionError, anthropic.APIConnectionError)):
+            return True
+        if getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES:
+            return True
+        error = error.__cause__
+    return False
+
+class _ConfigQueue:
+    __slots__ = ("semaphore", "waiting", "avg_latency")
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+        self.waiting = 0
+        self.avg_latency = 0.0
+
+class LLMRequestScheduler:
+    """Controle de admissão por LLMConfiguration (por worker)"""
+
+    def __init__(self):
+        self._queues: Dict[int, _ConfigQueue] = {}
+
+    def _queue(self, config: LLMConfigSnapshot) -> _ConfigQueue:
+        queue = self._queues.get(config.id)
+        if queue is None:
+            queue = _ConfigQueue()
+            self._queues[config.id] = queue
+        return queue
+
+    def retry_after(self, config: LLMConfigSnapshot) -> int:
+        """Estimativa em segundos para a fila atual esvaziar"""
+        queue = self._queue(config)
+        latency = queue.avg_latency or 2.0
+        return max(1, math.ceil(latency * (queue.waiting + 1) / LLM_MAX_IN_FLIGHT))
+
+    def check_admission(self, config: LLMConfigSnapshot) -> None:
+        queue = self._queue(config)
+        if queue.semaphore.locked() and queue.waiting >= LLM_MAX_QUEUE:
+            raise LLMOverloadedError(self.retry_after(config))
+
+    @staticmethod
+    def deadline() -> float:
+        return asyncio.get_running_loop().time() + LLM_REQUEST_DEADLINE
+
+    @staticmethod
+    def remaining(deadline: float) -> float:
+        return deadline - asyncio.get_running_loop().time()
+
+    @asynccontextmanager
+    async def slot(self, config: LLMConfigSnapshot, deadline: float):
+        """Vaga na configuração e no provider; sem vaga até o prazo, rejeita com LLMOverloadedError"""
+        queue = self._queue(config)
+        provider_slot = llm_registry.slot(config.provider)
+        if queue.semaphore.locked():
+            # Sem vaga livre: entra na fila (limitada) até o prazo
+            self.check_admission(config)
+            queue.waiting += 1
+            try:
+                await asyncio.wait_for(queue.semaphore.acquire(), max(0.0, self.remaining(deadline)))
+            except asyncio.TimeoutError:
+                raise LLMOverloadedError(self.retry_after(config))
+            finally:
+                queue.waiting -= 1
+        else:
+            await queue.semaphore.acquire()
+        try:
+            await asyncio.wait_for(provider_slot.acquire(), max(0.0, self.remaining(deadline)))
+        except asyncio.TimeoutError:
+            queue.semaphore.release()
+            raise LLMOverloadedError(self.retry_after(config))
+        started = time.time()
+        try:
+            yield
+        finally:
+            provider_slot.release()
+            queue.semaphore.release()
+            elapsed = time.time() - started
+            queue.avg_latency = elapsed if not queue.avg_latency else queue.avg_latency * 0.9 + elapsed * 0.1
+
+    async def backoff(self, error: BaseException, attempt: int, deadline: float) -> None:
+        """Espera antes de uma nova tentativa; relança o erro se não for transitório ou não houver tempo"""
+        if attempt + 1 >= LLM_RETRY_ATTEMPTS or not is_transient_error(error):
+            raise error
+        delay = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        if self.remaining(deadline) <= delay:
+            raise error
+        print(f"[LLM] Erro transitório ({str(error)}); nova tentativa {attempt + 2} em {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def call(self, config: LLMConfigSnapshot, request: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Executa a chamada na vaga da configuração, com novas tentativas dentro do prazo"""
+        deadline = self.deadline()
+        async with self.slot(config, deadline):
+            attempt = 0
+            while True:
+                try:
+                    return await asyncio.wait_for(request(), max(0.0, self.remaining(deadline)))
+                except Exception as e:
+                    if self.remaining(deadline) <= 0:
+                        raise LLMDeadlineError(f"Tempo limite de {LLM_REQUEST_DEADLINE:.0f}s esgotado") from e
+                    await self.backoff(e, attempt, deadline)
+                    attempt += 1
+
+llm_scheduler = LLMRequestScheduler()
+
+def _usage_cost(config: LLMConfigSnapshot, usage: Dict[str, Any]) -> float:
+    if not config.cost_per_token:
+        return 0
+    read_factor, write_factor = PROMPT_CACHE_COST_FACTORS.get(config.provider, (1.0, 1.0))
+    billed = usage.get("tokens_used", 0) \
+        - usage.get("cache_read_tokens", 0) * (1 - read_factor) \
+        + usage.get("cache_write_tokens", 0) * (write_factor - 1)
+    return billed * config.cost_per_token
 
 class LLMService:
     def __init__(self, db: Session):
         self.db = db
     
-    def get_llm_config(self, config_id: Optional[int] = None, session_llm_provider: Optional[str] = None, session_llm_model: Optional[str] = None) -> Optional[LLMConfiguration]:
-        if config_id:
-            # Quando config_id é fornecido, buscar diretamente por ID (não precisa estar ativa)
-            return self.db.query(LLMConfiguration).filter(LLMConfiguration.id == config_id).first()
-        elif session_llm_provider and session_llm_model:
-            # Tentar encontrar a LLM específica da sessão
-            try:
-                # Converter string para enum se necessário
-                provider_enum = LLMProvider(session_llm_provider) if isinstance(session_llm_provider, str) else session_llm_provider
-                config = self.db.query(LLMConfiguration).filter(
-                    LLMConfiguration.provider == provider_enum,
-                    LLMConfiguration.model_name == session_llm_model
-                ).first()
-                if config:
-                    return config
-            except (ValueError, AttributeError):
-                # Se não conseguir converter, tenta buscar por string
-                pass
-        # Fallback para LLM ativa
-        return self.db.query(LLMConfiguration).filter(LLMConfiguration.is_active == True).first()
+    def get_llm_config(self, config_id: Optional[int] = None, session_llm_provider: Optional[str] = None, session_llm_model: Optional[str] = None) -> Optional[LLMConfigSnapshot]:
+        # Configurações em cache no worker; as rotas de admin invalidam o cache ao alterá-las
+        return llm_registry.resolve(self.db, config_id, session_llm_provider, session_llm_model)
     
     async def generate_response(self, prompt: str, system_prompt: Optional[str] = None, config_id: Optional[int] = None, context: Optional[Dict[str, Any]] = None, session_llm_provider: Optional[str] = None, session_llm_model: Optional[str] = None) -> Dict[str, Any]:
         config = self.get_llm_config(config_id, session_llm_provider, session_llm_model)
         if not config:
             raise ValueError("Nenhuma configuração de LLM ativa encontrada")
+        try:
+            result = await self.generate_with_config(config, prompt, system_prompt, context)
+        except LLMOverloadedError:
+            raise
+        except Exception:
+            usage_buffer.record_failure(config.id)
+            raise
+        usage_buffer.record_success(config.id, result["tokens_used"], result["cost"], result["response_time"], result["cache_read_tokens"], result["cache_write_tokens"])
+        return result
+
+    async def generate_with_config(self, config: LLMConfigSnapshot, prompt: str, system_prompt: Optional[str] = None, context: Optional[Dict[str, Any]] = None, prefix_chars: int = 0) -> Dict[str, Any]:
+        """Chama a LLM com uma configuração já carregada, sem acessar o banco durante a espera.
+
+        `prefix_chars` é o tamanho do prefixo estável do prompt de sistema, marcado como cacheável no provider.
+        """
+        start_time = time.time()
+        if config.provider == LLMProvider.OPENAI:
+            request = lambda: self._call_openai(prompt, system_prompt, config, context, prefix_chars)
+        elif config.provider == LLMProvider.ANTHROPIC:
+            request = lambda: self._call_anthropic(prompt, system_prompt, config, context, prefix_chars)
+        elif config.provider == LLMProvider.LOCAL:
+            request = lambda: local_llm.complete(config.model_name, prompt, system_prompt, context)
+        else:
+            raise ValueError(f"Provider {config.provider} não suportado")
+        response = await llm_scheduler.call(config, request)
+        response_time = time.time() - start_time
+        return {
+            "response": response["text"], "tokens_used": response.get("tokens_used", 0), "cost": _usage_cost(config, response),
+            "response_time": response_time, "provider": config.provider.value, "model": config.model_name,
+            "cache_read_tokens": response.get("cache_read_tokens", 0), "cache_write_tokens": response.get("cache_write_tokens", 0),
+        }
+
+    async def stream_with_config(self, config: LLMConfigSnapshot, prompt: str, system_prompt: Optional[str] = None, context: Optional[Dict[str, Any]] = None, prefix_chars: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Gera a resposta em trechos à medida que chegam ({"type": "delta"}); o último item ({"type": "done"})
+        traz o texto completo, o uso de tokens e o tempo até o primeiro trecho"""
         start_time = time.time()
+        first_token_time = None
+        parts = []
+        usage: Dict[str, Any] = {}
+        if config.provider == LLMProvider.OPENAI:
+            open_stream = lambda: self._stream_openai(prompt, system_prompt, config, context, prefix_chars)
+        elif config.provider == LLMProvider.ANTHROPIC:
+            open_stream = lambda: self._stream_anthropic(prompt, system_prompt, config, context, prefix_chars)
+        elif config.provider == LLMProvider.LOCAL:
+            open_stream = lambda: local_llm.stream(config.model_name, prompt, system_prompt, context)
+        else:
+            raise ValueError(f"Provider {config.provider} não suportado")
+        deadline = llm_scheduler.deadline()
+        async with llm_scheduler.slot(config, deadline):
+            attempt = 0
+            while True:
+                stream = open_stream()
+                try:
+                    while True:
+                        # O prazo vale até o primeiro trecho; depois disso o stream segue no ritmo do provider
+                        if parts:
+                            kind, value = await stream.__anext__()
+                        else:
+                            kind, value = await asyncio.wait_for(stream.__anext__(), max(0.0, llm_scheduler.remaining(deadline)))
+                        if kind == "usage":
+                            usage = value
+                            continue
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                        parts.append(value)
+                        yield {"type": "delta", "text": value}
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    await stream.aclose()
+                    # Só há nova tentativa antes do primeiro trecho enviado ao jogador
+                    if parts:
+                        raise
+                    if llm_scheduler.remaining(deadline) <= 0:
+                        raise LLMDeadlineError(f"Tempo limite de {LLM_REQUEST_DEADLINE:.0f}s esgotado") from e
+                    await llm_scheduler.backoff(e, attempt, deadline)
+                    attempt += 1
+        response_time = time.time() - start_time
+        yield {
+            "type": "done", "response": "".join(parts), "tokens_used": usage.get("tokens_used", 0), "cost": _usage_cost(config, usage),
+            "response_time": response_time, "first_token_time": first_token_time, "provider": config.provider.value, "model": config.model_name,
+            "cache_read_tokens": usage.get("cache_read_tokens", 0), "cache_write_tokens": usage.get("cache_write_tokens", 0),
+        }
+
+    def _openai_params(self, prompt: str, system_prompt: Optional[str], config: LLMConfigSnapshot, context: Optional[Dict[str, Any]], prefix_chars: int = 0) -> Dict[str, Any]:
+        # O cache automático da OpenAI reaproveita o início idêntico do prompt: o prefixo estável vem primeiro
+        # e o contexto da sessão fica depois dele
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        if context:
+            messages.append({"role": "system", "content": f"Contexto: {context}"})
+        messages.append({"role": "user", "content": prompt})
+        params = {
+            "model": config.model_name,
+            "messages": messages,
+            "temperature": config.temperature or 0.7
+        }
+        if config.max_tokens:
+            params["max_tokens"] = config.max_tokens
+        if system_prompt and prefix_chars:
+            # Direciona requisições com o mesmo prefixo para o mesmo cache
+            prefix_hash = hashlib.sha256(system_prompt[:prefix_chars].encode("utf-8")).hexdigest()[:16]
+            params["extra_body"] = {"prompt_cache_key": f"prefix-{prefix_hash}"}
+        return params
+
+    @staticmethod
+    def _openai_usage(usage: Any) -> Dict[str, Any]:
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "tokens_used": usage.total_tokens,
+            "cache_read_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            "cache_write_tokens": 0,
+        }
+
+    @staticmethod
+    def _anthropic_system(system_prompt: Optional[str], context: Optional[Dict[str, Any]], prefix_chars: int) -> Union[str, List[Dict[str, Any]]]:
+        """Prompt de sistema em blocos: o prefixo estável com cache_control e o restante (seções dinâmicas e contexto) sem cache"""
+        system_message = system_prompt or ""
+        if context:
+            system_message += f"\n\nContexto: {context}"
+        if not prefix_chars or not system_prompt:
+            return system_message
+        blocks: List[Dict[str, Any]] = [{"type": "text", "text": system_message[:prefix_chars], "cache_control": {"type": "ephemeral"}}]
+        rest = system_message[prefix_chars:]
+        if rest.strip():
+            blocks.append({"type": "text", "text": rest})
+        return blocks
+
+    @staticmethod
+    def _anthropic_usage(usage: Any) -> Dict[str, Any]:
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return {
+            "tokens_used": usage.input_tokens + usage.output_tokens + cache_read + cache_write,
+            "cache_read_tokens": cache_read,
+            "cache_write_tokens": cache_write,
+        }
+
+    async def _call_openai(self, prompt: str, system_prompt: Optional[str], config: LLMConfigSnapshot, context: Optional[Dict[str, Any]], prefix_chars: int = 0) -> Dict[str, Any]:
         try:
-            if config.provider == LLMProvider.OPENAI:
-                response = await self._call_openai(prompt, system_prompt, config, context)
-            elif config.provider == LLMProvider.ANTHROPIC:
-                response = await self._call_anthropic(prompt, system_prompt, config, context)
-            else:
-                raise ValueError(f"Provider {config.provider} não suportado")
-            response_time = time.time() - start_time
-            tokens_used = response.get("tokens_used", 0)
-            cost = tokens_used * config.cost_per_token if config.cost_per_token else 0
-            config.total_requests += 1
-            config.total_tokens += tokens_used
-            config.total_cost += cost
-            if config.avg_response_time == 0:
-                config.avg_response_time = response_time
-            else:
-                config.avg_response_time = (config.avg_response_time * 0.9) + (response_time * 0.1)
-            self.db.commit()
-            return {"response": response["text"], "tokens_used": tokens_used, "cost": cost, "response_time": response_time, "provider": config.provider.value, "model": config.model_name}
+            client = llm_registry.client(config)
+            params = self._openai_params(prompt, system_prompt, config, context, prefix_chars)
+            response = await client.chat.completions.create(**params)
+            return {"text": response.choices[0].message.content, **self._openai_usage(response.usage)}
         except Exception as e:
-            raise Exception(f"Erro ao gerar resposta: {str(e)}")
+            raise Exception(f"Erro ao chamar OpenAI: {str(e)}") from e
     
-    async def _call_openai(self, prompt: str, system_prompt: Optional[str], config: LLMConfiguration, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    @staticmethod
+    def _anthropic_params(prompt: str, config: LLMConfigSnapshot, system_message: Any) -> Dict[str, Any]:
+        params = {"model": config.model_name, "max_tokens": config.max_tokens or 1024, "system": system_message, "messages": [{"role": "user", "content": prompt}]}
+        # O SDK rejeita temperature=None: sem valor configurado, vale o padrão do provider
+        if config.temperature is not None:
+            params["temperature"] = config.temperature
+        return params
+
+    async def _call_anthropic(self, prompt: str, system_prompt: Optional[str], config: LLMConfigSnapshot, context: Optional[Dict[str, Any]], prefix_chars: int = 0) -> Dict[str, Any]:
+        client = llm_registry.client(config)
+        system_message = self._anthropic_system(system_prompt, context, prefix_chars)
+        response = await client.messages.create(**self._anthropic_params(prompt, config, system_message))
+        return {"text": response.content[0].text, **self._anthropic_usage(response.usage)}
+    
+    async def _stream_openai(self, prompt: str, system_prompt: Optional[str], config: LLMConfigSnapshot, context: Optional[Dict[str, Any]], prefix_chars: int = 0) -> AsyncIterator[Tuple[str, Any]]:
         try:
-            client = openai.OpenAI(api_key=config.api_key)
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            if context:
-                messages.append({"role": "system", "content": f"Contexto: {context}"})
-            messages.append({"role": "user", "content": prompt})
-            
-            # Preparar parâmetros
-            params = {
-                "model": config.model_name,
-                "messages": messages,
-                "temperature": config.temperature or 0.7
-            }
-            if config.max_tokens:
-                params["max_tokens"] = config.max_tokens
-            
-            response = client.chat.completions.create(**params)
-            return {"text": response.choices[0].message.content, "tokens_used": response.usage.total_tokens}
+            client = llm_registry.client(config)
+            params = self._openai_params(prompt, system_prompt, config, context, prefix_chars)
+            stream = await client.chat.completions.create(**params, stream=True, stream_options={"include_usage": True})
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield "text", chunk.choices[0].delta.content
+                if chunk.usage:
+                    yield "usage", self._openai_usage(chunk.usage)
         except Exception as e:
-            raise Exception(f"Erro ao chamar OpenAI: {str(e)}")
-    
-    async def _call_anthropic(self, prompt: str, system_prompt: Optional[str], config: LLMConfiguration, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
-        client = Anthropic(api_key=config.api_key)
-        system_message = system_prompt or ""
-        if context:
-            system_message += f"\n\nContexto: {context}"
-        response = client.messages.create(model=config.model_name, max_tokens=config.max_tokens or 1024, temperature=config.temperature, system=system_message, messages=[{"role": "user", "content": prompt}])
-        return {"text": response.content[0].text, "tokens_used": response.usage.input_tokens + response.usage.output_tokens}
-    
+            raise Exception(f"Erro ao chamar OpenAI: {str(e)}") from e
+
+    async def _stream_anthropic(self, prompt: str, system_prompt: Optional[str], config: LLMConfigSnapshot, context: Optional[Dict[str, Any]], prefix_chars: int = 0) -> AsyncIterator[Tuple[str, Any]]:
+        client = llm_registry.client(config)
+        system_message = self._anthropic_system(system_prompt, context, prefix_chars)
+        async with client.messages.stream(**self._anthropic_params(prompt, config, system_message)) as stream:
+            async for text in stream.text_stream:
+                yield "text", text
+            message = await stream.get_final_message()
+        yield "usage", self._anthropic_usage(message.usage)
+
     def build_game_context(self, session_id: int, current_scenario: Optional[Any] = None, game_rules: Optional[list] = None) -> Dict[str, Any]:
         context = {"language": "pt-BR", "session_id": session_id}
         if current_scenario:
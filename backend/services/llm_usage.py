@@ -0,0 +1,179 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+import asyncio
+import os
+import threading
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import LLMConfiguration, LLMUsageRollup
+
+# Uso das LLMs acumulado em memória no worker e gravado a cada intervalo:
+# uma linha nova em llm_usage_rollups (só inserção) e um UPDATE atômico de incremento nos totais da configuração
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "10"))
+
+# Limites (segundos) das faixas do histograma de latência; a última faixa é aberta
+LATENCY_BUCKETS = [0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 45.0, 60.0]
+
+def _bucket(latency: float) -> int:
+    for index, limit in enumerate(LATENCY_BUCKETS):
+        if latency <= limit:
+            return index
+    return len(LATENCY_BUCKETS)
+
+def histogram_percentile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Percentil aproximado pelo limite superior da faixa (a faixa aberta usa o último limite)"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target = fraction * total
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= target:
+            return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+    return LATENCY_BUCKETS[-1]
+
+class _UsageCounters:
+    __slots__ = (
+        "requests", "failures", "tokens_used", "cost", "cache_read_tokens", "cache_write_tokens",
+        "cache_hits", "cache_saved_tokens", "latency_sum", "histogram",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.tokens_used = 0
+        self.cost = 0.0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.cache_hits = 0
+        self.cache_saved_tokens = 0
+        self.latency_sum = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+class LLMUsageBuffer:
+    """Contadores de uso por configuração, trocados por novos a cada gravação"""
+
+    def __init__(self):
+        self._counters: Dict[int, _UsageCounters] = {}
+        self._period_start = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+
+    def _get(self, config_id: int) -> _UsageCounters:
+        counters = self._counters.get(config_id)
+        if counters is None:
+            counters = _UsageCounters()
+            self._counters[config_id] = counters
+        return counters
+
+    def record_success(self, config_id: int, tokens_used: int, cost: float, response_time: float, cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> None:
+        with self._lock:
+            counters = self._get(config_id)
+            counters.requests += 1
+            counters.tokens_used += tokens_used or 0
+            counters.cost += cost or 0.0
+            counters.cache_read_tokens += cache_read_tokens or 0
+            counters.cache_write_tokens += cache_write_tokens or 0
+            counters.latency_sum += response_time or 0.0
+            counters.histogram[_bucket(response_time or 0.0)] += 1
+
+    def record_failure(self, config_id: int) -> None:
+        with self._lock:
+            self._get(config_id).failures += 1
+
+    def record_cache_hit(self, config_id: int, saved_tokens: int) -> None:
+        with self._lock:
+            counters = self._get(config_id)
+            counters.cache_hits += 1
+            counters.cache_saved_tokens += saved_tokens or 0
+
+    def drain(self):
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            period_start, self._period_start = self._period_start, datetime.now(timezone.utc)
+        return period_start, self._period_start, counters
+
+    def restore(self, counters: Dict[int, _UsageCounters]) -> None:
+        """Devolve ao buffer os contadores de uma gravação que falhou"""
+        with self._lock:
+            for config_id, old in counters.items():
+                current = self._get(config_id)
+                for name in _UsageCounters.__slots__:
+                    if name == "histogram":
+                        current.histogram = [a + b for a, b in zip(current.histogram, old.histogram)]
+                    else:
+                        setattr(current, name, getattr(current, name) + getattr(old, name))
+
+usage_buffer = LLMUsageBuffer()
+
+def flush_llm_usage() -> None:
+    """Grava o uso acumulado no worker (uma transação curta por intervalo)"""
+    period_start, period_end, counters = usage_buffer.drain()
+    if not counters:
+        return
+    db = SessionLocal()
+    try:
+        existing = {row.id for row in db.query(LLMConfiguration.id).filter(LLMConfiguration.id.in_(list(counters))).all()}
+        for config_id, c in counters.items():
+            if config_id not in existing:
+                # Configuração removida desde a chamada
+                continue
+            db.add(LLMUsageRollup(
+                llm_config_id=config_id, period_start=period_start, period_end=period_end,
+                requests=c.requests, failures=c.failures, tokens_used=c.tokens_used, cost=c.cost,
+                cache_read_tokens=c.cache_read_tokens, cache_write_tokens=c.cache_write_tokens,
+                cache_hits=c.cache_hits, cache_saved_tokens=c.cache_saved_tokens,
+                latency_sum=c.latency_sum, latency_histogram=c.histogram,
+            ))
+            previous_requests = func.coalesce(LLMConfiguration.total_requests, 0)
+            db.query(LLMConfiguration).filter(LLMConfiguration.id == config_id).update({
+                LLMConfiguration.total_requests: previous_requests + c.requests,
+                LLMConfiguration.total_tokens: func.coalesce(LLMConfiguration.total_tokens, 0) + c.tokens_used,
+                LLMConfiguration.total_cost: func.coalesce(LLMConfiguration.total_cost, 0.0) + c.cost,
+                LLMConfiguration.total_cache_read_tokens: func.coalesce(LLMConfiguration.total_cache_read_tokens, 0) + c.cache_read_tokens,
+                LLMConfiguration.total_cache_write_tokens: func.coalesce(LLMConfiguration.total_cache_write_tokens, 0) + c.cache_write_tokens,
+                LLMConfiguration.cache_hits: func.coalesce(LLMConfiguration.cache_hits, 0) + c.cache_hits,
+                LLMConfiguration.cache_saved_tokens: func.coalesce(LLMConfiguration.cache_saved_tokens, 0) + c.cache_saved_tokens,
+                # Média ponderada pelo número de requisições (todas as expressões usam os valores anteriores da linha)
+                LLMConfiguration.avg_response_time: case(
+                    (previous_requests + c.requests == 0, func.coalesce(LLMConfiguration.avg_response_time, 0.0)),
+                    else_=(func.coalesce(LLMConfiguration.avg_response_time, 0.0) * previous_requests + c.latency_sum) / (previous_requests + c.requests)
+                ),
+            }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        usage_buffer.restore(counters)
+        print(f"[LLM_USAGE] Erro ao gravar uso das LLMs: {str(e)}")
+    finally:
+        db.close()
+
+async def run_usage_flusher() -> None:
+    """Tarefa iniciada no startup: grava o buffer a cada LLM_USAGE_FLUSH_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(LLM_USAGE_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_llm_usage)
+
+def usage_rollup(db: Session, since: datetime) -> Dict[int, Dict[str, Any]]:
+    """Soma das linhas de uso por configuração desde `since`, com taxa de sucesso e percentis de latência"""
+    rows = db.query(LLMUsageRollup).filter(LLMUsageRollup.period_end >= since).all()
+    totals: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        total = totals.setdefault(row.llm_config_id, {"requests": 0, "failures": 0, "histogram": [0] * (len(LATENCY_BUCKETS) + 1)})
+        total["requests"] += row.requests or 0
+        total["failures"] += row.failures or 0
+        for index, count in enumerate((row.latency_histogram or [])[:len(total["histogram"])]):
+            total["histogram"][index] += count
+    result: Dict[int, Dict[str, Any]] = {}
+    for config_id, total in totals.items():
+        attempts = total["requests"] + total["failures"]
+        result[config_id] = {
+            "window_requests": total["requests"],
+            "window_failures": total["failures"],
+            "success_rate": total["requests"] / attempts if attempts else 0.0,
+            "latency_p50": histogram_percentile(total["histogram"], 0.50),
+            "latency_p95": histogram_percentile(total["histogram"], 0.95),
+            "latency_p99": histogram_percentile(total["histogram"], 0.99),
+        }
+    return result
@@ -0,0 +1,140 @@
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+from services.prompt_builder import estimate_tokens
+
+# Provider simulado (LLMProvider.LOCAL) para testes de carga e benchmarks sem rede.
+# Mesma entrada (modelo, prompts, contexto) => mesmo texto e mesma latência; falhas seguem a sequência da semente.
+LOCAL_LLM_SEED = os.getenv("LOCAL_LLM_SEED", "0")
+# Latência total em ms: "fixed", "uniform" (média ± jitter) ou "lognormal" (média com cauda longa)
+LOCAL_LLM_LATENCY_DIST = os.getenv("LOCAL_LLM_LATENCY_DIST", "lognormal")
+LOCAL_LLM_LATENCY_MS = float(os.getenv("LOCAL_LLM_LATENCY_MS", "800"))
+LOCAL_LLM_LATENCY_JITTER_MS = float(os.getenv("LOCAL_LLM_LATENCY_JITTER_MS", "300"))
+# Streaming: tempo até o primeiro trecho, intervalo entre trechos e palavras por trecho
+LOCAL_LLM_FIRST_TOKEN_MS = float(os.getenv("LOCAL_LLM_FIRST_TOKEN_MS", "250"))
+LOCAL_LLM_CHUNK_MS = float(os.getenv("LOCAL_LLM_CHUNK_MS", "35"))
+LOCAL_LLM_CHUNK_WORDS = max(1, int(os.getenv("LOCAL_LLM_CHUNK_WORDS", "3")))
+# Tamanho da resposta em frases
+LOCAL_LLM_SENTENCES = max(1, int(os.getenv("LOCAL_LLM_SENTENCES", "4")))
+# Falhas injetadas: fração das chamadas que falham na hora ou ficam presas até o timeout
+LOCAL_LLM_ERROR_RATE = float(os.getenv("LOCAL_LLM_ERROR_RATE", "0"))
+LOCAL_LLM_TIMEOUT_RATE = float(os.getenv("LOCAL_LLM_TIMEOUT_RATE", "0"))
+LOCAL_LLM_TIMEOUT_S = float(os.getenv("LOCAL_LLM_TIMEOUT_S", "30"))
+
+SCENE_LINE_RE = re.compile(r"Cena atual:\s*(.+)")
+
+OPENINGS = [
+    "O narrador respira fundo e continua a história.",
+    "Uma brisa atravessa o cenário enquanto o narrador retoma a palavra.",
+    "Os sons ao redor mudam e a aventura segue adiante.",
+    "O narrador sorri e observa a escolha com atenção.",
+]
+MIDDLES = [
+    "Os elementos da natureza parecem responder ao que foi dito.",
+    "Algo novo surge no horizonte, convidando a explorar mais um pouco.",
+    "Cada decisão deixa uma marca no tabuleiro e no caminho de vocês.",
+    "Uma pista escondida brilha por um instante e depois some.",
+    "O reino guarda segredos que só aparecem para quem presta atenção.",
+    "Um personagem misterioso acena de longe, sem dizer uma palavra.",
+]
+CLOSINGS = [
+    "O que vocês querem fazer agora?",
+    "Qual será o próximo passo?",
+    "Para onde a aventura deve seguir?",
+    "Vocês preferem investigar ou seguir em frente?",
+]
+
+class SimulatedTimeout(TimeoutError):
+    pass
+
+class SimulatedProviderError(Exception):
+    # Tratado como erro transitório do provider (5xx)
+    status_code = 503
+
+class LocalLLMSimulator:
+    """Narrador determinístico: texto ciente da cena, latência configurável e falhas injetadas"""
+
+    def __init__(self):
+        # Falhas sorteadas por chamada (sequência reproduzível pela semente), para que novas tentativas possam ter sucesso
+        self._failures = random.Random(LOCAL_LLM_SEED)
+
+    def _rng(self, model: str, prompt: str, system_prompt: Optional[str], context: Optional[Dict[str, Any]]) -> random.Random:
+        key = "\x1f".join([LOCAL_LLM_SEED, model or "", system_prompt or "", str(context or ""), prompt or ""])
+        return random.Random(int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big"))
+
+    def _scene(self, system_prompt: Optional[str], context: Optional[Dict[str, Any]]) -> Optional[str]:
+        scenario = (context or {}).get("scenario")
+        if isinstance(scenario, dict) and scenario.get("name"):
+            return scenario["name"]
+        match = SCENE_LINE_RE.search(system_prompt or "")
+        return match.group(1).strip()[:80] if match else None
+
+    def _latency(self, rng: random.Random) -> float:
+        mean = LOCAL_LLM_LATENCY_MS
+        jitter = LOCAL_LLM_LATENCY_JITTER_MS
+        if LOCAL_LLM_LATENCY_DIST == "fixed" or mean <= 0:
+            value = mean
+        elif LOCAL_LLM_LATENCY_DIST == "uniform":
+            value = rng.uniform(mean - jitter, mean + jitter)
+        else:
+            # Lognormal com a média informada; o jitter define o desvio
+            sigma = min(2.0, jitter / mean) if jitter > 0 else 0.0
+            value = rng.lognormvariate(0, sigma) * mean / math.exp(sigma * sigma / 2)
+        return max(0.0, value) / 1000
+
+    def _text(self, rng: random.Random, prompt: str, scene: Optional[str]) -> str:
+        sentences: List[str] = []
+        opening = rng.choice(OPENINGS)
+        sentences.append(f"[{scene}] {opening}" if scene else opening)
+        player_input = " ".join((prompt or "").split())
+        if player_input:
+            sentences.append(f"Você disse: \"{player_input[:120]}\".")
+        while len(sentences) < LOCAL_LLM_SENTENCES:
+            sentences.append(rng.choice(MIDDLES))
+        sentences.append(rng.choice(CLOSINGS))
+        return " ".join(sentences)
+
+    def _plan(self, model: str, prompt: str, system_prompt: Optional[str], context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        rng = self._rng(model, prompt, system_prompt, context)
+        failure_roll = self._failures.random()
+        text = self._text(rng, prompt, self._scene(system_prompt, context))
+        input_tokens = estimate_tokens(system_prompt or "") + estimate_tokens(str(context or "")) + estimate_tokens(prompt or "")
+        return {
+            "latency": self._latency(rng),
+            "error": failure_roll < LOCAL_LLM_ERROR_RATE,
+            "timeout": LOCAL_LLM_ERROR_RATE <= failure_roll < LOCAL_LLM_ERROR_RATE + LOCAL_LLM_TIMEOUT_RATE,
+            "text": text,
+            "tokens_used": input_tokens + estimate_tokens(text),
+        }
+
+    async def _fail_if_planned(self, plan: Dict[str, Any]) -> None:
+        if plan["timeout"]:
+            await asyncio.sleep(LOCAL_LLM_TIMEOUT_S)
+            raise SimulatedTimeout(f"Tempo esgotado (simulado) após {LOCAL_LLM_TIMEOUT_S:.0f}s")
+        if plan["error"]:
+            await asyncio.sleep(plan["latency"] / 4)
+            raise SimulatedProviderError("Falha simulada do provider local")
+
+    async def complete(self, model: str, prompt: str, system_prompt: Optional[str], context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        plan = self._plan(model, prompt, system_prompt, context)
+        await self._fail_if_planned(plan)
+        await asyncio.sleep(plan["latency"])
+        return {"text": plan["text"], "tokens_used": plan["tokens_used"]}
+
+    async def stream(self, model: str, prompt: str, system_prompt: Optional[str], context: Optional[Dict[str, Any]]) -> AsyncIterator[Tuple[str, Any]]:
+        plan = self._plan(model, prompt, system_prompt, context)
+        await self._fail_if_planned(plan)
+        await asyncio.sleep(LOCAL_LLM_FIRST_TOKEN_MS / 1000)
+        words = plan["text"].split(" ")
+        for start in range(0, len(words), LOCAL_LLM_CHUNK_WORDS):
+            if start:
+                await asyncio.sleep(LOCAL_LLM_CHUNK_MS / 1000)
+            chunk = " ".join(words[start:start + LOCAL_LLM_CHUNK_WORDS])
+            yield "text", chunk if start == 0 else " " + chunk
+        yield "usage", {"tokens_used": plan["tokens_used"]}
+
+local_llm = LocalLLMSimulator()
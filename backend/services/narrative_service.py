@@ -0,0 +1,380 @@
+from typing import Optional, Dict, Any, List, Iterable
+from datetime import datetime
+import re
+import unicodedata
+from sqlalchemy.orm import Session
+from models import GameSession, SessionInteraction, SessionNarrativeState, Scenario, ScenarioSegment
+
+def normalize_text(text: str) -> str:
+    if not text:
+        return ""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join([c for c in normalized if not unicodedata.combining(c)]).lower()
+
+def sanitize_scene_text(content: str) -> str:
+    """Remove do texto da cena os blocos marcados como instrução interna (não exibir ao jogador)"""
+    if not content:
+        return ""
+    lines: List[str] = []
+    skip_block = False
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            if not skip_block:
+                lines.append(line)
+            continue
+        normalized = normalize_text(stripped)
+        if normalized.startswith("nao exibir ao jogador"):
+            skip_block = True
+            continue
+        if skip_block:
+            continue
+        if normalized.startswith("a partir daqui") or normalized.startswith("a ia ") or normalized.startswith("se for "):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def split_scene_segments(content: str) -> List[str]:
+    """Divide a cena em trechos; cada trecho termina na pergunta feita ao jogador"""
+    if not content:
+        return []
+    content = sanitize_scene_text(content)
+    if not content:
+        return []
+    segments: List[str] = []
+    current: List[str] = []
+    question_seen = False
+    for line in content.splitlines():
+        if question_seen and "?" in line:
+            chunk = "\n".join(current).strip()
+            if chunk:
+                segments.append(chunk)
+            current = [line]
+            question_seen = "?" in line
+            continue
+        current.append(line)
+        if "?" in line:
+            question_seen = True
+    if current:
+        chunk = "\n".join(current).strip()
+        if chunk:
+            segments.append(chunk)
+    return segments
+
+def selected_element(text: str) -> Optional[str]:
+    normalized = normalize_text(text)
+    if "agua" in normalized:
+        return "agua"
+    if "fogo" in normalized:
+        return "fogo"
+    if "terra" in normalized:
+        return "terra"
+    if "ar" in normalized:
+        return "ar"
+    return None
+
+def build_scene_segments(content: str) -> List[Dict[str, Any]]:
+    """Segmenta a cena e calcula a posição de cada trecho no texto sanitizado"""
+    sanitized = sanitize_scene_text(content)
+    segments: List[Dict[str, Any]] = []
+    cursor = 0
+    for position, chunk in enumerate(split_scene_segments(content)):
+        start = sanitized.find(chunk, cursor)
+        if start < 0:
+            start = cursor
+        end = start + len(chunk)
+        segments.append({"position": position, "content": chunk, "start_offset": start, "end_offset": end})
+        cursor = end
+    return segments
+
+class InMemorySegmentSource:
+    """Segmenta `file_content` em memória (usado na reconstrução do estado e em cenas sem trechos gravados)"""
+
+    def __init__(self):
+        self._segments: Dict[int, List[str]] = {}
+
+    def segments_for(self, scene: Any) -> List[str]:
+        cached = self._segments.get(scene.id)
+        if cached is None:
+            cached = split_scene_segments(scene.file_content) if scene.file_content else []
+            self._segments[scene.id] = cached
+        return cached
+
+    def segment_at(self, scene: Any, index: int) -> Optional[str]:
+        segments = self.segments_for(scene)
+        return segments[index] if index < len(segments) else None
+
+class ScenarioSegmentStore:
+    """Lê trechos pré-calculados da tabela scenario_segments, um por (scenario_id, posição)"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._fetched: Dict[tuple, Optional[str]] = {}
+        self._unsegmented = InMemorySegmentSource()
+
+    def rebuild(self, scenario: Scenario) -> int:
+        """Recalcula os trechos da cena; chamar sempre que file_content mudar"""
+        if scenario.id is None:
+            self.db.flush()
+        self.db.query(ScenarioSegment).filter(ScenarioSegment.scenario_id == scenario.id).delete(synchronize_session=False)
+        segments = build_scene_segments(scenario.file_content or "")
+        for segment in segments:
+            self.db.add(ScenarioSegment(scenario_id=scenario.id, **segment))
+        scenario.segment_count = len(segments)
+        self.db.add(scenario)
+        return len(segments)
+
+    def segment_at(self, scene: Any, index: int) -> Optional[str]:
+        count = getattr(scene, "segment_count", None)
+        if count is None:
+            # Cena ainda não segmentada (fora do catálogo, p. ex. inativa): segmenta em memória sem gravar,
+            # pois a fase de leitura é descartada; a gravação fica com o catálogo, o admin e build_scenario_segments.py
+            return self._unsegmented.segment_at(scene, index)
+        if index >= count:
+            return None
+        key = (scene.id, index)
+        if key not in self._fetched:
+            row = self.db.query(ScenarioSegment.content).filter(
+                ScenarioSegment.scenario_id == scene.id,
+                ScenarioSegment.position == index
+            ).first()
+            self._fetched[key] = row.content if row else None
+        return self._fetched[key]
+
+ELEMENTS = ("agua", "fogo", "terra", "ar")
+
+class SceneIndex:
+    """Índice das cenas de um jogo com nomes normalizados uma única vez.
+
+    Resolve prefixos ("Cena 0A", "Cena 01"), portal por elemento, cena de introdução e
+    próxima cena da ordem com consultas a dicionários em vez de varrer todas as cenas.
+    """
+
+    __slots__ = ("scenes", "_by_id", "_by_prefix", "_norm_names", "_portals", "_next", "_intro_ids", "intro")
+
+    def __init__(self, scenes: List[Any]):
+        self.scenes = scenes
+        self._by_id: Dict[int, Any] = {}
+        self._by_prefix: Dict[str, Any] = {}
+        self._norm_names: List[tuple] = []
+        self._intro_ids = set()
+        intro_prefixes = (normalize_text("Introdução"), normalize_text("Introducao"))
+        for scene in scenes:
+            name = normalize_text(scene.name)
+            self._by_id[scene.id] = scene
+            self._norm_names.append((name, scene))
+            # Todos os prefixos do nome apontam para a primeira cena (na ordem) que os possui
+            for size in range(1, len(name) + 1):
+                self._by_prefix.setdefault(name[:size], scene)
+            if name.startswith(intro_prefixes):
+                self._intro_ids.add(scene.id)
+        self.intro = self.scene_by_prefix("Introdução") or self.scene_by_contains("Introducao")
+        self._portals: Dict[str, Any] = {}
+        for element in ELEMENTS:
+            portal = self._find_portal(element)
+            if portal:
+                self._portals[element] = portal
+        self._next: Dict[int, Any] = {}
+        for name, scene in self._norm_names:
+            next_scene = self._find_next(name)
+            if next_scene:
+                self._next[scene.id] = next_scene
+
+    def scene_by_id(self, scenario_id: Optional[int]) -> Optional[Any]:
+        if not scenario_id:
+            return None
+        return self._by_id.get(scenario_id)
+
+    def scene_by_prefix(self, prefix: str) -> Optional[Any]:
+        target = normalize_text(prefix)
+        if not target:
+            return self.scenes[0] if self.scenes else None
+        return self._by_prefix.get(target)
+
+    def scene_by_contains(self, text: str) -> Optional[Any]:
+        target = normalize_text(text)
+        for name, scene in self._norm_names:
+            if target in name:
+                return scene
+        return None
+
+    def is_intro_scene(self, scene: Any) -> bool:
+        if scene.id in self._by_id:
+            return scene.id in self._intro_ids
+        return normalize_text(scene.name).startswith((normalize_text("Introdução"), normalize_text("Introducao")))
+
+    def portal_scene_for_element(self, element: Optional[str]) -> Optional[Any]:
+        if not element:
+            return None
+        return self._portals.get(element) or self._find_portal(element)
+
+    def next_scene_by_order(self, scene: Any) -> Optional[Any]:
+        if scene.id in self._by_id:
+            return self._next.get(scene.id)
+        # Cena fora do índice (ex.: desativada durante a sessão)
+        return self._find_next(normalize_text(scene.name))
+
+    def _find_portal(self, element: str) -> Optional[Any]:
+        targets = [
+            f"Cena 0A - Portal da {element}",
+            f"Cena 0A - Portal do {element}",
+            f"Portal da {element}",
+            f"Portal do {element}",
+        ]
+        for target in targets:
+            scene = self.scene_by_contains(target)
+            if scene:
+                return scene
+        return None
+
+    def _find_next(self, current_name: str) -> Optional[Any]:
+        if current_name.startswith(normalize_text("Cena 0A")):
+            return self.scene_by_prefix("Cena 0B")
+        if current_name.startswith(normalize_text("Cena 0B")):
+            return self.scene_by_prefix("Cena 01 - Temperança") or self.scene_by_prefix("Cena 01")
+        match = re.search(r"cena\s*(\d{2})", current_name)
+        if match:
+            current_number = int(match.group(1))
+            next_number = current_number + 1
+            return self.scene_by_prefix(f"Cena {next_number:02d}")
+        return None
+
+class NarrativeEngine:
+    """Máquina de estados das cenas: escolha do portal pelo elemento e avanço por trechos.
+
+    Opera sobre qualquer objeto com `id` e `name` (modelos Scenario ou snapshots do catálogo);
+    o texto dos trechos vem da fonte de segmentos.
+    """
+
+    def __init__(self, scenes: Any, segment_source: Optional[Any] = None):
+        self.index = scenes if isinstance(scenes, SceneIndex) else SceneIndex(list(scenes))
+        self.scenarios = self.index.scenes
+        self.segment_source = segment_source or InMemorySegmentSource()
+
+    def scene_by_id(self, scenario_id: Optional[int]) -> Optional[Any]:
+        return self.index.scene_by_id(scenario_id)
+
+    def intro_scene(self) -> Optional[Any]:
+        return self.index.intro
+
+    def segment_at(self, scene: Optional[Any], index: int) -> Optional[str]:
+        if not scene or index < 0:
+            return None
+        return self.segment_source.segment_at(scene, index)
+
+    def advance(self, scene: Optional[Any], index: int, player_input: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "scene": scene,
+            "index": index,
+            "scene_changed": False,
+            "decision_reason": "manter_cena",
+            "element": selected_element(player_input),
+        }
+        if not scene:
+            return result
+        if self.index.is_intro_scene(scene) and result["element"]:
+            portal_scene = self.index.portal_scene_for_element(result["element"])
+            if portal_scene:
+                scene = portal_scene
+                index = 0
+                result.update({
+                    "scene": scene,
+                    "index": index,
+                    "scene_changed": True,
+                    "decision_reason": "selecionou_elemento",
+                })
+        next_segment = self.segment_at(scene, index)
+        if not result["scene_changed"] and next_segment is None:
+            next_scene = self.index.next_scene_by_order(scene)
+            if next_scene:
+                scene = next_scene
+                index = 0
+                next_segment = self.segment_at(scene, index)
+                result.update({
+                    "scene": scene,
+                    "index": index,
+                    "scene_changed": True,
+                    "decision_reason": "fim_da_cena",
+                })
+        result["next_segment"] = next_segment or ""
+        # O trecho apresentado neste turno é consumido; sem trecho o índice permanece
+        result["next_index"] = index + 1 if next_segment is not None else index
+        # Turno que só apresenta o trecho da cena, sem depender da escolha do jogador:
+        # a resposta pode ser reaproveitada entre sessões (cache de narração)
+        result["cacheable"] = bool(next_segment) and not result["element"]
+        return result
+
+    def simulate(self, player_inputs: Iterable[str], base_scene: Optional[Any]) -> Dict[str, Any]:
+        """Reconstrói o estado narrativo reproduzindo as entradas do jogador em ordem"""
+        scene = base_scene
+        index = 0
+        element = None
+        history: List[Dict[str, Any]] = []
+        for turn, player_input in enumerate(player_inputs):
+            decision = self.advance(scene, index, player_input or "")
+            scene = decision["scene"]
+            index = decision.get("next_index", index)
+            if decision["scene_changed"]:
+                if decision["decision_reason"] == "selecionou_elemento":
+                    element = decision["element"]
+                history.append(_history_entry(decision, turn))
+        return {"scene": scene, "index": index, "element": element, "history": history}
+
+def _history_entry(decision: Dict[str, Any], turn: int) -> Dict[str, Any]:
+    scene = decision.get("scene")
+    return {
+        "turn": turn,
+        "scenario_id": scene.id if scene else None,
+        "reason": decision.get("decision_reason"),
+        "element": decision.get("element"),
+        "at": datetime.utcnow().isoformat(),
+    }
+
+class NarrativeStateService:
+    """Persistência do estado narrativo da sessão (cena, trecho, elemento e decisões)"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_or_backfill(self, session: GameSession, engine: NarrativeEngine, base_scene: Optional[Any]) -> SessionNarrativeState:
+        # Usa o estado já carregado com a sessão (joined) quando disponível
+        state = session.narrative_state
+        if state:
+            return state
+        return self.backfill(session, engine, base_scene)
+
+    def backfill(self, session: GameSession, engine: NarrativeEngine, base_scene: Optional[Any]) -> SessionNarrativeState:
+        """Reconstrói o estado a partir das interações existentes (sessões anteriores ao estado persistido)"""
+        rows = self.db.query(SessionInteraction.player_input).filter(
+            SessionInteraction.session_id == session.id
+        ).order_by(SessionInteraction.created_at.asc()).all()
+        simulated = engine.simulate([row.player_input for row in rows], base_scene)
+        scene = simulated["scene"]
+        # Mantém o índice salvo na sessão, como fazia a reconstrução a cada turno
+        index = session.current_scene_index if session.current_scene_index is not None else simulated["index"]
+        state = SessionNarrativeState(
+            session=session,
+            scenario_id=scene.id if scene else None,
+            segment_index=index,
+            selected_element=simulated["element"],
+            decision_history=simulated["history"],
+            turn_count=len(rows),
+        )
+        # Sem flush: o INSERT acontece junto com a gravação do turno
+        self.db.add(state)
+        return state
+
+    def apply_decision(self, state: SessionNarrativeState, decision: Dict[str, Any]) -> SessionNarrativeState:
+        """Registra o resultado do turno; a versão é incrementada no flush (controle otimista)"""
+        scene = decision.get("scene")
+        if scene is not None:
+            state.scenario_id = scene.id
+        state.segment_index = decision.get("next_index", state.segment_index)
+        if decision.get("scene_changed"):
+            if decision.get("decision_reason") == "selecionou_elemento":
+                state.selected_element = decision.get("element")
+            # Lista nova para que o SQLAlchemy detecte a alteração na coluna JSON
+            state.decision_history = list(state.decision_history or []) + [_history_entry(decision, state.turn_count or 0)]
+        state.turn_count = (state.turn_count or 0) + 1
+        self.db.add(state)
+        return state
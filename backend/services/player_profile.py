@@ -0,0 +1,180 @@
+from typing import Optional, Dict, Any, List
+import re
+from sqlalchemy.orm import Session
+from models import GameSession, SessionInteraction
+from services.narrative_service import normalize_text
+
+NUMBER_WORDS = {
+    "um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3,
+    "quatro": 4, "cinco": 5, "seis": 6, "sete": 7, "oito": 8,
+    "nove": 9, "dez": 10, "onze": 11, "doze": 12, "treze": 13,
+    "catorze": 14, "quatorze": 14, "quinze": 15, "dezesseis": 16,
+    "dezessete": 17, "dezoito": 18, "dezenove": 19, "vinte": 20
+}
+
+MIN_AGE = 3
+MAX_AGE = 120
+
+# Padrões compilados uma única vez; os de número por extenso rodam sobre o texto normalizado (sem acentos)
+PLAYER_RE = re.compile(r"jogador\s*\d+\s*[:\-]\s*([A-Za-zÀ-ÿ' -]+?)\s*(?:,|\-|\(|\s)\s*(\d{1,3})\s*anos?\)?", re.IGNORECASE)
+# Idade em dígitos apenas com o contexto "anos", para não confundir com números de cena ou de jogador;
+# "há 5 anos" / "faz 5 anos" falam de tempo, não de idade
+AGE_DIGITS_RE = re.compile(r"(?<!\bha )(?<!\bfaz )\b(\d{1,3})\s*anos?\b")
+# Por extenso só com "tenho": "um ano atrás" e "há dois anos" não são idade
+AGE_WORDS_RE = re.compile(r"\btenho\s+([a-z]+)\s+anos?\b")
+NAME_RE = re.compile(r"\b(?:(?:me chamo|meu nome é|meu nome e|chamo-me)\s+|nome\s*[:\-]\s*)([A-Za-zÀ-ÿ' -]+)", re.IGNORECASE)
+# "sou ..." também aparece em frases comuns ("sou corajoso"): só vale enquanto o jogador não disse o nome
+SELF_NAME_RE = re.compile(r"\bsou\s+(?:o\s+|a\s+)?([A-Za-zÀ-ÿ' -]+)", re.IGNORECASE)
+NAME_END_RE = re.compile(r"(\s+e\s+|\s+tenho\s+|,|\.|;)")
+COUNT_DIGITS_RE = re.compile(r"\b(somos|temos)\s*(\d{1,2})\b")
+COUNT_WORDS_RE = re.compile(r"\b(somos|temos)\s*([a-z]+)")
+COUNT_INLINE_DIGITS_RE = re.compile(r"\b(\d{1,2})\s+jogadores")
+COUNT_INLINE_WORDS_RE = re.compile(r"\b([a-z]+)\s+jogadores")
+
+def _valid_age(age: Optional[int]) -> Optional[int]:
+    if age is not None and MIN_AGE <= age <= MAX_AGE:
+        return age
+    return None
+
+def parse_players_list(text: str) -> List[Dict[str, Any]]:
+    """Lê listas no formato "Jogador 1: Gabriel, 11 anos" (uma por linha ou vários na mesma linha)"""
+    if not text:
+        return []
+    players = []
+    for line in text.splitlines():
+        for match in PLAYER_RE.finditer(line):
+            if _valid_age(int(match.group(2))):
+                players.append({"name": match.group(1).strip().title(), "age": int(match.group(2))})
+    return players
+
+def extract_age(text: str) -> Optional[int]:
+    if not text:
+        return None
+    normalized = normalize_text(text)
+    for match in AGE_DIGITS_RE.finditer(normalized):
+        age = _valid_age(int(match.group(1)))
+        if age:
+            return age
+    for match in AGE_WORDS_RE.finditer(normalized):
+        age = _valid_age(NUMBER_WORDS.get(match.group(1)))
+        if age:
+            return age
+    return None
+
+def _match_name(pattern: "re.Pattern", text: str) -> Optional[str]:
+    if not text:
+        return None
+    match = pattern.search(text)
+    if not match:
+        return None
+    name = NAME_END_RE.split(match.group(1).strip())[0].strip()
+    return name.title() or None
+
+def extract_player_name(text: str) -> Optional[str]:
+    """Nome declarado ("me chamo", "meu nome é", "nome:")"""
+    return _match_name(NAME_RE, text)
+
+def extract_self_name(text: str) -> Optional[str]:
+    """Nome informado com "sou ..." (pode ser só uma descrição do jogador)"""
+    return _match_name(SELF_NAME_RE, text)
+
+def extract_player_count(text: str) -> Optional[int]:
+    if not text:
+        return None
+    normalized = normalize_text(text)
+    match = COUNT_DIGITS_RE.search(normalized)
+    if match:
+        return int(match.group(2))
+    match = COUNT_WORDS_RE.search(normalized)
+    if match and NUMBER_WORDS.get(match.group(2)):
+        return NUMBER_WORDS[match.group(2)]
+    match = COUNT_INLINE_DIGITS_RE.search(normalized)
+    if match:
+        return int(match.group(1))
+    match = COUNT_INLINE_WORDS_RE.search(normalized)
+    if match:
+        return NUMBER_WORDS.get(match.group(1))
+    return None
+
+def extract_features(text: str) -> Dict[str, Any]:
+    """Extrai de uma mensagem do jogador apenas os dados de perfil encontrados"""
+    features: Dict[str, Any] = {}
+    if not text:
+        return features
+    players = parse_players_list(text)
+    if players:
+        features["players"] = players
+    age = extract_age(text)
+    if age:
+        features["age"] = age
+    name = extract_player_name(text)
+    if name:
+        features["name"] = name
+    else:
+        self_name = extract_self_name(text)
+        if self_name:
+            features["self_name"] = self_name
+    count = len(players) if players else extract_player_count(text)
+    if count:
+        features["count"] = count
+    return features
+
+def empty_profile() -> Dict[str, Any]:
+    return {"players": [], "declared_players": False, "name": None, "declared_name": False, "age": None, "count": None, "youngest_age": None}
+
+def merge_profile(profile: Optional[Dict[str, Any]], features: Dict[str, Any]) -> Dict[str, Any]:
+    """Combina o perfil salvo com os dados da nova mensagem (o dado mais recente prevalece)"""
+    merged = empty_profile()
+    merged.update(profile or {})
+    if features.get("players"):
+        merged["players"] = features["players"]
+        merged["declared_players"] = True
+    if features.get("name"):
+        merged["name"] = features["name"]
+        merged["declared_name"] = True
+    elif features.get("self_name") and not merged["declared_name"]:
+        merged["name"] = features["self_name"]
+    for key in ("age", "count"):
+        if features.get(key):
+            merged[key] = features[key]
+    if merged["count"] is None:
+        if merged["players"]:
+            merged["count"] = len(merged["players"])
+        elif merged["age"] and merged["name"]:
+            merged["count"] = 1
+    # Jogador único informado por nome e idade vira a lista de jogadores
+    if not merged["declared_players"] and merged["age"] and merged["name"]:
+        merged["players"] = [{"name": merged["name"], "age": merged["age"]}]
+    ages = [player["age"] for player in merged["players"] if isinstance(player.get("age"), int)]
+    if isinstance(merged["age"], int):
+        ages.append(merged["age"])
+    merged["youngest_age"] = min(ages) if ages else None
+    return merged
+
+class PlayerProfileService:
+    """Perfil dos jogadores persistido na sessão e atualizado uma vez por mensagem"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_or_backfill(self, session: GameSession) -> Dict[str, Any]:
+        if session.player_profile is not None:
+            return session.player_profile
+        # Sessões anteriores ao perfil persistido: reconstrói uma única vez a partir das interações
+        profile = empty_profile()
+        previous = self.db.query(SessionInteraction.player_input).filter(
+            SessionInteraction.session_id == session.id
+        ).order_by(SessionInteraction.created_at.asc(), SessionInteraction.id.asc()).all()
+        for row in previous:
+            profile = merge_profile(profile, extract_features(row.player_input or ""))
+        session.player_profile = profile
+        return profile
+
+    def apply_input(self, session: GameSession, player_input: str) -> Dict[str, Any]:
+        """Atualiza o perfil com a mensagem atual e retorna os dados extraídos dela"""
+        profile = self.get_or_backfill(session)
+        features = extract_features(player_input or "")
+        if features:
+            # Novo dicionário para o SQLAlchemy detectar a alteração na coluna JSON
+            session.player_profile = merge_profile(profile, features)
+        return features
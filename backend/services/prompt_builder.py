@@ -0,0 +1,204 @@
+from typing import Optional, Dict, Any, List, Tuple
+import math
+import threading
+from services.game_catalog import GameCatalog
+
+# Blocos fixos do prompt: iguais para todas as sessões de um jogo
+BASE_INSTRUCTIONS = "Você é um assistente de jogo interativo. Responda em português do Brasil de forma envolvente e imersiva."
+
+GAME_INSTRUCTIONS = (
+    "\n\nINSTRUÇÕES DO JOGO (SEMPRE ENVIAR):"
+    "\n- Os elementos do Jogo iniciados com o termo História, podem ser acessados apenas quando jogador pedir mais informações sobre a história de um reino específico."
+    "\n- Inicie pela Cena intitulada Introdução. Nela será solicitado ao jogador que forneça nome, idade e quantidade de jogadores."
+    "\n- Nesse ponto, considere diversas formas de receber esses dados, mas tenha como padrão o seguinte exemplo:"
+    "\n- Jogador 1: Gabriel, 11 anos"
+    "\n- Jogador 2: Sofia, 9 anos"
+    "\n- O exemplo acima indica que temos 2 jogadores na sala sendo que o primeiro é o Gabriel de 11 anos e o segundo é a Sofia de 9 anos."
+    "\n- Essa informação deve ser mantida durante todo o jogo, portanto a mantenha para interação com os jogadores da sala de jogo atual."
+    "\n- A LLM sempre recebe esses dados como contexto antes de trazer a próxima cena do jogo. Dessa forma, ela mantém um diálogo educado sempre chamando o jogador pelo nome e com o tom de de comunicação adequado à idade do jogador ou jogadores. Se tiver mais de um jogador, sempre considere a idade do jogador mais novo para o tom da conversação."
+    "\n- Uma vez tendo recebido os dados de nome do jogador, idade e quantidade de jogadores, sempre os mantenha no contexto enviado para a LLM e de modo a apoiar a seleção das próximas cenas, que também dependerão de respostas dos jogadores. Essas respostas devem ser registradas para manter o fluxo e saber para qual ponto retornar no fluxo do jogo e portanto, também devem sempre ser enviadas como contexto para LLM."
+    "\n- Use o arquivo Introdução até que jogador selecione um dos elementos (Ar, Fogo, Água ou Terra)."
+    "\n- Uma vez que nome, idade e quantidade de jogadores foi informado e um dos elementos selecionado (Ar, Fogo, Água ou Terra), passe para a sequência do arquivo de cena de acordo com o elemento selecionado."
+    "\n- O elemento selecionado pelo jogador deve indicar qual Portal será aberto, em outras palavras se jogador selecionar elemento Água, o arquivo a ser aberto será Cena 0A - Portal da Água, se selecionar elemento Terra, o arquivo a ser aberto será Cena 0A - Portal da Terra, e assim por diante com todos os demais. Nesse caso, apenas uma das Cenas 0A será apresentada de acordo com a seleção do elemento ar, fogo, água ou terra."
+    "\n- A partir disso, a interação segue o arquivo Cena 0A com o portal do elemento selecionado pelo jogador. Ao finalizar todo o fluxo deste arquivo a partir da conversa com o jogador e salvando suas respostas como contexto para a próxima interação com o jogador, siga para o arquivo cujo título inicia com Cena 0B."
+    "\n- Após apresentar todo o conteúdo do arquivo cujo título inicia com Cena 0B siga para o arquivo cujo título inicia com Cena 01 - Temperança."
+    "\n- A partir do arquivo de Cena 01-Temperança, siga em ordem crescente de cenas, ou seja, Cena 02 - Temperança, Cena 03 - Temperança, etc."
+    "\n- Todas as cenas do jogo são selecionadas de acordo com a resposta do jogador. Uma vez tendo entrado num arquivo de cena só mude para a próxima cena quando passar por todo o fluxo da cena."
+)
+
+OPENING_RULES_HEADER = "\n\nELEMENTOS DO JOGO (APENAS NO INÍCIO):"
+PROMPT_INSTRUCTION_TEMPLATE = "\n\nPROMPT DE INSTRUÇÃO:\n{text}\n"
+RULE_TEMPLATE = "\n\n{title}:\n{content}"
+
+PROFILE_HEADER = "\n\nINFORMAÇÕES DO JOGADOR (MANTER DURANTE TODO O JOGO):"
+HISTORY_RULES_HEADER = "\n\nHISTÓRIA DO REINO (APENAS QUANDO SOLICITADA):"
+MEMORY_SUMMARY_TEMPLATE = "\n\nRESUMO DA SESSÃO (TURNOS ANTERIORES):\n{summary}"
+RECENT_HISTORY_HEADER = "\n\nHISTÓRICO RECENTE DA SESSÃO (MANTER CONTEXTO):"
+SCENE_SEGMENT_TEMPLATE = "\n\nTRECHO DA CENA ATUAL (APRESENTAR INTEGRALMENTE):\n{segment}"
+NPC_CYCLE_TEMPLATE = (
+    "\n\nCICLO COGNITIVO DO NPC:"
+    "\nPercepção:"
+    "\n- Input do jogador: {player_input}"
+    "\n- Ambiente: cena atual = {scene_name}"
+    "\n- Próximo ponto de início: {segment}"
+    "\n- Próximo ponto de fim: {segment}"
+    "\nMemória:"
+    "\n- Confiança: {confidence:.2f}"
+    "\nDecisão:"
+    "\n- Cena atual: {scene_name}"
+    "{decision_details}"
+    "\nAção:"
+    "\n- Apresente apenas o trecho da cena correspondente ao próximo ponto de início/fim."
+    "\nFeedback:"
+    "\n- Responda ao jogador e finalize a interação para reiniciar o ciclo."
+)
+
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa simples de tokens (~4 caracteres por token)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+class StaticPrefix:
+    """Prefixo imutável do prompt de um jogo (instruções, regras iniciais e prompt de instrução)"""
+
+    __slots__ = ("version", "sections", "text")
+
+    def __init__(self, version: int, sections: List[Tuple[str, str]]):
+        self.version = version
+        self.sections = sections
+        self.text = "".join(text for _, text in sections)
+
+_prefixes: Dict[Tuple[int, bool], StaticPrefix] = {}
+_prefix_lock = threading.Lock()
+
+def _render_static_sections(catalog: GameCatalog, is_first_interaction: bool) -> List[Tuple[str, str]]:
+    sections = [("instrucoes", BASE_INSTRUCTIONS + GAME_INSTRUCTIONS)]
+    if is_first_interaction and catalog.opening_rules:
+        rules_text = "".join(
+            RULE_TEMPLATE.format(title=rule.title, content=rule.file_content)
+            for rule in catalog.opening_rules if rule.file_content
+        )
+        sections.append(("regras_iniciais", OPENING_RULES_HEADER + rules_text))
+    prompt_instruction = catalog.prompt_instruction
+    if prompt_instruction and prompt_instruction.file_content:
+        sections.append(("prompt_instrucao", PROMPT_INSTRUCTION_TEMPLATE.format(text=prompt_instruction.file_content)))
+    return sections
+
+def get_static_prefix(catalog: GameCatalog, is_first_interaction: bool) -> StaticPrefix:
+    """Retorna o prefixo do jogo, renderizado novamente apenas quando a versão do conteúdo muda"""
+    key = (catalog.game_id, is_first_interaction)
+    prefix = _prefixes.get(key)
+    if prefix is not None and prefix.version == catalog.version:
+        return prefix
+    with _prefix_lock:
+        prefix = _prefixes.get(key)
+        if prefix is None or prefix.version != catalog.version:
+            prefix = StaticPrefix(catalog.version, _render_static_sections(catalog, is_first_interaction))
+            _prefixes[key] = prefix
+    return prefix
+
+def render_player_profile(profile: Dict[str, Any]) -> str:
+    if not (profile.get("count") or profile.get("name") or profile.get("age") or profile.get("players")):
+        return ""
+    lines = [PROFILE_HEADER]
+    for idx, player in enumerate(profile.get("players") or [], start=1):
+        lines.append(f"\n- Jogador {idx}: {player.get('name')} ({player.get('age')} anos)")
+    if profile.get("count"):
+        lines.append(f"\n- Quantidade de jogadores: {profile['count']}")
+    if profile.get("name"):
+        lines.append(f"\n- Nome: {profile['name']}")
+    if profile.get("age"):
+        lines.append(f"\n- Idade: {profile['age']}")
+    if profile.get("youngest_age"):
+        lines.append(f"\n- Idade de referência para o tom: {profile['youngest_age']} anos (mais novo).")
+    if profile.get("age") or profile.get("players"):
+        lines.append("\n- Tom de linguagem deve ser adequado à idade do jogador.")
+    lines.append("\n- Não pergunte novamente por nome, idade ou quantidade de jogadores se já informado.")
+    return "".join(lines)
+
+def render_history_rules(catalog: GameCatalog, normalized_input: str) -> str:
+    """Histórias dos reinos, apenas quando o jogador pede detalhes de um reino específico"""
+    if not ("historia" in normalized_input and "reino" in normalized_input) or not catalog.history_rules:
+        return ""
+    # tentar filtrar por termos da pergunta
+    terms = [t for t in normalized_input.split() if len(t) > 3]
+    matched = [rule for rule in catalog.history_rules if any(t in rule.norm_title for t in terms)]
+    selected = matched or catalog.history_rules
+    return HISTORY_RULES_HEADER + "".join(
+        RULE_TEMPLATE.format(title=rule.title, content=rule.file_content)
+        for rule in selected if rule.file_content
+    )
+
+def render_memory_summary(summary: Optional[str]) -> str:
+    return MEMORY_SUMMARY_TEMPLATE.format(summary=summary) if summary else ""
+
+def render_recent_history(interactions: List[Any]) -> str:
+    if not interactions:
+        return ""
+    lines = [RECENT_HISTORY_HEADER]
+    for interaction in interactions:
+        if interaction.player_input:
+            lines.append(f"\n- Jogador: {interaction.player_input}")
+        if interaction.ai_response:
+            lines.append(f"\n- Narrador: {interaction.ai_response}")
+    return "".join(lines)
+
+def npc_confidence(profile: Dict[str, Any], element_selected: Optional[str], next_segment: str, scene_changed: bool) -> float:
+    confidence = 0.4
+    if profile.get("count") or profile.get("players") or (profile.get("name") and profile.get("age")):
+        confidence += 0.2
+    if element_selected:
+        confidence += 0.2
+    if next_segment:
+        confidence += 0.1
+    if scene_changed:
+        confidence += 0.1
+    return min(confidence, 0.99)
+
+def render_npc_cycle(
+    player_input: str,
+    scene_name: str,
+    next_segment: str,
+    confidence: float,
+    scene_changed: bool,
+    decision_reason: str,
+    element_selected: Optional[str],
+) -> str:
+    decision_details = ""
+    if scene_changed:
+        decision_details += f"\n- Transição aplicada: {decision_reason}"
+    if element_selected:
+        decision_details += f"\n- Elemento identificado: {element_selected}"
+    return NPC_CYCLE_TEMPLATE.format(
+        player_input=player_input,
+        scene_name=scene_name,
+        segment=next_segment or "N/A",
+        confidence=confidence,
+        decision_details=decision_details,
+    )
+
+def render_scene_segment(next_segment: str) -> str:
+    return SCENE_SEGMENT_TEMPLATE.format(segment=next_segment) if next_segment else ""
+
+class SystemPromptBuilder:
+    """Monta o prompt de sistema em camadas: prefixo estável primeiro, seções dinâmicas depois"""
+
+    def __init__(self, catalog: GameCatalog, is_first_interaction: bool):
+        self.prefix = get_static_prefix(catalog, is_first_interaction)
+        self.sections: List[Tuple[str, str]] = []
+
+    def add(self, name: str, text: str) -> "SystemPromptBuilder":
+        if text:
+            self.sections.append((name, text))
+        return self
+
+    def build(self) -> str:
+        return self.prefix.text + "".join(text for _, text in self.sections)
+
+    def section_sizes(self) -> List[Dict[str, Any]]:
+        """Tamanho de cada seção (caracteres e tokens estimados) para registrar na interação"""
+        return [
+            {"name": name, "chars": len(text), "tokens": estimate_tokens(text), "static": index < len(self.prefix.sections)}
+            for index, (name, text) in enumerate(self.prefix.sections + self.sections)
+        ]
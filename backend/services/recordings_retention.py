@@ -0,0 +1,215 @@
+from typing import Optional, Dict, Any, List, Set, Tuple
+from datetime import datetime, timezone
+from pathlib import Path
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import time
+from database import SessionLocal
+from models import SessionInteraction
+from services.audio_service import AudioService
+from services.tts_stream import manifest_filename
+
+# Retenção do volume de gravações: uploads de voz (recordings/audio) e áudio gerado (recordings/output)
+# são apagados depois do TTL de cada diretório, exceto os arquivos ainda apontados por
+# SessionInteraction.ai_response_audio_url. Os trechos mp3 de um manifesto referenciado podem sair:
+# /api/audio/stream/{id} sintetiza de novo o que faltar
+RECORDINGS_SWEEP_ENABLED = os.getenv("RECORDINGS_SWEEP_ENABLED", "true").lower() == "true"
+RECORDINGS_UPLOAD_TTL_HOURS = float(os.getenv("RECORDINGS_UPLOAD_TTL_HOURS", str(24 * 30)))
+RECORDINGS_OUTPUT_TTL_HOURS = float(os.getenv("RECORDINGS_OUTPUT_TTL_HOURS", str(24 * 7)))
+# Temporários de gravação atômica deixados por um worker interrompido
+RECORDINGS_TMP_TTL_HOURS = float(os.getenv("RECORDINGS_TMP_TTL_HOURS", "1"))
+RECORDINGS_SWEEP_INTERVAL = float(os.getenv("RECORDINGS_SWEEP_INTERVAL", "3600"))
+# Limite de ritmo: remoções por lote, pausa entre lotes e teto por execução
+RECORDINGS_SWEEP_BATCH = int(os.getenv("RECORDINGS_SWEEP_BATCH", "200"))
+RECORDINGS_SWEEP_PAUSE = float(os.getenv("RECORDINGS_SWEEP_PAUSE", "0.2"))
+RECORDINGS_SWEEP_MAX_DELETES = int(os.getenv("RECORDINGS_SWEEP_MAX_DELETES", "5000"))
+# Lock e resultado das execuções ficam no volume, compartilhados entre os workers
+RECORDINGS_STATE_DIR = Path(os.getenv("RECORDINGS_STATE_DIR", "./recordings"))
+
+_LOCK_FILE = ".retention.lock"
+_STATE_FILE = ".retention_state.json"
+_AUDIO_URL_PREFIX = "/api/audio/"
+_STREAM_URL_PREFIX = "/api/audio/stream/"
+
+def audio_reference(url: Optional[str]) -> Optional[str]:
+    """Nome do arquivo no diretório de saída apontado pela URL de áudio de uma interação"""
+    if not url:
+        return None
+    if url.startswith(_STREAM_URL_PREFIX):
+        return manifest_filename(url[len(_STREAM_URL_PREFIX):])
+    if url.startswith(_AUDIO_URL_PREFIX):
+        return url[len(_AUDIO_URL_PREFIX):]
+    return None
+
+def load_references() -> Set[str]:
+    db = SessionLocal()
+    try:
+        names: Set[str] = set()
+        rows = db.query(SessionInteraction.ai_response_audio_url).filter(
+            SessionInteraction.ai_response_audio_url.isnot(None)
+        ).yield_per(1000)
+        for (url,) in rows:
+            name = audio_reference(url)
+            if name:
+                names.add(name)
+        return names
+    finally:
+        db.close()
+
+def retention_dirs() -> List[Tuple[str, Path, float]]:
+    audio_service = AudioService()
+    return [
+        ("audio", audio_service.audio_upload_dir, RECORDINGS_UPLOAD_TTL_HOURS),
+        ("output", audio_service.audio_output_dir, RECORDINGS_OUTPUT_TTL_HOURS),
+    ]
+
+def _expired_files(directory: Path, ttl_hours: float, referenced: Set[str], limit: int) -> List[Tuple[str, int]]:
+    now = time.time()
+    expired: List[Tuple[str, int]] = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if len(expired) >= limit:
+                break
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            is_tmp = entry.name.startswith(".") and entry.name.endswith(".tmp")
+            max_age = (RECORDINGS_TMP_TTL_HOURS if is_tmp else ttl_hours) * 3600
+            if now - stat.st_mtime < max_age or entry.name in referenced:
+                continue
+            expired.append((entry.path, stat.st_size))
+    return expired
+
+def _delete_batch(batch: List[Tuple[str, int]]) -> Tuple[int, int]:
+    deleted = 0
+    reclaimed = 0
+    for path, size in batch:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Já removido por outra execução
+            continue
+        except OSError as e:
+            print(f"[RETENTION] Erro ao remover {path}: {str(e)}")
+            continue
+        deleted += 1
+        reclaimed += size
+    return deleted, reclaimed
+
+def _try_lock():
+    RECORDINGS_STATE_DIR.mkdir(parents=True, exist_ok=True)
+    handle = open(RECORDINGS_STATE_DIR / _LOCK_FILE, "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+def _unlock(handle) -> None:
+    fcntl.flock(handle, fcntl.LOCK_UN)
+    handle.close()
+
+def load_state() -> Dict[str, Any]:
+    path = RECORDINGS_STATE_DIR / _STATE_FILE
+    if not path.exists():
+        return {"last_sweep": None, "total_deleted_files": 0, "total_reclaimed_bytes": 0}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def _save_state(result: Dict[str, Any]) -> None:
+    state = load_state()
+    state["last_sweep"] = result
+    state["total_deleted_files"] += result["deleted_files"]
+    state["total_reclaimed_bytes"] += result["reclaimed_bytes"]
+    path = RECORDINGS_STATE_DIR / _STATE_FILE
+    tmp_path = path.with_name(f"{_STATE_FILE}.tmp")
+    tmp_path.write_text(json.dumps(state), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+async def sweep_recordings(dry_run: bool = False) -> Dict[str, Any]:
+    """Uma execução do coletor: remove em lotes, com pausa entre eles, até RECORDINGS_SWEEP_MAX_DELETES arquivos.
+    Só um worker por vez (flock no volume); os demais recebem skipped"""
+    handle = await asyncio.to_thread(_try_lock)
+    if handle is None:
+        return {"skipped": True}
+    try:
+        started_at = datetime.now(timezone.utc)
+        referenced = await asyncio.to_thread(load_references)
+        result: Dict[str, Any] = {
+            "skipped": False, "dry_run": dry_run, "started_at": started_at.isoformat(),
+            "referenced_files": len(referenced), "deleted_files": 0, "reclaimed_bytes": 0, "directories": {},
+        }
+        budget = RECORDINGS_SWEEP_MAX_DELETES
+        for name, directory, ttl_hours in retention_dirs():
+            expired = await asyncio.to_thread(_expired_files, directory, ttl_hours, referenced, budget)
+            deleted = 0
+            reclaimed = 0
+            if dry_run:
+                deleted = len(expired)
+                reclaimed = sum(size for _, size in expired)
+            else:
+                for start in range(0, len(expired), RECORDINGS_SWEEP_BATCH):
+                    batch_deleted, batch_reclaimed = await asyncio.to_thread(_delete_batch, expired[start:start + RECORDINGS_SWEEP_BATCH])
+                    deleted += batch_deleted
+                    reclaimed += batch_reclaimed
+                    await asyncio.sleep(RECORDINGS_SWEEP_PAUSE)
+            budget -= len(expired)
+            result["directories"][name] = {"deleted_files": deleted, "reclaimed_bytes": reclaimed}
+            result["deleted_files"] += deleted
+            result["reclaimed_bytes"] += reclaimed
+        result["duration_seconds"] = (datetime.now(timezone.utc) - started_at).total_seconds()
+        if not dry_run:
+            await asyncio.to_thread(_save_state, result)
+            print(f"[RETENTION] {result['deleted_files']} arquivos removidos, {result['reclaimed_bytes']} bytes liberados")
+        return result
+    finally:
+        await asyncio.to_thread(_unlock, handle)
+
+async def run_recordings_sweeper() -> None:
+    """Tarefa iniciada no startup: coleta a cada RECORDINGS_SWEEP_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(RECORDINGS_SWEEP_INTERVAL)
+        try:
+            await sweep_recordings()
+        except Exception as e:
+            print(f"[RETENTION] Erro na coleta das gravações: {str(e)}")
+
+def storage_usage() -> Dict[str, Any]:
+    """Uso do volume por diretório e arquivos ainda referenciados (executar em thread)"""
+    RECORDINGS_STATE_DIR.mkdir(parents=True, exist_ok=True)
+    referenced = load_references()
+    directories = []
+    for name, directory, ttl_hours in retention_dirs():
+        files = 0
+        total_bytes = 0
+        referenced_files = 0
+        referenced_bytes = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+                files += 1
+                total_bytes += size
+                if entry.name in referenced:
+                    referenced_files += 1
+                    referenced_bytes += size
+        directories.append({
+            "name": name, "path": str(directory), "ttl_hours": ttl_hours, "files": files, "bytes": total_bytes,
+            "referenced_files": referenced_files, "referenced_bytes": referenced_bytes,
+        })
+    volume = shutil.disk_usage(RECORDINGS_STATE_DIR)
+    state = load_state()
+    return {
+        "directories": directories,
+        "volume_total_bytes": volume.total,
+        "volume_used_bytes": volume.used,
+        "volume_free_bytes": volume.free,
+        "sweeper_enabled": RECORDINGS_SWEEP_ENABLED,
+        "last_sweep": state["last_sweep"],
+        "total_deleted_files": state["total_deleted_files"],
+        "total_reclaimed_bytes": state["total_reclaimed_bytes"],
+    }
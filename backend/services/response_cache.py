@@ -0,0 +1,141 @@
+from typing import Optional, Dict, Any
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import os
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import LLMResponseCache
+
+# Cache de respostas de narração para turnos determinados pelo estado da cena
+# (ex.: a primeira resposta da Introdução, igual para toda sessão nova do jogo)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+# Camada compartilhada entre workers (tabela llm_response_cache)
+LLM_CACHE_SHARED = os.getenv("LLM_CACHE_SHARED", "false").lower() == "true"
+
+# Faixas de idade usadas na chave: o tom da narração muda por faixa, não por ano
+AGE_BRACKETS = ((6, "ate_6"), (9, "7_9"), (12, "10_12"), (17, "13_17"))
+
+def age_bracket(age: Optional[int]) -> str:
+    if not age:
+        return "sem_idade"
+    for limit, label in AGE_BRACKETS:
+        if age <= limit:
+            return label
+    return "adulto"
+
+def narration_cache_key(game_id: int, content_version: int, scene_id: Optional[int], segment_index: int, profile: Dict[str, Any], config: Any) -> str:
+    """Chave semântica do turno: versão do conteúdo, cena, trecho, faixa etária, nº de jogadores e modelo"""
+    parts = {
+        "game": game_id,
+        "version": content_version,
+        "scene": scene_id,
+        "segment": segment_index,
+        "age": age_bracket(profile.get("youngest_age")),
+        "count": profile.get("count") or 0,
+        "config": config.id,
+        "provider": config.provider.value,
+        "model": config.model_name,
+        "temperature": config.temperature,
+        "max_tokens": config.max_tokens,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+class CachedResponse:
+    __slots__ = ("response", "tokens_used", "provider", "model")
+
+    def __init__(self, response: str, tokens_used: int, provider: str, model: str):
+        self.response = response
+        self.tokens_used = tokens_used or 0
+        self.provider = provider
+        self.model = model
+
+    def as_llm_response(self) -> Dict[str, Any]:
+        """Mesmo formato de LLMService.generate_with_config, sem custo"""
+        return {
+            "response": self.response, "tokens_used": 0, "cost": 0.0, "response_time": 0.0,
+            "first_token_time": 0.0, "provider": self.provider, "model": self.model,
+            "cache_hit": True, "saved_tokens": self.tokens_used,
+        }
+
+class ResponseCache:
+    """LRU com TTL no processo; opcionalmente consulta a camada compartilhada no banco"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: int = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_local(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResponse, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, db: Session, key: str) -> Optional[CachedResponse]:
+        entry = self._get_local(key)
+        if entry is not None or not LLM_CACHE_SHARED:
+            return entry
+        now = datetime.now(timezone.utc)
+        row = db.query(LLMResponseCache).filter(
+            LLMResponseCache.cache_key == key,
+            LLMResponseCache.expires_at > now
+        ).first()
+        if row is None:
+            return None
+        entry = CachedResponse(row.response, row.tokens_used, row.provider, row.model_name)
+        # Promove para a camada local pelo tempo que ainda resta na compartilhada
+        expires_at = row.expires_at if row.expires_at.tzinfo else row.expires_at.replace(tzinfo=timezone.utc)
+        self.put(key, entry, (expires_at - now).total_seconds())
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+def store_shared_response(key: str, entry: CachedResponse) -> None:
+    """Grava a resposta na camada compartilhada (executado em segundo plano, com sessão própria)"""
+    db = SessionLocal()
+    try:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=LLM_CACHE_TTL)
+        row = db.query(LLMResponseCache).filter(LLMResponseCache.cache_key == key).first()
+        if row is None:
+            db.add(LLMResponseCache(
+                cache_key=key, provider=entry.provider, model_name=entry.model,
+                response=entry.response, tokens_used=entry.tokens_used, expires_at=expires_at,
+            ))
+        else:
+            row.response = entry.response
+            row.tokens_used = entry.tokens_used
+            row.expires_at = expires_at
+        db.commit()
+    except IntegrityError:
+        # Outro worker gravou a mesma chave ao mesmo tempo
+        db.rollback()
+    except Exception as e:
+        db.rollback()
+        print(f"[LLM_CACHE] Erro ao gravar resposta compartilhada: {str(e)}")
+    finally:
+        db.close()
+
+response_cache = ResponseCache()
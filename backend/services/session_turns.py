@@ -0,0 +1,209 @@
+from typing import Optional, Dict, List
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import uuid
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from database import DATABASE_URL, engine
+
+# Turnos de uma mesma sessão são processados um de cada vez, na ordem de chegada:
+# lock por sessão no worker e, no Postgres, uma concessão (lease) por sessão para serializar entre workers
+SESSION_TURN_MAX_QUEUE = int(os.getenv("SESSION_TURN_MAX_QUEUE", "2"))
+# Espera máxima pela vez (fila local e concessão somadas), contada da chegada do pedido; por padrão igual ao
+# prazo da chamada à LLM, para o pedido não ficar mais tempo parado do que o turno levaria para rodar
+SESSION_TURN_WAIT_TIMEOUT = float(os.getenv("SESSION_TURN_WAIT_TIMEOUT", os.getenv("LLM_REQUEST_DEADLINE", "45")))
+SESSION_TURN_LEASES = os.getenv("SESSION_TURN_LEASES", "true").lower() == "true" and DATABASE_URL.startswith("postgresql")
+# A concessão é renovada enquanto o turno roda; se o worker cair, expira depois desse prazo
+SESSION_TURN_LEASE_SECONDS = float(os.getenv("SESSION_TURN_LEASE_SECONDS", "30"))
+SESSION_TURN_LOCK_POLL_INTERVAL = float(os.getenv("SESSION_TURN_LOCK_POLL_INTERVAL", "0.05"))
+
+class SessionBusyError(Exception):
+    """Fila da sessão cheia ou turno anterior demorando demais: o cliente deve tentar de novo depois"""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Ainda estamos processando as jogadas anteriores desta sessão. Tente novamente em instantes.")
+        self.retry_after = retry_after
+
+class DuplicateTurnError(Exception):
+    """O mesmo pedido (mesmo id de requisição) já está em andamento ou na fila desta sessão"""
+
+    def __init__(self):
+        super().__init__("Esta jogada já está sendo processada.")
+
+# Cada operação da concessão é uma transação curta no pool principal: nenhuma conexão fica presa
+# durante a chamada à LLM/TTS, só a linha de session_turn_leases
+_TAKE_LEASE = text("""
+    INSERT INTO session_turn_leases (session_id, token, expires_at)
+    VALUES (:session_id, :token, now() + make_interval(secs => :seconds))
+    ON CONFLICT (session_id) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at
+    WHERE session_turn_leases.expires_at < now()
+    RETURNING token
+""")
+_RENEW_LEASE = text("""
+    UPDATE session_turn_leases SET expires_at = now() + make_interval(secs => :seconds)
+    WHERE session_id = :session_id AND token = :token
+""")
+_DROP_LEASE = text("DELETE FROM session_turn_leases WHERE session_id = :session_id AND token = :token")
+
+def _try_lease(session_id: int, token: str) -> bool:
+    """Uma tentativa de obter a concessão (executado em thread)"""
+    try:
+        with engine.begin() as connection:
+            return connection.execute(
+                _TAKE_LEASE, {"session_id": session_id, "token": token, "seconds": SESSION_TURN_LEASE_SECONDS}
+            ).first() is not None
+    except PoolTimeoutError:
+        # Pool do banco esgotado: o turno é recusado com Retry-After em vez de virar erro 500
+        raise SessionBusyError()
+
+def _renew_lease(session_id: int, token: str) -> None:
+    with engine.begin() as connection:
+        connection.execute(_RENEW_LEASE, {"session_id": session_id, "token": token, "seconds": SESSION_TURN_LEASE_SECONDS})
+
+def _drop_lease(session_id: int, token: str) -> None:
+    try:
+        with engine.begin() as connection:
+            connection.execute(_DROP_LEASE, {"session_id": session_id, "token": token})
+    except Exception as e:
+        # A concessão expira sozinha depois de SESSION_TURN_LEASE_SECONDS
+        print(f"[SESSION_TURNS] Erro ao liberar a vez da sessão {session_id}: {str(e)}")
+
+def _drop_when_done(task: "asyncio.Future", session_id: int, token: str) -> None:
+    """Turno cancelado durante uma tentativa: se a thread ainda conseguir a concessão, libera em seguida"""
+    if task.cancelled() or task.exception() is not None or not task.result():
+        return
+    asyncio.get_running_loop().run_in_executor(None, _drop_lease, session_id, token)
+
+async def _keep_lease(session_id: int, token: str) -> None:
+    """Renova a concessão enquanto o turno estiver em andamento"""
+    while True:
+        await asyncio.sleep(SESSION_TURN_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(_renew_lease, session_id, token)
+        except Exception as e:
+            print(f"[SESSION_TURNS] Erro ao renovar a vez da sessão {session_id}: {str(e)}")
+
+class _SessionQueue:
+    __slots__ = ("lock", "request_ids")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Um item por turno em andamento ou aguardando: o id da requisição ou None
+        self.request_ids: List[Optional[str]] = []
+
+class TurnSlot:
+    """Vez de uma sessão já adquirida; release() pode ser chamado mais de uma vez"""
+
+    def __init__(self, queue: "SessionTurnQueue", session_id: int, request_id: Optional[str], token: Optional[str] = None):
+        self._queue = queue
+        self.session_id = session_id
+        self.request_id = request_id
+        self.token = token
+        self.keeper: Optional["asyncio.Task"] = None
+        self.released = False
+
+    async def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        await self._queue._release(self)
+
+class SessionTurnQueue:
+    """Fila de turnos por sessão; as entradas somem do mapa quando não há turno em andamento nem aguardando.
+    Só o mesmo id de requisição (Idempotency-Key ou client_request_id) é tratado como duplicado: jogadas iguais
+    de jogadores diferentes (duas rolagens de dados seguidas) são turnos distintos e entram na fila"""
+
+    def __init__(self):
+        self._queues: Dict[int, _SessionQueue] = {}
+
+    def check(self, session_id: int, request_id: Optional[str] = None) -> None:
+        """Rejeição barata, antes de qualquer leitura ou chamada à LLM"""
+        queue = self._queues.get(session_id)
+        if queue is None:
+            return
+        if request_id is not None and request_id in queue.request_ids:
+            raise DuplicateTurnError()
+        # Um turno em andamento mais SESSION_TURN_MAX_QUEUE aguardando
+        if len(queue.request_ids) > SESSION_TURN_MAX_QUEUE:
+            raise SessionBusyError()
+
+    async def acquire(self, session_id: int, request_id: Optional[str] = None) -> TurnSlot:
+        self.check(session_id, request_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SESSION_TURN_WAIT_TIMEOUT
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = _SessionQueue()
+            self._queues[session_id] = queue
+        queue.request_ids.append(request_id)
+        slot = TurnSlot(self, session_id, request_id)
+        try:
+            await asyncio.wait_for(queue.lock.acquire(), SESSION_TURN_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._leave(slot)
+            raise SessionBusyError()
+        except BaseException:
+            self._leave(slot)
+            raise
+        try:
+            if SESSION_TURN_LEASES:
+                slot.token = await self._acquire_lease(session_id, deadline)
+                slot.keeper = asyncio.ensure_future(_keep_lease(session_id, slot.token))
+        except BaseException:
+            queue.lock.release()
+            self._leave(slot)
+            raise
+        return slot
+
+    async def _acquire_lease(self, session_id: int, deadline: float) -> str:
+        """Cada tentativa usa uma thread só pelo tempo da transação; a espera entre tentativas fica no event loop,
+        sem ocupar o pool de threads que as dependências síncronas do FastAPI também usam"""
+        loop = asyncio.get_running_loop()
+        token = uuid.uuid4().hex
+        while True:
+            task = asyncio.ensure_future(asyncio.to_thread(_try_lease, session_id, token))
+            try:
+                acquired = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                task.add_done_callback(lambda done: _drop_when_done(done, session_id, token))
+                raise
+            if acquired:
+                return token
+            # Outro worker está com a vez desta sessão: tenta de novo em intervalos curtos até o prazo
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise SessionBusyError()
+            await asyncio.sleep(min(SESSION_TURN_LOCK_POLL_INTERVAL, remaining))
+
+    async def _release(self, slot: TurnSlot) -> None:
+        try:
+            if slot.keeper is not None:
+                slot.keeper.cancel()
+            if slot.token is not None:
+                # Protegido do cancelamento da requisição: a liberação termina mesmo se o cliente desconectar
+                await asyncio.shield(asyncio.to_thread(_drop_lease, slot.session_id, slot.token))
+        finally:
+            queue = self._queues.get(slot.session_id)
+            if queue is not None:
+                queue.lock.release()
+            self._leave(slot)
+
+    def _leave(self, slot: TurnSlot) -> None:
+        queue = self._queues.get(slot.session_id)
+        if queue is None:
+            return
+        if slot.request_id in queue.request_ids:
+            queue.request_ids.remove(slot.request_id)
+        if not queue.request_ids:
+            del self._queues[slot.session_id]
+
+    @asynccontextmanager
+    async def turn(self, session_id: int, request_id: Optional[str] = None):
+        slot = await self.acquire(session_id, request_id)
+        try:
+            yield slot
+        finally:
+            await slot.release()
+
+session_turns = SessionTurnQueue()
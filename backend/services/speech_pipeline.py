@@ -0,0 +1,111 @@
+from typing import Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import speech_recognition as sr
+from pydub import AudioSegment
+
+# Transcrição do áudio enviado pelo jogador sem arquivos temporários: o upload é decodificado em memória
+# para PCM (num pool de processos, pois a conversão usa CPU) e entregue direto ao reconhecedor
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "pt-BR")
+# 0 decodifica numa thread do próprio worker (sem pool de processos)
+STT_DECODE_WORKERS = int(os.getenv("STT_DECODE_WORKERS", "2"))
+# Texto devolvido pelo reconhecedor local (testes de carga e benchmarks sem rede)
+STT_LOCAL_TEXT = os.getenv("STT_LOCAL_TEXT", "Seguimos em frente")
+
+UNRECOGNIZED_TEXT = "Não foi possível reconhecer o áudio"
+
+def decode_audio(audio_data: bytes, audio_format: Optional[str] = None) -> Tuple[bytes, int, int]:
+    """Decodifica o upload em memória para PCM mono (executado no pool de processos): (amostras, taxa, largura)"""
+    segment = AudioSegment.from_file(BytesIO(audio_data), format=audio_format)
+    segment = segment.set_channels(1)
+    return segment.raw_data, segment.frame_rate, segment.sample_width
+
+class GoogleRecognizer:
+    """Google Web Speech API (o reconhecedor usado até aqui); faz uma requisição HTTP bloqueante"""
+    name = "google"
+
+    def recognize(self, audio: sr.AudioData, language: str) -> str:
+        try:
+            return sr.Recognizer().recognize_google(audio, language=language)
+        except sr.UnknownValueError:
+            return UNRECOGNIZED_TEXT
+
+class LocalRecognizer:
+    """Reconhecedor offline, sem rede: devolve STT_LOCAL_TEXT (testes e benchmarks)"""
+    name = "local"
+
+    def recognize(self, audio: sr.AudioData, language: str) -> str:
+        if not audio.frame_data:
+            return UNRECOGNIZED_TEXT
+        return STT_LOCAL_TEXT
+
+RECOGNIZERS = {
+    GoogleRecognizer.name: GoogleRecognizer,
+    LocalRecognizer.name: LocalRecognizer,
+}
+
+def get_recognizer(name: Optional[str] = None):
+    backend = (name or STT_BACKEND).lower()
+    if backend not in RECOGNIZERS:
+        raise ValueError(f"Reconhecedor de voz desconhecido: {backend}")
+    return RECOGNIZERS[backend]()
+
+class Transcription:
+    __slots__ = ("text", "backend", "decode_ms", "recognition_ms", "total_ms")
+
+    def __init__(self, text: str, backend: str, decode_ms: float, recognition_ms: float, total_ms: float):
+        self.text = text
+        self.backend = backend
+        self.decode_ms = decode_ms
+        self.recognition_ms = recognition_ms
+        self.total_ms = total_ms
+
+    def server_timing(self) -> str:
+        """Valor do cabeçalho Server-Timing com as etapas da transcrição"""
+        return (
+            f"stt-decode;dur={self.decode_ms:.1f}, "
+            f"stt-recognize;dur={self.recognition_ms:.1f};desc=\"{self.backend}\", "
+            f"stt-total;dur={self.total_ms:.1f}"
+        )
+
+_decode_pool: Optional[ProcessPoolExecutor] = None
+_decode_pool_lock = threading.Lock()
+
+def _get_decode_pool() -> Optional[ProcessPoolExecutor]:
+    global _decode_pool
+    if STT_DECODE_WORKERS <= 0:
+        return None
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            # spawn: o worker do uvicorn já tem threads (pools do banco, TTS), e fork com threads não é seguro
+            _decode_pool = ProcessPoolExecutor(max_workers=STT_DECODE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _decode_pool
+
+def shutdown_decode_pool() -> None:
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is not None:
+            _decode_pool.shutdown(wait=False, cancel_futures=True)
+            _decode_pool = None
+
+async def transcribe(audio_data: bytes, audio_format: Optional[str] = None, backend: Optional[str] = None) -> Transcription:
+    recognizer = get_recognizer(backend)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    frame_data, sample_rate, sample_width = await loop.run_in_executor(_get_decode_pool(), decode_audio, audio_data, audio_format)
+    decoded = time.perf_counter()
+    text = await asyncio.to_thread(recognizer.recognize, sr.AudioData(frame_data, sample_rate, sample_width), STT_LANGUAGE)
+    finished = time.perf_counter()
+    return Transcription(
+        text=text,
+        backend=recognizer.name,
+        decode_ms=(decoded - started) * 1000,
+        recognition_ms=(finished - decoded) * 1000,
+        total_ms=(finished - started) * 1000,
+    )
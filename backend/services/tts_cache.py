@@ -0,0 +1,178 @@
+from typing import Optional, Dict, Any, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from gtts import gTTS, __version__ as GTTS_VERSION
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import TTSAudioCache
+
+# Cache da síntese de voz endereçado pelo conteúdo: o nome do arquivo é o sha256 de (texto, idioma, voz, motor),
+# igual em todos os workers e depois de reiniciar. Ordem de consulta: disco, camada compartilhada, síntese
+TTS_VOICE_TLD = os.getenv("TTS_VOICE_TLD", "com")
+TTS_ENGINE = f"gtts-{GTTS_VERSION}"
+# Camada compartilhada entre máquinas (tabela tts_audio_cache); com o diretório de saída num volume
+# compartilhado, o disco já basta
+TTS_CACHE_SHARED = os.getenv("TTS_CACHE_SHARED", "false").lower() == "true"
+TTS_CACHE_SHARED_MAX_BYTES = int(os.getenv("TTS_CACHE_SHARED_MAX_BYTES", str(2 * 1024 * 1024)))
+# Sínteses simultâneas por worker (trechos de uma narração rodam em paralelo até esse limite)
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "4"))
+
+_tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
+def tts_cache_key(text: str, lang: str, voice: str = TTS_VOICE_TLD, engine: str = TTS_ENGINE) -> str:
+    parts = {"text": text, "lang": lang, "voice": voice, "engine": engine}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def tts_filename(key: str) -> str:
+    return f"tts_{key}.mp3"
+
+def write_atomic(path: Path, data: Optional[bytes] = None, tts: Optional[gTTS] = None) -> None:
+    """Grava num arquivo temporário e renomeia: outro worker nunca lê um mp3 pela metade"""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        if tts is not None:
+            tts.save(str(tmp_path))
+        else:
+            tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+def _synthesize(text: str, lang: str, path: Path) -> None:
+    write_atomic(path, tts=gTTS(text=text, lang=lang, tld=TTS_VOICE_TLD, slow=False))
+
+def _load_shared(key: str, path: Path) -> bool:
+    db = SessionLocal()
+    try:
+        row = db.query(TTSAudioCache).filter(TTSAudioCache.cache_key == key).first()
+        if row is None:
+            return False
+        write_atomic(path, data=row.audio)
+        return True
+    except Exception as e:
+        print(f"[TTS_CACHE] Erro ao ler a camada compartilhada: {str(e)}")
+        return False
+    finally:
+        db.close()
+
+def _store_shared(key: str, path: Path) -> None:
+    db = SessionLocal()
+    try:
+        data = path.read_bytes()
+        if len(data) > TTS_CACHE_SHARED_MAX_BYTES:
+            return
+        db.add(TTSAudioCache(cache_key=key, audio=data, size_bytes=len(data)))
+        db.commit()
+    except IntegrityError:
+        # Outro worker gravou o mesmo áudio ao mesmo tempo
+        db.rollback()
+    except Exception as e:
+        db.rollback()
+        print(f"[TTS_CACHE] Erro ao gravar na camada compartilhada: {str(e)}")
+    finally:
+        db.close()
+
+class TTSCache:
+    """Consulta e síntese com single-flight por chave no worker; contadores por worker"""
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "disk_hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0, "errors": 0,
+            "synthesis_seconds": 0.0,
+        }
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def _lookup(self, text: str, lang: str, output_dir: Path, count: bool = True) -> Tuple[Path, Optional["asyncio.Future"]]:
+        """Caminho do arquivo e, se ainda não estiver em disco, a tarefa que o produz"""
+        key = tts_cache_key(text, lang)
+        path = output_dir / tts_filename(key)
+        if path.exists():
+            if count:
+                self._count("disk_hits")
+                try:
+                    # A retenção das gravações usa o mtime: arquivos em uso continuam no cache
+                    os.utime(path)
+                except OSError:
+                    pass
+            return path, None
+        task = self._inflight.get(key)
+        if task is not None:
+            # Mesmo texto já sendo sintetizado neste worker: aguarda o mesmo resultado
+            if count:
+                self._count("coalesced")
+        else:
+            # Tarefa própria: a síntese termina (e fica no cache) mesmo se a requisição que a iniciou for cancelada
+            task = asyncio.ensure_future(self._fill(key, text, lang, path))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return path, task
+
+    async def get_or_synthesize(self, text: str, lang: str, output_dir: Path, count: bool = True) -> Path:
+        path, task = self._lookup(text, lang, output_dir, count)
+        if task is None:
+            return path
+        return await asyncio.shield(task)
+
+    def prefetch(self, texts: List[str], lang: str, output_dir: Path) -> None:
+        """Dispara a síntese dos textos que faltam sem aguardar (limitada por TTS_MAX_WORKERS)"""
+        for text in texts:
+            self._lookup(text, lang, output_dir)
+
+    def _done(self, key: str, task: "asyncio.Future") -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Marca a exceção como lida mesmo que nenhuma requisição esteja mais aguardando
+            task.exception()
+
+    async def _fill(self, key: str, text: str, lang: str, path: Path) -> Path:
+        if TTS_CACHE_SHARED and await asyncio.to_thread(_load_shared, key, path):
+            self._count("shared_hits")
+            return path
+        self._count("misses")
+        started = time.perf_counter()
+        try:
+            # gTTS faz requisições HTTP bloqueantes: roda fora do event loop, no pool limitado
+            await asyncio.get_running_loop().run_in_executor(_tts_executor, _synthesize, text, lang, path)
+        except Exception:
+            self._count("errors")
+            raise
+        self._count("synthesis_seconds", time.perf_counter() - started)
+        if TTS_CACHE_SHARED:
+            asyncio.get_running_loop().run_in_executor(None, _store_shared, key, path)
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["disk_hits"] + stats["shared_hits"] + stats["misses"] + stats["coalesced"]
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["avg_synthesis_seconds"] = stats["synthesis_seconds"] / stats["misses"] if stats["misses"] else 0.0
+        stats["inflight"] = len(self._inflight)
+        return stats
+
+tts_cache = TTSCache()
+
+def disk_usage(output_dir: Path) -> Dict[str, int]:
+    """Arquivos de síntese em cache no diretório de saída (executar em thread)"""
+    entries = 0
+    total_bytes = 0
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if entry.name.startswith("tts_") and entry.name.endswith(".mp3") and entry.is_file():
+                entries += 1
+                total_bytes += entry.stat().st_size
+    return {"disk_entries": entries, "disk_bytes": total_bytes}
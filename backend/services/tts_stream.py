@@ -0,0 +1,90 @@
+from typing import Optional, Dict, Any, List, AsyncIterator
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import re
+import aiofiles
+from services.tts_cache import tts_cache, tts_cache_key, tts_filename, write_atomic
+
+# Narração em trechos: o texto é dividido em frases, cada trecho é sintetizado (e cacheado) separadamente
+# e em paralelo, e o áudio é entregue aos poucos em /api/audio/stream/{id}
+TTS_STREAMING = os.getenv("TTS_STREAMING", "true").lower() == "true"
+# Frases curtas são agrupadas até esse tamanho; o primeiro trecho fica com uma frase só para começar logo
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "80"))
+TTS_STREAM_READ_SIZE = 64 * 1024
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+_MANIFEST_ID = re.compile(r"^[0-9a-f]{64}$")
+
+def split_sentences(text: str) -> List[str]:
+    chunks: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_BOUNDARY.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        current = f"{current} {sentence}" if current else sentence
+        if not chunks or len(current) >= TTS_CHUNK_MIN_CHARS:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+def manifest_filename(manifest_id: str) -> str:
+    return f"manifest_{manifest_id}.json"
+
+def build_manifest(text: str, lang: str) -> Dict[str, Any]:
+    chunks = [{"key": tts_cache_key(chunk, lang), "text": chunk} for chunk in split_sentences(text)]
+    # Endereçado pelo conteúdo, como os trechos: a mesma narração gera o mesmo manifesto
+    manifest_id = hashlib.sha256(json.dumps([chunk["key"] for chunk in chunks]).encode("utf-8")).hexdigest()
+    return {"id": manifest_id, "lang": lang, "chunks": chunks}
+
+def save_manifest(output_dir: Path, manifest: Dict[str, Any]) -> None:
+    path = output_dir / manifest_filename(manifest["id"])
+    if not path.exists():
+        write_atomic(path, data=json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+
+def load_manifest(output_dir: Path, manifest_id: str) -> Optional[Dict[str, Any]]:
+    if not _MANIFEST_ID.match(manifest_id):
+        return None
+    path = output_dir / manifest_filename(manifest_id)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+async def start_narration(text: str, lang: str, output_dir: Path) -> Dict[str, Any]:
+    """Grava o manifesto, dispara a síntese de todos os trechos e aguarda só o primeiro"""
+    manifest = build_manifest(text, lang)
+    if not manifest["chunks"]:
+        raise ValueError("Texto vazio para síntese de voz")
+    await asyncio.to_thread(save_manifest, output_dir, manifest)
+    texts = [chunk["text"] for chunk in manifest["chunks"]]
+    tts_cache.prefetch(texts, lang, output_dir)
+    await tts_cache.get_or_synthesize(texts[0], lang, output_dir, count=False)
+    return manifest
+
+async def stream_manifest(manifest: Dict[str, Any], output_dir: Path) -> AsyncIterator[bytes]:
+    """Trechos em ordem, cada um assim que estiver pronto; os seguintes continuam sendo sintetizados em paralelo.
+    Os mp3 do gTTS são só quadros MPEG, então a concatenação toca como um arquivo único"""
+    texts = [chunk["text"] for chunk in manifest["chunks"]]
+    # Em outro worker (ou depois de limpar o disco) os trechos que faltam são sintetizados aqui
+    tts_cache.prefetch(texts, manifest["lang"], output_dir)
+    for text in texts:
+        path = await tts_cache.get_or_synthesize(text, manifest["lang"], output_dir, count=False)
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                data = await f.read(TTS_STREAM_READ_SIZE)
+                if not data:
+                    break
+                yield data
+
+def manifest_playlist(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Alternativa ao stream: lista dos trechos servidos por /api/audio/{filename}"""
+    return {
+        "id": manifest["id"],
+        "stream_url": f"/api/audio/stream/{manifest['id']}",
+        "chunks": [{"url": f"/api/audio/{tts_filename(chunk['key'])}", "text": chunk["text"]} for chunk in manifest["chunks"]],
+    }
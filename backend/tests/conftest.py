@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+import pytest
+
+# Banco SQLite descartável: definido antes de qualquer importação de database, que cria o engine ao ser importado
+_TEST_DIR = Path(tempfile.mkdtemp(prefix="jogo_online_tests_"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DIR / 'test.db'}"
+os.environ["AUDIO_UPLOAD_DIR"] = str(_TEST_DIR / "recordings" / "audio")
+os.environ["AUDIO_OUTPUT_DIR"] = str(_TEST_DIR / "recordings" / "output")
+os.environ["RECORDINGS_STATE_DIR"] = str(_TEST_DIR / "recordings")
+os.environ["RECORDINGS_SWEEP_ENABLED"] = "false"
+# Narrador local (LLMProvider.LOCAL) sem latência simulada
+os.environ["LOCAL_LLM_LATENCY_DIST"] = "fixed"
+os.environ["LOCAL_LLM_LATENCY_MS"] = "0"
+os.environ["LOCAL_LLM_FIRST_TOKEN_MS"] = "0"
+os.environ["LOCAL_LLM_CHUNK_MS"] = "0"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture(scope="session")
+def tables():
+    from database import Base, engine
+    import models  # noqa: F401 (registra as tabelas)
+    Base.metadata.create_all(bind=engine)
+
+@pytest.fixture
+def db(tables):
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def game_session(db):
+    """Jogador, jogo e sessão ativa, sem cenas nem regras"""
+    from models import User, Game, GameSession
+    name = uuid.uuid4().hex[:12]
+    user = User(username=name, email=f"{name}@teste.com", hashed_password="x")
+    game = Game(title="Jogo de teste")
+    db.add_all([user, game])
+    db.flush()
+    session = GameSession(game_id=game.id, player_id=user.id, status="active")
+    db.add(session)
+    db.commit()
+    return session
+
+@pytest.fixture
+def narrator(monkeypatch):
+    """Conta as chamadas ao narrador (provider local, sem rede)"""
+    from services.llm_service import LLMService
+    calls = []
+    generate = LLMService.generate_with_config
+
+    async def counted(self, config, prompt, *args, **kwargs):
+        calls.append(prompt)
+        return await generate(self, config, prompt, *args, **kwargs)
+
+    monkeypatch.setattr(LLMService, "generate_with_config", counted)
+    return calls
+
+@pytest.fixture
+def player(db, game_session, narrator):
+    """Sessão jogável (cena de introdução e narrador local) e cliente autenticado como o jogador"""
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    from main import app
+    from models import LLMConfiguration, LLMProvider, Scenario, User
+    from services.llm_registry import llm_registry
+    db.add(Scenario(
+        game_id=game_session.game_id, name="Introdução - Início do Jogo", phase=0, order=0,
+        file_content="Bem-vindo ao reino.\nQual é o seu nome e a sua idade?\nEscolha um elemento: água, fogo, terra ou ar?",
+    ))
+    db.add(LLMConfiguration(game_id=game_session.game_id, provider=LLMProvider.LOCAL, model_name="local-narrador", api_key="-", cost_per_token=0.0))
+    db.commit()
+    llm_registry.invalidate()
+    username = db.query(User.username).filter(User.id == game_session.player_id).scalar()
+    with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': username})}"
+        client.session_id = game_session.id
+        yield client
@@ -0,0 +1,41 @@
+import pytest
+from models import GameSession, SessionInteraction
+from services.conversation_memory import ConversationMemory, refresh_session_summary, MEMORY_MAX_TURNS
+
+def _play(db, session_id: int, turns: int, response: str):
+    """Simula os turnos como em /interact: janela lida na preparação, interação gravada e resumo atualizado se pedido"""
+    for number in range(1, turns + 1):
+        session = db.query(GameSession).filter(GameSession.id == session_id).one()
+        memory = ConversationMemory(db)
+        window = {turn.player_input for turn in memory.recent_turns(session)}
+        summary = memory.summary(session)
+        existing = [row.player_input for row in db.query(SessionInteraction.player_input).filter(SessionInteraction.session_id == session_id)]
+        lost = [text for text in existing if text not in window and f"Jogador: {text} |" not in summary]
+        # O resumo é limitado em tokens: só os turnos mais antigos podem sair dele
+        assert lost == existing[:len(lost)], f"turno {number}: fora do resumo e da janela {lost}"
+        db.add(SessionInteraction(session_id=session_id, player_input=f"jogada {number}", ai_response=response))
+        db.commit()
+        if memory.overflowed or ConversationMemory.needs_refresh(len(existing) + 1):
+            refresh_session_summary(session_id)
+        db.expire_all()
+
+@pytest.mark.parametrize("response", [
+    "O narrador responde brevemente.",
+    # Respostas longas: o orçamento de tokens corta a janela antes de MEMORY_MAX_TURNS
+    "A floresta se abre diante de vocês. " * 20,
+])
+def test_no_turn_is_left_out_of_summary_and_window(db, game_session, response):
+    _play(db, game_session.id, 40, response)
+    session = db.query(GameSession).filter(GameSession.id == game_session.id).one()
+    assert session.memory_summary_until_id is not None
+    assert "Jogador: jogada 30 |" in session.memory_summary
+
+def test_window_keeps_base_turns_after_refresh(db, game_session):
+    _play(db, game_session.id, MEMORY_MAX_TURNS + 5, "Resposta curta.")
+    refresh_session_summary(game_session.id)
+    db.expire_all()
+    session = db.query(GameSession).filter(GameSession.id == game_session.id).one()
+    memory = ConversationMemory(db)
+    turns = memory.recent_turns(session)
+    assert [turn.player_input for turn in turns] == [f"jogada {n}" for n in range(6, MEMORY_MAX_TURNS + 6)]
+    assert memory.overflowed is False
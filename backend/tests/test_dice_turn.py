@@ -0,0 +1,21 @@
+from models import PlayerBoard, PlayerBoardEvent, SessionInteraction
+
+def _roll(player):
+    return player.post("/api/game/interact", json={"session_id": player.session_id, "player_input": "Quero rolar dados"})
+
+def test_dice_roll_skips_the_narrator_and_records_board_events(db, player, narrator):
+    response = _roll(player)
+    assert response.status_code == 200, response.text
+    assert response.json()["ai_response"].startswith("Resultado da rolagem:")
+    assert narrator == []
+    interaction = db.query(SessionInteraction).filter(SessionInteraction.session_id == player.session_id).one()
+    assert interaction.llm_provider == "dice"
+    board = db.query(PlayerBoard).filter(PlayerBoard.session_id == player.session_id).one()
+    assert db.query(PlayerBoardEvent).filter(PlayerBoardEvent.board_id == board.id).count() == 1
+
+def test_repeated_rolls_are_separate_turns(db, player, narrator):
+    assert _roll(player).status_code == 200
+    assert _roll(player).status_code == 200
+    assert narrator == []
+    assert db.query(SessionInteraction).filter(SessionInteraction.session_id == player.session_id).count() == 2
+    assert db.query(PlayerBoardEvent).filter(PlayerBoardEvent.session_id == player.session_id).count() == 2
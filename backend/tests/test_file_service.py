@@ -0,0 +1,40 @@
+import asyncio
+import io
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from services import file_service
+from services.file_service import FileService, UploadTooLargeError, UPLOAD_MAX_REQUEST_BYTES
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setenv("GAME_COVERS_DIR", str(tmp_path / "game_covers"))
+    monkeypatch.setattr(file_service, "UPLOAD_CHUNK_SIZE", 1024)
+    monkeypatch.setitem(file_service.UPLOAD_MAX_BYTES, "game_cover", 4096)
+    return FileService()
+
+def _upload(data: bytes, size=None) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="capa.png", size=size)
+
+def test_upload_is_copied_in_chunks(service):
+    data = bytes(range(256)) * 15
+    path = asyncio.run(service.save_upload_stream(_upload(data), "capa.png", file_type="game_cover"))
+    assert path == str(service.game_covers_dir / "capa.png")
+    assert (service.game_covers_dir / "capa.png").read_bytes() == data
+    assert list(service.game_covers_dir.glob(".*.part")) == []
+
+@pytest.mark.parametrize("declared_size", [None, 5000])
+def test_oversized_upload_is_rejected_without_leftovers(service, declared_size):
+    # Sem tamanho declarado o limite é verificado durante a cópia, bloco a bloco
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(service.save_upload_stream(_upload(b"x" * 5000, declared_size), "capa.png", file_type="game_cover"))
+    assert list(service.game_covers_dir.iterdir()) == []
+
+def test_oversized_request_gets_413_before_the_body_is_read():
+    from main import app
+    response = TestClient(app).post(
+        "/api/admin/games/",
+        content=b"",
+        headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Length": str(UPLOAD_MAX_REQUEST_BYTES + 1)},
+    )
+    assert response.status_code == 413
@@ -0,0 +1,73 @@
+import uuid
+import pytest
+from models import Game, GameRule, Scenario, ScenarioSegment, User, UserRole
+from services import game_catalog as catalog_module
+from services.game_catalog import get_game_catalog, get_game_content_version, bump_game_content_version
+from services.narrative_service import split_scene_segments
+
+SCENE = "Você chega ao portal do fogo.\nO que você faz?\n\nAs chamas abrem passagem.\nSegue em frente?"
+
+@pytest.fixture
+def game(db):
+    game = Game(title="Jogo do catálogo")
+    db.add(game)
+    db.commit()
+    yield game
+    catalog_module._catalogs.pop(game.id, None)
+
+@pytest.fixture
+def admin(db):
+    from fastapi.testclient import TestClient
+    from auth import create_access_token
+    from main import app
+    name = uuid.uuid4().hex[:12]
+    db.add(User(username=name, email=f"{name}@teste.com", hashed_password="x", role=UserRole.ADMIN))
+    db.commit()
+    with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': name})}"
+        yield client
+
+def test_catalog_is_reused_until_the_content_version_changes(db, game):
+    db.add(GameRule(game_id=game.id, title="Regras do Jogo", rule_type="rule", content={"file_content": "Seção 1"}))
+    db.commit()
+    first = get_game_catalog(db, game.id)
+    assert get_game_catalog(db, game.id) is first
+    assert [rule.title for rule in first.rules] == ["Regras do Jogo"]
+
+    db.add(GameRule(game_id=game.id, title="História - Prólogo", rule_type="history", content={}))
+    bump_game_content_version(db, game.id)
+    db.commit()
+    assert game.id not in catalog_module._catalogs
+    second = get_game_catalog(db, game.id)
+    assert second is not first
+    assert second.version == first.version + 1 == get_game_content_version(db, game.id)
+    assert [rule.title for rule in second.history_rules] == ["História - Prólogo"]
+
+def test_compile_backfills_segments_of_legacy_scenes(db, game):
+    scenario = Scenario(game_id=game.id, name="Cena 1A – Portal do Fogo", phase=1, order=0, file_content=SCENE)
+    db.add(scenario)
+    db.commit()
+    assert scenario.segment_count is None
+    catalog = get_game_catalog(db, game.id)
+    expected = split_scene_segments(SCENE)
+    assert [scene.segment_count for scene in catalog.scenes] == [len(expected)]
+    db.expire_all()
+    assert scenario.segment_count == len(expected)
+    assert db.query(ScenarioSegment).filter(ScenarioSegment.scenario_id == scenario.id).count() == len(expected)
+
+def test_deleting_a_rule_bumps_the_version(db, game, admin):
+    rule = GameRule(game_id=game.id, title="Regras do Jogo", rule_type="rule", content={})
+    db.add(rule)
+    db.commit()
+    catalog = get_game_catalog(db, game.id)
+    assert admin.delete(f"/api/admin/rules/{rule.id}").status_code == 200
+    db.expire_all()
+    assert get_game_content_version(db, game.id) == catalog.version + 1
+    assert get_game_catalog(db, game.id).rules == []
+
+def test_deleting_a_game_drops_its_cached_catalog(db, game, admin):
+    get_game_catalog(db, game.id)
+    assert game.id in catalog_module._catalogs
+    response = admin.delete(f"/api/admin/games/{game.id}")
+    assert response.status_code == 200, response.text
+    assert game.id not in catalog_module._catalogs
@@ -0,0 +1,31 @@
+from models import IdempotencyKey, SessionInteraction
+
+def _interact(player, text: str, key: str):
+    return player.post(
+        "/api/game/interact",
+        json={"session_id": player.session_id, "player_input": text},
+        headers={"Idempotency-Key": key},
+    )
+
+def test_replay_returns_stored_response_without_calling_the_narrator(db, player, narrator):
+    first = _interact(player, "Me chamo Ana e tenho 10 anos", "turno-1")
+    assert first.status_code == 200, first.text
+    calls = len(narrator)
+    assert calls == 1
+    replay = _interact(player, "Me chamo Ana e tenho 10 anos", "turno-1")
+    assert replay.status_code == 200
+    assert replay.json() == first.json()
+    assert len(narrator) == calls
+    assert db.query(SessionInteraction).filter(SessionInteraction.session_id == player.session_id).count() == 1
+
+def test_same_key_with_other_body_is_rejected(db, player, narrator):
+    assert _interact(player, "Quero ir pelo fogo", "turno-2").status_code == 200
+    calls = len(narrator)
+    response = _interact(player, "Quero ir pela água", "turno-2")
+    assert response.status_code == 422
+    assert len(narrator) == calls
+
+def test_failed_request_frees_the_key(db, player):
+    response = player.post("/api/game/interact", json={"session_id": 999999, "player_input": "olá"}, headers={"Idempotency-Key": "turno-3"})
+    assert response.status_code == 404
+    assert db.query(IdempotencyKey).filter(IdempotencyKey.key == "turno-3").count() == 0
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from typing import List
+from sqlalchemy import event
+from database import engine
+from models import GameSession, PlayerBoard, SessionInteraction, SessionNarrativeState
+from routers.game import _persist_turn
+from services.interaction_context import load_interaction_context
+
+@contextmanager
+def count_statements():
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def _with_state_and_board(db, game_session: GameSession):
+    """Estado narrativo e tabuleiro gravados; devolve (sessão, jogador) com o mapa de identidade vazio"""
+    ids = (game_session.id, game_session.player_id)
+    db.add(SessionNarrativeState(session_id=ids[0], segment_index=1, turn_count=3, decision_history=[]))
+    db.add(PlayerBoard(session_id=ids[0], player_id=ids[1], board_state={}))
+    db.commit()
+    db.expunge_all()
+    return ids
+
+def test_context_loads_in_one_query(db, game_session):
+    session_id, player_id = _with_state_and_board(db, game_session)
+    with count_statements() as statements:
+        context = load_interaction_context(db, session_id, player_id)
+        # Relacionamentos usados pelo turno já vêm carregados, sem consultas preguiçosas depois
+        assert context.narrative_state.turn_count == 3
+        assert context.board is not None
+        assert context.is_first_interaction is False
+    assert len(statements) == 1, statements
+
+def test_context_of_other_player_is_not_loaded(db, game_session):
+    assert load_interaction_context(db, game_session.id, game_session.player_id + 1000) is None
+
+def test_turn_is_written_in_one_flush_without_refresh(db, game_session):
+    session_id, player_id = _with_state_and_board(db, game_session)
+    context = load_interaction_context(db, session_id, player_id)
+    context.session.current_scene_index = 2
+    context.narrative_state.segment_index = 2
+    context.narrative_state.turn_count = 4
+    context.board.board_state = {"turn": 1}
+    interaction = SessionInteraction(session_id=session_id, player_input="sigo em frente", player_input_type="text", ai_response="Você segue.")
+    with count_statements() as statements:
+        response = _persist_turn(db, [context.session, context.narrative_state, context.board], interaction)
+    # Um UPDATE por objeto alterado e o INSERT da interação com RETURNING; nenhum SELECT de refresh
+    assert sorted(statement.split()[0] for statement in statements) == ["INSERT", "UPDATE", "UPDATE", "UPDATE"], statements
+    assert all("RETURNING" in statement for statement in statements if statement.startswith("INSERT"))
+    assert response.id == interaction.id
+    assert response.created_at is not None
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from models import LLMConfiguration, LLMProvider
+from services import llm_router as router_module
+from services.llm_registry import LLMConfigSnapshot
+from services.llm_router import LLMRouter
+
+class _SlowService:
+    """Provider que nunca responde; registra as tentativas canceladas"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+
+    async def generate_with_config(self, config, *args, **kwargs):
+        self.started += 1
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+def _config(config_id: int) -> LLMConfigSnapshot:
+    return LLMConfigSnapshot(LLMConfiguration(id=config_id, game_id=1, provider=LLMProvider.LOCAL, model_name="local", api_key="x"))
+
+@pytest.mark.parametrize("cancel_after", [0.05, 0.3])
+def test_cancelled_hedge_cancels_every_attempt(monkeypatch, cancel_after):
+    # 0.05: cancelado durante a espera do hedge; 0.3: depois de a cobertura já ter sido disparada
+    monkeypatch.setattr(router_module, "LLM_HEDGE_AFTER", 0.1)
+    router = LLMRouter()
+    service = _SlowService()
+    primary, backup = _config(1), _config(2)
+    # Meio-aberto: a tentativa em andamento ocupa a única vaga de teste
+    router.health(primary).state = router_module.HALF_OPEN
+
+    async def run():
+        assert router.health(primary).acquire()
+        call = asyncio.ensure_future(router._hedged(service, primary, [backup], "prompt"))
+        await asyncio.sleep(cancel_after)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0.01)
+        # Verificado com o loop ainda rodando: no encerramento o asyncio.run cancelaria as tarefas restantes
+        assert service.started == (1 if cancel_after < 0.1 else 2)
+        assert service.cancelled == service.started
+        assert router.health(primary).probing is False
+
+    asyncio.run(run())
+
+class _StreamingService:
+    """Provider que envia um trecho e fica aguardando o restante"""
+
+    async def stream_with_config(self, config, *args, **kwargs):
+        yield {"type": "delta", "text": "Era uma vez"}
+        await asyncio.Event().wait()
+
+def test_closed_stream_frees_the_half_open_probe():
+    router = LLMRouter()
+    config = _config(1)
+    router.health(config).state = router_module.HALF_OPEN
+
+    async def run():
+        stream = router.stream(_StreamingService(), [config], "prompt")
+        assert (await stream.__anext__())["type"] == "delta"
+        assert router.health(config).probing is True
+        # Fechado no meio da resposta, como fazem os handlers SSE/WS quando o cliente desconecta
+        await stream.aclose()
+        assert router.health(config).probing is False
+        assert router.health(config).available()
+
+    asyncio.run(run())
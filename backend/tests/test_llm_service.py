@@ -0,0 +1,143 @@
+import asyncio
+import httpx
+import pytest
+from models import LLMConfiguration, LLMProvider
+from services import llm_service as service_module
+from services.llm_registry import LLMConfigSnapshot
+from services.llm_service import LLMService, is_transient_error
+from services.local_llm import local_llm
+
+def _config(config_id: int = 1) -> LLMConfigSnapshot:
+    return LLMConfigSnapshot(LLMConfiguration(id=config_id, game_id=1, provider=LLMProvider.LOCAL, model_name="local", api_key="x"))
+
+def _provider_timeout(monkeypatch):
+    async def complete(*args, **kwargs):
+        raise httpx.ReadTimeout("tempo esgotado no provider")
+
+    async def stream(*args, **kwargs):
+        raise httpx.ReadTimeout("tempo esgotado no provider")
+        yield
+
+    monkeypatch.setattr(local_llm, "complete", complete)
+    monkeypatch.setattr(local_llm, "stream", stream)
+    monkeypatch.setattr(service_module, "LLM_RETRY_ATTEMPTS", 1)
+
+def test_generate_keeps_the_provider_error(monkeypatch):
+    _provider_timeout(monkeypatch)
+    with pytest.raises(Exception) as raised:
+        asyncio.run(LLMService(None).generate_with_config(_config(), "olá"))
+    # O roteador (failover) e as rotas classificam o erro pela cadeia de causas
+    assert is_transient_error(raised.value)
+    assert not str(raised.value).startswith("Erro ao gerar resposta")
+
+def test_stream_keeps_the_provider_error(monkeypatch):
+    _provider_timeout(monkeypatch)
+
+    async def run():
+        async for _ in LLMService(None).stream_with_config(_config(), "olá"):
+            pass
+
+    with pytest.raises(Exception) as raised:
+        asyncio.run(run())
+    assert is_transient_error(raised.value)
+
+def test_interact_error_detail_has_a_single_prefix(monkeypatch, player):
+    _provider_timeout(monkeypatch)
+    response = player.post("/api/game/interact", json={"session_id": player.session_id, "player_input": "Me chamo Ana"})
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Erro ao gerar resposta: tempo esgotado no provider"
+
+class _AnthropicMessages:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **params):
+        self.calls.append(params)
+        usage = type("Usage", (), {"input_tokens": 3, "output_tokens": 2})()
+        return type("Message", (), {"content": [type("Block", (), {"text": "Olá"})()], "usage": usage})()
+
+@pytest.mark.parametrize("temperature", [None, 0.3])
+def test_anthropic_call_omits_unset_temperature(monkeypatch, temperature):
+    messages = _AnthropicMessages()
+    monkeypatch.setattr(service_module.llm_registry, "client", lambda config: type("Client", (), {"messages": messages})())
+    config = LLMConfigSnapshot(LLMConfiguration(id=2, game_id=1, provider=LLMProvider.ANTHROPIC, model_name="claude", api_key="x", temperature=temperature))
+    result = asyncio.run(LLMService(None).generate_with_config(config, "olá"))
+    assert result["response"] == "Olá"
+    if temperature is None:
+        assert "temperature" not in messages.calls[0]
+    else:
+        assert messages.calls[0]["temperature"] == temperature
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """Agendador com uma vaga por configuração e fila de um pedido"""
+    monkeypatch.setattr(service_module, "LLM_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(service_module, "LLM_MAX_QUEUE", 1)
+    monkeypatch.setattr(service_module, "LLM_RETRY_BASE_DELAY", 0.01)
+    return service_module.LLMRequestScheduler()
+
+def test_scheduler_sheds_requests_beyond_the_queue(scheduler):
+    config = _config(10)
+    release = None
+
+    async def blocked():
+        await release.wait()
+        return {"text": "ok"}
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        running = asyncio.ensure_future(scheduler.call(config, blocked))
+        await asyncio.sleep(0.01)
+        queued = asyncio.ensure_future(scheduler.call(config, blocked))
+        await asyncio.sleep(0.01)
+        with pytest.raises(service_module.LLMOverloadedError) as raised:
+            await scheduler.call(config, blocked)
+        assert raised.value.retry_after >= 1
+        release.set()
+        assert [result["text"] for result in await asyncio.gather(running, queued)] == ["ok", "ok"]
+
+    asyncio.run(run())
+
+def test_queued_request_gives_up_at_the_deadline(scheduler, monkeypatch):
+    config = _config(11)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return {"text": "ok"}
+
+        running = asyncio.ensure_future(scheduler.call(config, blocked))
+        await asyncio.sleep(0.01)
+        monkeypatch.setattr(service_module, "LLM_REQUEST_DEADLINE", 0.05)
+        with pytest.raises(service_module.LLMOverloadedError):
+            await scheduler.call(config, blocked)
+        assert scheduler._queue(config).waiting == 0
+        release.set()
+        assert (await running)["text"] == "ok"
+        # Com a vaga livre, o prazo limita a própria chamada
+        with pytest.raises(service_module.LLMDeadlineError):
+            await scheduler.call(config, lambda: asyncio.sleep(1))
+
+    asyncio.run(run())
+
+def test_scheduler_retries_only_transient_errors(scheduler):
+    config = _config(12)
+    attempts = []
+
+    def flaky(error):
+        async def request():
+            attempts.append(error)
+            if len(attempts) == 1:
+                raise error
+            return {"text": "ok"}
+        return request
+
+    assert asyncio.run(scheduler.call(config, flaky(httpx.ConnectError("conexão recusada"))))["text"] == "ok"
+    assert len(attempts) == 2
+    attempts.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.call(config, flaky(ValueError("pedido inválido"))))
+    assert len(attempts) == 1
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from models import LLMConfiguration, LLMProvider, LLMUsageRollup
+from services import llm_usage as usage_module
+from services.llm_usage import usage_buffer, flush_llm_usage, usage_rollup
+
+@pytest.fixture
+def config(db, game_session):
+    # Buffer vazio: descarta o uso registrado por outros testes
+    usage_buffer.drain()
+    config = LLMConfiguration(game_id=game_session.game_id, provider=LLMProvider.LOCAL, model_name="local-uso", api_key="-", total_requests=10, avg_response_time=1.0)
+    db.add(config)
+    db.commit()
+    return config
+
+def test_flush_adds_a_rollup_row_and_increments_totals(db, config):
+    usage_buffer.record_success(config.id, 100, 0.5, 2.0, cache_read_tokens=40)
+    usage_buffer.record_success(config.id, 50, 0.25, 4.0)
+    usage_buffer.record_failure(config.id)
+    usage_buffer.record_cache_hit(config.id, 30)
+    # Configuração removida depois da chamada: ignorada sem derrubar a gravação
+    usage_buffer.record_success(999999, 10, 0.0, 1.0)
+    flush_llm_usage()
+
+    db.refresh(config)
+    assert (config.total_requests, config.total_tokens, config.total_cost) == (12, 150, 0.75)
+    assert (config.total_cache_read_tokens, config.cache_hits, config.cache_saved_tokens) == (40, 1, 30)
+    # Média ponderada: (1.0 * 10 + 2.0 + 4.0) / 12
+    assert config.avg_response_time == pytest.approx(16 / 12)
+    row = db.query(LLMUsageRollup).filter(LLMUsageRollup.llm_config_id == config.id).one()
+    assert (row.requests, row.failures, row.latency_sum) == (2, 1, 6.0)
+    assert db.query(LLMUsageRollup).filter(LLMUsageRollup.llm_config_id == 999999).count() == 0
+    # Nada acumulado: a próxima gravação não abre transação
+    flush_llm_usage()
+    assert db.query(LLMUsageRollup).filter(LLMUsageRollup.llm_config_id == config.id).count() == 1
+
+def test_failed_flush_puts_the_counters_back(config, monkeypatch):
+    class BrokenSession:
+        def query(self, *args):
+            raise RuntimeError("banco fora do ar")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    usage_buffer.record_success(config.id, 100, 0.5, 2.0)
+    monkeypatch.setattr(usage_module, "SessionLocal", BrokenSession)
+    flush_llm_usage()
+    _, _, counters = usage_buffer.drain()
+    assert (counters[config.id].requests, counters[config.id].tokens_used) == (1, 100)
+
+def test_usage_rollup_reports_success_rate_and_percentiles(db, config):
+    for latency in [0.2, 0.2, 0.2, 0.4, 6.0]:
+        usage_buffer.record_success(config.id, 10, 0.0, latency)
+    usage_buffer.record_failure(config.id)
+    flush_llm_usage()
+    stats = usage_rollup(db, datetime.now(timezone.utc) - timedelta(hours=1))[config.id]
+    assert (stats["window_requests"], stats["window_failures"]) == (5, 1)
+    assert stats["success_rate"] == pytest.approx(5 / 6)
+    assert (stats["latency_p50"], stats["latency_p95"]) == (0.25, 8.0)
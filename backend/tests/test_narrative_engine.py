@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+from models import SessionInteraction, SessionNarrativeState
+from services.narrative_service import NarrativeEngine, NarrativeStateService, SceneIndex
+
+def _scene(scene_id: int, name: str, content: str = "") -> SimpleNamespace:
+    return SimpleNamespace(id=scene_id, name=name, file_content=content)
+
+SCENES = [
+    _scene(1, "Introdução - Início do Jogo", "Bem-vindo.\nEscolha um elemento?"),
+    _scene(2, "Cena 0A - Portal da Água", "O portal se abre.\nEntra?\nOlha em volta?"),
+    _scene(3, "Cena 0A - Portal do Fogo", "As chamas dançam.\nEntra?"),
+    _scene(4, "Cena 0B - Travessia", "Uma ponte.\nAtravessa?"),
+    _scene(5, "Cena 01 - Temperança", "Um jardim calmo.\nDescansa?"),
+    _scene(6, "Cena 02 - Coragem", "Um dragão.\nEnfrenta?"),
+]
+
+def test_scene_index_lookups():
+    index = SceneIndex(SCENES)
+    assert index.intro.id == 1
+    assert index.scene_by_prefix("cena 0b").id == 4
+    assert index.scene_by_id(6).id == 6
+    assert index.scene_by_id(99) is None
+    assert index.portal_scene_for_element("agua").id == 2
+    assert index.portal_scene_for_element("fogo").id == 3
+    assert index.portal_scene_for_element("terra") is None
+    assert [getattr(index.next_scene_by_order(scene), "id", None) for scene in SCENES] == [None, 4, 4, 5, 6, None]
+    assert index.is_intro_scene(SCENES[0]) and not index.is_intro_scene(SCENES[1])
+
+def test_scene_outside_the_index_still_finds_the_next_one():
+    index = SceneIndex(SCENES)
+    inactive = _scene(42, "Cena 01 - Outra versão")
+    assert index.next_scene_by_order(inactive).id == 6
+
+def test_engine_walks_portal_segments_and_next_scene():
+    engine = NarrativeEngine(SCENES)
+    decision = engine.advance(SCENES[0], 1, "Escolho a água")
+    assert (decision["scene"].id, decision["decision_reason"], decision["next_index"]) == (2, "selecionou_elemento", 1)
+    state = engine.simulate(["Escolho a água", "sigo", "sigo"], SCENES[0])
+    assert (state["scene"].id, state["index"], state["element"]) == (4, 1, "agua")
+    assert [entry["reason"] for entry in state["history"]] == ["selecionou_elemento", "fim_da_cena"]
+
+def test_backfill_replays_previous_turns_and_apply_decision_is_versioned(db, game_session):
+    for text in ["olá", "Escolho o fogo"]:
+        db.add(SessionInteraction(session_id=game_session.id, player_input=text, ai_response="..."))
+    db.commit()
+    service = NarrativeStateService(db)
+    engine = NarrativeEngine(SCENES)
+    state = service.get_or_backfill(game_session, engine, SCENES[0])
+    assert (state.scenario_id, state.selected_element, state.turn_count) == (3, "fogo", 2)
+    db.commit()
+    assert state.version == 1
+    service.apply_decision(state, engine.advance(SCENES[2], state.segment_index, "sigo"))
+    db.commit()
+    assert (state.version, state.turn_count) == (2, 3)
+    # Outro worker gravou a mesma versão antes: o flush é rejeitado em vez de sobrescrever
+    db.query(SessionNarrativeState).filter(SessionNarrativeState.id == state.id).update({"version": 3}, synchronize_session=False)
+    state.segment_index = 0
+    with pytest.raises(StaleDataError):
+        db.commit()
+    db.rollback()
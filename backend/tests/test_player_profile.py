@@ -0,0 +1,98 @@
+import pytest
+from services.player_profile import (
+    parse_players_list, extract_age, extract_player_name, extract_player_count, extract_features, merge_profile
+)
+
+# Mensagens reais de abertura de sessão
+@pytest.mark.parametrize("text, expected", [
+    ("Jogador 1: Gabriel, 11 anos", [("Gabriel", 11)]),
+    ("Jogador 1: Gabriel, 11 anos, Jogador 2: Sofia, 9 anos", [("Gabriel", 11), ("Sofia", 9)]),
+    ("Jogador 1: Gabriel, 11 anos\nJogador 2: Sofia, 9 anos", [("Gabriel", 11), ("Sofia", 9)]),
+    ("- Jogador 1: Gabriel, 11 anos\n• Jogador 2: João Pedro, 10 anos", [("Gabriel", 11), ("João Pedro", 10)]),
+    ("Somos dois. Jogador 1: Ana, 8 anos. Jogador 2: Lucas, 12 anos", [("Ana", 8), ("Lucas", 12)]),
+    ("Jogador 1 - Ana (8 anos)", [("Ana", 8)]),
+    ("jogador 1: maria 7 anos", [("Maria", 7)]),
+    ("Jogador 1: Velho, 200 anos", []),
+    ("Vamos para a cena 2", []),
+])
+def test_parse_players_list(text, expected):
+    assert [(player["name"], player["age"]) for player in parse_players_list(text)] == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Tenho 9 anos", 9),
+    ("tenho onze anos", 11),
+    ("Me chamo Ana e tenho 10 anos", 10),
+    ("Escolho a cena 2", None),
+    ("Jogador 1", None),
+])
+def test_extract_age(text, expected):
+    assert extract_age(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Me chamo Gabriel e tenho 11 anos", "Gabriel"),
+    ("Meu nome é Sofia, 9 anos", "Sofia"),
+    ("meu nome e joão", "João"),
+    ("Quero ir pela floresta", None),
+])
+def test_extract_player_name(text, expected):
+    assert extract_player_name(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Somos três", 3),
+    ("somos 2", 2),
+    ("Temos 4 jogadores", 4),
+    ("Vamos em frente", None),
+])
+def test_extract_player_count(text, expected):
+    assert extract_player_count(text) == expected
+
+def test_features_count_players_from_single_line_list():
+    features = extract_features("Jogador 1: Gabriel, 11 anos, Jogador 2: Sofia, 9 anos")
+    assert features["count"] == 2
+    profile = merge_profile(None, features)
+    assert profile["declared_players"] is True
+    assert profile["youngest_age"] == 9
+
+def test_merge_profile_single_player_from_name_and_age():
+    profile = merge_profile(None, extract_features("Me chamo Ana"))
+    profile = merge_profile(profile, extract_features("tenho 10 anos"))
+    assert profile["players"] == [{"name": "Ana", "age": 10}]
+    assert profile["count"] == 1
+    assert profile["youngest_age"] == 10
+
+def test_merge_profile_keeps_declared_list_when_later_messages_have_no_players():
+    profile = merge_profile(None, extract_features("Jogador 1: Gabriel, 11 anos, Jogador 2: Sofia, 9 anos"))
+    profile = merge_profile(profile, extract_features("Quero abrir a porta"))
+    assert [player["name"] for player in profile["players"]] == ["Gabriel", "Sofia"]
+    assert profile["count"] == 2
+
+@pytest.mark.parametrize("text, expected", [
+    ("Há 5 anos meu avô viu um dragão", None),
+    ("faz dois anos que moro aqui", None),
+    ("Isso foi um ano atrás", None),
+    ("há dois anos", None),
+    ("tenho dois anos", None),
+])
+def test_extract_age_ignores_time_spans(text, expected):
+    assert extract_age(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Eu soube que o dragão fugiu", {}),
+    ("Sou a Ana", {"self_name": "Ana"}),
+    ("eu sou corajoso", {"self_name": "Corajoso"}),
+])
+def test_self_name_features(text, expected):
+    assert extract_features(text) == expected
+
+def test_sou_does_not_replace_a_declared_name():
+    profile = merge_profile(None, extract_features("Me chamo Ana e tenho 10 anos"))
+    profile = merge_profile(profile, extract_features("Eu soube que o dragão fugiu"))
+    profile = merge_profile(profile, extract_features("sou corajoso"))
+    assert profile["name"] == "Ana"
+    assert profile["players"] == [{"name": "Ana", "age": 10}]
+
+def test_sou_names_the_player_until_a_declared_name_arrives():
+    profile = merge_profile(None, extract_features("Sou o Pedro"))
+    assert profile["name"] == "Pedro"
+    profile = merge_profile(profile, extract_features("Meu nome é João"))
+    assert profile["name"] == "João"
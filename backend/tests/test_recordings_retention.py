@@ -0,0 +1,44 @@
+import os
+import time
+import pytest
+from services import recordings_retention as retention
+from services.recordings_retention import audio_reference, _expired_files
+from services.tts_stream import manifest_filename
+
+HOUR = 3600
+
+def _file(directory, name: str, age_hours: float, size: int = 10):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age_hours * HOUR
+    os.utime(path, (mtime, mtime))
+    return path
+
+@pytest.mark.parametrize("url, expected", [
+    ("/api/audio/tts_abc.mp3", "tts_abc.mp3"),
+    (f"/api/audio/stream/{'a' * 64}", manifest_filename("a" * 64)),
+    ("https://cdn.exemplo.com/audio.mp3", None),
+    (None, None),
+])
+def test_audio_reference(url, expected):
+    assert audio_reference(url) == expected
+
+def test_expired_files_keep_referenced_and_recent_ones(tmp_path):
+    _file(tmp_path, "antigo.mp3", 48, size=7)
+    _file(tmp_path, "referenciado.mp3", 48)
+    _file(tmp_path, manifest_filename("b" * 64), 48)
+    _file(tmp_path, "recente.mp3", 1)
+    referenced = {"referenciado.mp3", manifest_filename("b" * 64)}
+    expired = _expired_files(tmp_path, 24, referenced, limit=100)
+    assert expired == [(str(tmp_path / "antigo.mp3"), 7)]
+
+def test_atomic_write_leftovers_use_their_own_ttl(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "RECORDINGS_TMP_TTL_HOURS", 1)
+    _file(tmp_path, ".tts_abc.mp3.123.tmp", 2)
+    _file(tmp_path, "tts_def.mp3", 2)
+    assert [os.path.basename(path) for path, _ in _expired_files(tmp_path, 24, set(), limit=100)] == [".tts_abc.mp3.123.tmp"]
+
+def test_expired_files_respect_the_limit(tmp_path):
+    for number in range(5):
+        _file(tmp_path, f"antigo_{number}.mp3", 48)
+    assert len(_expired_files(tmp_path, 24, set(), limit=3)) == 3
@@ -0,0 +1,28 @@
+from models import Scenario, ScenarioSegment
+from services.narrative_service import ScenarioSegmentStore, split_scene_segments
+
+CONTENT = "Você chega ao portal da água.\nO que você faz?\n\nDepois disso?\nFim?"
+
+def _scenario(db, game_session, segmented: bool) -> Scenario:
+    scenario = Scenario(game_id=game_session.game_id, name="Cena 0A – Portal da Água", file_content=CONTENT, is_active=False)
+    db.add(scenario)
+    if segmented:
+        ScenarioSegmentStore(db).rebuild(scenario)
+    db.commit()
+    return scenario
+
+def test_segments_are_read_by_position(db, game_session):
+    scenario = _scenario(db, game_session, segmented=True)
+    store = ScenarioSegmentStore(db)
+    expected = split_scene_segments(CONTENT)
+    assert scenario.segment_count == len(expected)
+    assert [store.segment_at(scenario, index) for index in range(len(expected))] == expected
+    assert store.segment_at(scenario, len(expected)) is None
+
+def test_unsegmented_scene_is_split_in_memory_without_writes(db, game_session):
+    scenario = _scenario(db, game_session, segmented=False)
+    store = ScenarioSegmentStore(db)
+    assert store.segment_at(scenario, 0) == split_scene_segments(CONTENT)[0]
+    # A fase de leitura não grava nada: a sessão é fechada (rollback) antes da escrita do turno
+    assert not db.new and not db.dirty
+    assert db.query(ScenarioSegment).filter(ScenarioSegment.scenario_id == scenario.id).count() == 0
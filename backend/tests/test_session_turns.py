@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from services import session_turns as turns_module
+from services.session_turns import SessionTurnQueue, SessionBusyError, DuplicateTurnError
+
+@pytest.fixture
+def leases(monkeypatch):
+    """Concessões simuladas (sem Postgres): held guarda a sessão ocupada por outro worker"""
+    state = {"held": set(), "attempts": 0, "dropped": []}
+
+    def try_lease(session_id, token):
+        state["attempts"] += 1
+        return session_id not in state["held"]
+
+    monkeypatch.setattr(turns_module, "SESSION_TURN_LEASES", True)
+    monkeypatch.setattr(turns_module, "SESSION_TURN_LOCK_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(turns_module, "_try_lease", try_lease)
+    monkeypatch.setattr(turns_module, "_renew_lease", lambda session_id, token: None)
+    monkeypatch.setattr(turns_module, "_drop_lease", lambda session_id, token: state["dropped"].append(token))
+    return state
+
+def test_waiting_for_the_lease_does_not_hold_a_thread(leases):
+    leases["held"].add(1)
+
+    async def run():
+        # Uma única thread no pool: se a espera a ocupasse, a outra tarefa ficaria bloqueada
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waiting = asyncio.ensure_future(SessionTurnQueue().acquire(1))
+        await asyncio.sleep(0.05)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: "livre"), 0.5) == "livre"
+        leases["held"].discard(1)
+        slot = await asyncio.wait_for(waiting, 1)
+        await slot.release()
+        return slot
+
+    slot = asyncio.run(run())
+    assert leases["attempts"] > 2
+    assert leases["dropped"] == [slot.token]
+
+def test_lease_wait_stops_at_the_deadline(leases, monkeypatch):
+    monkeypatch.setattr(turns_module, "SESSION_TURN_WAIT_TIMEOUT", 0.1)
+    leases["held"].add(1)
+    queue = SessionTurnQueue()
+
+    async def run():
+        with pytest.raises(SessionBusyError):
+            await queue.acquire(1)
+
+    asyncio.run(run())
+    assert queue._queues == {}
+
+def test_pool_timeout_is_reported_as_busy(monkeypatch):
+    def exhausted(*args, **kwargs):
+        raise PoolTimeoutError("QueuePool limit reached")
+
+    monkeypatch.setattr(turns_module.engine, "begin", exhausted)
+    with pytest.raises(SessionBusyError):
+        turns_module._try_lease(1, "token")
+
+def test_only_the_same_request_id_is_a_duplicate():
+    queue = SessionTurnQueue()
+
+    async def run():
+        first = await queue.acquire(1, "pedido-1")
+        with pytest.raises(DuplicateTurnError):
+            queue.check(1, "pedido-1")
+        # Mesma jogada sem id (ou com outro id) entra na fila
+        queue.check(1, None)
+        queue.check(1, "pedido-2")
+        await first.release()
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+import asyncio
+import io
+import wave
+import pytest
+from services import speech_pipeline
+from services.speech_pipeline import transcribe, get_recognizer, STT_LOCAL_TEXT, UNRECOGNIZED_TEXT
+
+def _wav(frames: int, rate: int = 16000, channels: int = 2) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as output:
+        output.setnchannels(channels)
+        output.setsampwidth(2)
+        output.setframerate(rate)
+        output.writeframes(b"\x01\x00" * channels * frames)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("decode_workers", [0, 1])
+def test_local_backend_transcribes_from_memory(monkeypatch, decode_workers):
+    # 0 decodifica numa thread; 1 usa o pool de processos (spawn), como em produção
+    monkeypatch.setattr(speech_pipeline, "STT_DECODE_WORKERS", decode_workers)
+    try:
+        transcription = asyncio.run(transcribe(_wav(1600), "wav", backend="local"))
+    finally:
+        speech_pipeline.shutdown_decode_pool()
+    assert transcription.text == STT_LOCAL_TEXT
+    assert transcription.backend == "local"
+    assert transcription.total_ms >= transcription.decode_ms
+    timing = transcription.server_timing()
+    assert "stt-decode;dur=" in timing and 'desc="local"' in timing and "stt-total;dur=" in timing
+
+def test_empty_audio_is_not_recognized(monkeypatch):
+    monkeypatch.setattr(speech_pipeline, "STT_DECODE_WORKERS", 0)
+    transcription = asyncio.run(transcribe(_wav(0), "wav", backend="local"))
+    assert transcription.text == UNRECOGNIZED_TEXT
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        get_recognizer("whisper-inexistente")
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import pytest
+from services import tts_cache as tts_cache_module
+from services.tts_cache import TTSCache, tts_cache_key, tts_filename
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+def _key_in_new_process(hash_seed: str) -> str:
+    code = "from services.tts_cache import tts_cache_key; print(tts_cache_key('Bem-vindo ao reino de Eterrea!', 'pt'))"
+    env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+    return subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout.strip()
+
+def test_cache_key_is_stable_across_processes():
+    # hash() muda a cada processo; o nome do arquivo precisa ser o mesmo em todos os workers
+    expected = tts_cache_key("Bem-vindo ao reino de Eterrea!", "pt")
+    assert _key_in_new_process("1") == expected
+    assert _key_in_new_process("2") == expected
+
+def test_cache_key_depends_on_text_language_and_voice():
+    key = tts_cache_key("Olá", "pt")
+    assert tts_cache_key("Olá!", "pt") != key
+    assert tts_cache_key("Olá", "en") != key
+    assert tts_cache_key("Olá", "pt", voice="com.br") != key
+    assert len(key) == 64
+
+def test_concurrent_requests_share_one_synthesis(monkeypatch, tmp_path):
+    synthesized = []
+
+    def fake_synthesize(text, lang, path):
+        synthesized.append(text)
+        time.sleep(0.05)
+        path.write_bytes(b"ID3mp3")
+
+    monkeypatch.setattr(tts_cache_module, "_synthesize", fake_synthesize)
+    cache = TTSCache()
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_synthesize("Uma frase.", "pt", tmp_path) for _ in range(5)])
+
+    paths = asyncio.run(run())
+    assert synthesized == ["Uma frase."]
+    assert set(paths) == {tmp_path / tts_filename(tts_cache_key("Uma frase.", "pt"))}
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 4 and stats["inflight"] == 0
+    # Em disco: a próxima consulta não sintetiza de novo
+    asyncio.run(cache.get_or_synthesize("Uma frase.", "pt", tmp_path))
+    assert synthesized == ["Uma frase."]
+    assert cache.stats()["disk_hits"] == 1
+
+def test_failed_synthesis_is_not_cached(monkeypatch, tmp_path):
+    def failing_synthesize(text, lang, path):
+        raise RuntimeError("gTTS indisponível")
+
+    monkeypatch.setattr(tts_cache_module, "_synthesize", failing_synthesize)
+    cache = TTSCache()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(cache.get_or_synthesize("Outra frase.", "pt", tmp_path))
+    assert cache.stats()["errors"] == 2
+    assert list(tmp_path.iterdir()) == []
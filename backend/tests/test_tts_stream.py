@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from services import tts_cache as tts_cache_module
+from services.tts_cache import tts_cache_key, tts_filename
+from services.tts_stream import (
+    split_sentences, build_manifest, save_manifest, load_manifest, manifest_playlist, start_narration, stream_manifest,
+    TTS_CHUNK_MIN_CHARS,
+)
+
+NARRATION = (
+    "Bem-vindos ao reino! "
+    "O portal da água brilha diante de vocês, e uma brisa fria sopra do outro lado. "
+    "Ao longe, o Sábio Galhar acena. Ele parece esperar por alguém. "
+    "O que vocês fazem?"
+)
+
+def test_first_chunk_is_a_single_sentence():
+    chunks = split_sentences(NARRATION)
+    assert chunks[0] == "Bem-vindos ao reino!"
+    assert " ".join(chunks) == " ".join(NARRATION.split())
+
+def test_short_sentences_are_grouped_up_to_the_minimum():
+    chunks = split_sentences(NARRATION)
+    assert all(len(chunk) >= TTS_CHUNK_MIN_CHARS for chunk in chunks[1:-1])
+
+@pytest.mark.parametrize("text", ["", "   ", "\n\n"])
+def test_empty_text_has_no_chunks(text):
+    assert split_sentences(text) == []
+
+def test_line_breaks_split_sentences():
+    assert split_sentences("Primeira linha\nSegunda linha") == ["Primeira linha", "Segunda linha"]
+
+def test_manifest_round_trip(tmp_path):
+    manifest = build_manifest(NARRATION, "pt")
+    # Endereçado pelo conteúdo: a mesma narração gera o mesmo id
+    assert build_manifest(NARRATION, "pt")["id"] == manifest["id"]
+    assert build_manifest(NARRATION + " Fim.", "pt")["id"] != manifest["id"]
+    save_manifest(tmp_path, manifest)
+    assert load_manifest(tmp_path, manifest["id"]) == manifest
+    playlist = manifest_playlist(manifest)
+    assert playlist["stream_url"] == f"/api/audio/stream/{manifest['id']}"
+    assert [chunk["url"] for chunk in playlist["chunks"]] == [
+        f"/api/audio/{tts_filename(tts_cache_key(chunk['text'], 'pt'))}" for chunk in manifest["chunks"]
+    ]
+
+@pytest.mark.parametrize("manifest_id", ["../segredo", "0" * 63, "f" * 64])
+def test_invalid_or_missing_manifest_is_not_loaded(tmp_path, manifest_id):
+    assert load_manifest(tmp_path, manifest_id) is None
+
+def test_stream_concatenates_chunks_in_order(monkeypatch, tmp_path):
+    def fake_synthesize(text, lang, path):
+        path.write_bytes(text.encode("utf-8"))
+
+    monkeypatch.setattr(tts_cache_module, "_synthesize", fake_synthesize)
+
+    async def run():
+        manifest = await start_narration(NARRATION, "pt", tmp_path)
+        return b"".join([data async for data in stream_manifest(load_manifest(tmp_path, manifest["id"]), tmp_path)])
+
+    assert asyncio.run(run()).decode("utf-8") == "".join(split_sentences(NARRATION))
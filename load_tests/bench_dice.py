@@ -0,0 +1,79 @@
+"""Benchmark da fase de leitura da rolagem de dados.
+
+Compara, no mesmo processo e no mesmo banco, o caminho rápido da rolagem ("rolar dados")
+com o trabalho feito antes a cada rolagem: o pipeline completo de um turno do narrador
+(regras, histórico, perfil e prompt de sistema) mais a extração das Seções 5/6 do arquivo de regras.
+Nada é gravado:
+a fase de leitura fecha a sessão do banco sem commit.
+
+Uso (a partir da raiz do projeto, com o banco do backend acessível):
+    BENCH_SESSION_ID=123 python load_tests/bench_dice.py
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from database import SessionLocal  # noqa: E402
+from models import GameSession, User  # noqa: E402
+from schemas import InteractionCreate  # noqa: E402
+from routers.game import _prepare_turn  # noqa: E402
+from services.dice_roll import shadow_light_texts  # noqa: E402
+from services.game_catalog import get_game_catalog  # noqa: E402
+
+SESSION_ID = int(os.getenv("BENCH_SESSION_ID", "0"))
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "200"))
+WARMUP = int(os.getenv("BENCH_WARMUP", "10"))
+DICE_INPUT = "rolar dados"
+NARRATOR_INPUT = os.getenv("BENCH_NARRATOR_INPUT", "Seguimos em frente")
+
+
+def load_player(session_id):
+    db = SessionLocal()
+    try:
+        session = db.query(GameSession).filter(GameSession.id == session_id).first()
+        if not session:
+            raise SystemExit(f"Sessão {session_id} não encontrada. Informe BENCH_SESSION_ID.")
+        user = db.query(User).filter(User.id == session.player_id).first()
+        db.expunge(user)
+        return user, get_game_catalog(db, session.game_id).rules_file_content
+    finally:
+        db.close()
+
+
+def measure(user, player_input, rules_content=None):
+    interaction = InteractionCreate(session_id=SESSION_ID, player_input=player_input, player_input_type="text")
+    samples = []
+    for iteration in range(WARMUP + ITERATIONS):
+        db = SessionLocal()
+        started = time.perf_counter()
+        try:
+            _prepare_turn(interaction, db, user)
+            if rules_content is not None:
+                shadow_light_texts(rules_content)
+        finally:
+            db.close()
+        if iteration >= WARMUP:
+            samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "mean": statistics.mean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def main():
+    user, rules_content = load_player(SESSION_ID)
+    full = measure(user, NARRATOR_INPUT, rules_content)
+    dice = measure(user, DICE_INPUT)
+    print(f"{'caminho':<28}{'média (ms)':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+    for label, result in (("pipeline completo (antes)", full), ("rolagem rápida", dice)):
+        print(f"{label:<28}{result['mean']:>12.2f}{result['p50']:>12.2f}{result['p95']:>12.2f}")
+    print(f"redução do p50: {(1 - dice['p50'] / full['p50']) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
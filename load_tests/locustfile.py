@@ -3,6 +3,22 @@ import uuid
 import random
 from locust import HttpUser, task, between
 
+# Pesos das tarefas: rolagem de dados (sem LLM) e fala livre com o narrador (passa pela LLM).
+# Para rodar sem rede, ative no admin uma configuração de LLM com provider "local".
+DICE_WEIGHT = int(os.getenv("LOCUST_DICE_WEIGHT", "1"))
+NARRATOR_WEIGHT = int(os.getenv("LOCUST_NARRATOR_WEIGHT", "3"))
+# Usa /api/game/interact/stream (SSE) na fala com o narrador
+NARRATOR_STREAM = os.getenv("LOCUST_NARRATOR_STREAM", "false").lower() == "true"
+NARRATOR_INPUTS = [
+    "Jogador 1: Ana, 10 anos",
+    "Quero explorar a floresta",
+    "Escolho o elemento água",
+    "Vamos falar com o guardião do portal",
+    "O que tem atrás da porta?",
+    "Quero saber mais sobre a história do reino",
+    "Seguimos em frente",
+]
+
 
 class GameLoadUser(HttpUser):
     wait_time = between(2, 5)
@@ -94,24 +110,42 @@ class GameLoadUser(HttpUser):
 
         self.ready = True
 
-    @task
+    @task(DICE_WEIGHT)
     def interact_and_save_status(self):
         if not self.ready or not self.session_ids:
             return
+        self._interact("rolar dados", "/api/game/interact")
+
+    @task(NARRATOR_WEIGHT)
+    def talk_to_narrator(self):
+        if not self.ready or not self.session_ids:
+            return
+        player_input = random.choice(NARRATOR_INPUTS)
+        if NARRATOR_STREAM:
+            self._interact(player_input, "/api/game/interact/stream", stream=True)
+        else:
+            self._interact(player_input, "/api/game/interact [narrador]")
+
+    def _interact(self, player_input, name, stream=False):
         session_id = random.choice(self.session_ids)
         payload = {
             "session_id": session_id,
-            "player_input": "rolar dados",
+            "player_input": player_input,
             "player_input_type": "text",
             "include_audio_response": False,
         }
         with self.client.post(
-            "/api/game/interact",
+            "/api/game/interact/stream" if stream else "/api/game/interact",
             json=payload,
             headers=self.headers,
-            name="/api/game/interact",
+            name=name,
             catch_response=True,
         ) as response:
+            if stream and response.status_code == 200:
+                # Erros do stream chegam como evento "error" depois do status 200
+                if "event: error" in response.text:
+                    response.failure(response.text.split("event: error", 1)[1][:200])
+                return
             if response.status_code != 200:
                 detail = ""
                 try: